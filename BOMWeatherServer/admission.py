@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from collections import OrderedDict
+from threading import Lock
+import math
+import time
+
+
+# =============================================================================
+
+
+SHED_SHARE = 0.5            # share of the in-flight budget beyond which new places and waits are refused
+BUSY_RETRY = 1              # seconds a request refused for want of capacity is asked to wait
+MAX_CLIENTS = 4096          # clients whose rates are tracked, the least recently seen forgotten first
+REGISTRATION_WINDOW = 60    # seconds over which each client's new places are capped
+
+
+# =============================================================================
+
+
+class Refused(Exception):
+    """
+    a request turned away - 503 while the server is too busy, 429 while the client is over its limits
+    """
+    def __init__(self, code, reason, retry_after, cause):
+        super(Refused, self).__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.retry_after = retry_after  # whole seconds
+        self.cause = cause              # metrics label: busy, shed, rate or places
+        return
+
+
+def server_busy():
+    return Refused(503, "server busy, try again later", BUSY_RETRY, "busy")
+
+
+# =============================================================================
+
+
+class TokenBucket(object):
+    """
+    allows rate tokens a second on average, and up to burst at once
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, time_now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time_now
+        return
+
+    def take(self, time_now):
+        """
+        :return: 0 if a token was taken, else seconds until one will be
+        """
+        self.tokens = min(self.burst, self.tokens + (time_now - self.updated) * self.rate)
+        self.updated = time_now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# =============================================================================
+
+
+class AdmissionControl(object):
+    """
+    decides which requests are served, so a flood of them (i.e. clients all reconnecting after an outage)
+    is turned away quickly rather than queueing up behind one another.
+    Load is the requests being served plus those waiting for a worker. Past half the budget, requests that would
+    register new places or wait on first fetches are refused, so requests for weather already in hand are served
+    until the budget is spent.
+    """
+    def __init__(self, max_inflight, client_rate, client_burst, client_places, clock=time.monotonic):
+        """
+        :param max_inflight: max requests served or waiting at once, 0 for no limit
+        :param client_rate: requests per second allowed each client on average, 0 for no limit
+        :param client_burst: requests each client may make at once
+        :param client_places: new places each client may register per REGISTRATION_WINDOW, 0 for no limit
+        :param clock: returns the current time, in seconds
+        """
+        self.max_inflight = max_inflight
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.client_places = client_places
+        self.clock = clock
+        self.lock = Lock()
+        self.inflight = 0           # requests being served
+        self.queued = 0             # connections (or requests) waiting for a worker
+        self.clients = OrderedDict()    # {client:[request TokenBucket, registration TokenBucket]}, in order seen
+        return
+
+    def enqueue(self, limited=True):
+        """
+        count a connection (or request) now waiting for a worker
+
+        :param limited: False => exempt from the budget, i.e. for metrics and health checks
+        :return: False => the budget is spent, so it's to be refused straight off rather than left waiting
+        """
+        with self.lock:
+            if limited and self.max_inflight > 0 and self.inflight + self.queued >= self.max_inflight:
+                return False
+            self.queued += 1
+        return True
+
+    def dequeue(self):
+        # a worker has taken it up
+        with self.lock:
+            self.queued -= 1
+        return
+
+    def load(self):
+        return self.inflight + self.queued
+
+    def busy(self):
+        """
+        :return: True => requests are waiting for a worker, so keep-alive connections should give theirs up
+        """
+        return self.queued > 0
+
+    def shedding(self):
+        """
+        :return: True => past the share of the budget where costly requests are refused
+        """
+        return self.max_inflight > 0 and self.load() >= self.max_inflight * SHED_SHARE
+
+    def _buckets(self, client, time_now):
+        # NOTE: call with lock held
+        buckets = self.clients.get(client)
+        if buckets is None:
+            buckets = [TokenBucket(self.client_rate, self.client_burst, time_now),
+                       TokenBucket(self.client_places / REGISTRATION_WINDOW, self.client_places, time_now)]
+            self.clients[client] = buckets
+            if len(self.clients) > MAX_CLIENTS:
+                self.clients.popitem(last=False)
+        else:
+            self.clients.move_to_end(client)
+        return buckets
+
+    def begin(self, client, limited=True):
+        """
+        admit a request, which must be ended once served
+
+        :param client: the client's address, None if not over the network
+        :param limited: False => exempt from the budget and the client's rate, i.e. for metrics and health checks
+        :raise Refused: too busy, or the client is over its rate
+        """
+        with self.lock:
+            if limited:
+                if self.max_inflight > 0 and self.inflight + self.queued >= self.max_inflight:
+                    raise server_busy()
+                if client is not None and self.client_rate > 0:
+                    time_now = self.clock()
+                    wait = self._buckets(client, time_now)[0].take(time_now)
+                    if wait:
+                        raise Refused(429, "too many requests, slow down", max(1, math.ceil(wait)), "rate")
+            self.inflight += 1
+        return
+
+    def end(self):
+        with self.lock:
+            self.inflight -= 1
+        return
+
+    def admit_registration(self, client):
+        """
+        admit a request that would register a new place
+
+        :param client: the client's address, None if not over the network
+        :raise Refused: too busy to take on new places, or the client has registered its share lately
+        """
+        if self.shedding():
+            raise Refused(503, "server busy, not taking on new places, try again later", BUSY_RETRY, "shed")
+        if client is None or self.client_places <= 0:
+            return
+        time_now = self.clock()
+        with self.lock:
+            wait = self._buckets(client, time_now)[1].take(time_now)
+        if wait:
+            raise Refused(429, f"too many new places, at most {self.client_places} a minute",
+                          max(1, math.ceil(wait)), "places")
+        return
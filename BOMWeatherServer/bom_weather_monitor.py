@@ -1,179 +1,1077 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-from dateutil import parser as du_parser
-from ftplib import FTP
 from periodic import Periodic
-from threading import Thread, Lock
-import io
+from scheduler import Scheduler
+from threading import Condition, Lock, Thread
+from urllib.parse import urlsplit
+import ftplib
 import json
-import requests
+import math
+import random
 import time
-import untangle
 
 
 from BOMWeatherServer.weather_pending import WeatherPending
-from BOMWeatherServer.urls import OBSERVATION_URL, FORECAST_HOST, FORECAST_PATH
+from BOMWeatherServer.circuit_breaker import CircuitBreaker
+from BOMWeatherServer.forecast_parser import AreaNotFound, parse_product_areas, split_area_place
+from BOMWeatherServer.ftp_pool import FTPPool
+from BOMWeatherServer.history import HISTORY_FIELDS, ObservationHistory
+from BOMWeatherServer.metrics import DATA_AGE, FETCH_DURATION, LOCK_WAIT, PARSE_DURATION, PEER_FETCHES, \
+    PLACES_EVICTED, PLACES_TRACKED, STAGE_DURATION, UPSTREAM_ERRORS, UPSTREAM_SUSPENDED, TimedLock
+from BOMWeatherServer.partial_json import leading_records
+from BOMWeatherServer.peers import PEER_LAG, PEER_WAIT, PeerUnavailable, Peers
+from BOMWeatherServer.records import ABSENT, BOM_ICONS, BLANK_ICON, ICON_CODES, MISSING, NO_ICON, Forecast, \
+    ObservationRecord, TrackedPlace, present, weather_results
+from BOMWeatherServer.refresh import ObservationTiming, backoff_refresh, next_refresh
+from BOMWeatherServer.snapshot import save_snapshot
+from BOMWeatherServer.timestamps import parse_timestamp
+from BOMWeatherServer.urls import OBSERVATION_URL, FORECAST_HOST, FORECAST_PORT, FORECAST_PATH
+
+
+# =============================================================================
+
+
+OBSERVATION_TIMEOUT = (10, 30)      # (connect, read) seconds
+OBSERVATION_DEADLINE = 60           # seconds a whole download may take, however steadily it trickles in
+DOWNLOAD_CHUNK = 64 * 1024
+PENDING_RETRY = 2                   # seconds a first fetch is expected to take
+FORECAST_AREA = 2                   # index of the product's forecast area serving places not naming an area
 
 
 # =============================================================================
 
 
 class BOMWeatherMonitor(Thread):
-    BOM_ICONS = {
-        '1': "sunny",
-        '2': "clear",
-        '3': "partly-cloudy",
-        '3n': "partly-cloudy-night",
-        '4': "cloudy",
-        '6': "haze",
-        '6n': "haze-night",
-        '8': "light-rain",
-        '9': "wind",
-        '10': "fog",
-        '10n': "fog-night",
-        '11': "showers",
-        '11n': "showers-night",
-        '12': "rain",
-        '13': "dust",
-        '14': "frost",
-        '15': "snow",
-        '16': "storm",
-        '17': "light-showers",
-        '17n': "light-showers-night",
-        '18': "heavy-showers",
-        '19': "tropicalcyclone"
-    }
+    BOM_ICONS = BOM_ICONS
 
     def __init__(self, my_args, my_globals, observation_interval, forecast_interval):
         super(BOMWeatherMonitor, self).__init__()
-        self.weather_lock = Lock()
+        self.weather_lock = TimedLock(LOCK_WAIT)
         self.my_args = my_args
         self.globals = my_globals
         self.observation_interval = observation_interval
         self.forecast_interval = forecast_interval
+        # NOTE: weather is published as immutable (version, data) tuples, swapped in whole under weather_lock.
+        # Readers take a tuple without the lock, and must never modify its data.
         self.forecast_to_observation = {}
-        self.observation = {}       # {observation_place:{observation={temp_now:<float>}, periodic=Periodic}}
-        self.forecast = {}          # {forecast_place:{forecast={}, periodic=Periodic}}
+        self.observation = {}       # {observation_place:TrackedPlace, published=(<int>, ObservationRecord)}
+        self.forecast = {}          # {forecast_place:TrackedPlace, published=(<int>, Forecast)}
+        self.products = {}          # {forecast product:TrackedPlace, areas={area key:Forecast}}
+        self.eviction_listeners = []    # callables taking (kind, place), called with weather_lock held
+        self.last_version = 0       # bumped on every data write, under weather_lock
+        self.updated = Condition(self.weather_lock)     # notified whenever last_version is bumped
+        # noinspection PyUnresolvedReferences
+        self.scheduler = Scheduler(my_args.fetch_workers)
+        # noinspection PyUnresolvedReferences
+        self.ftp_pool = FTPPool(FORECAST_HOST, FORECAST_PORT, my_args.fetch_workers)
+        self.session_lock = Lock()
+        self.http_session = None    # requests.Session, made for the first observation fetch
+        # one per BoM server, so a server that's down doesn't hold up fetches from the other
+        # noinspection PyUnresolvedReferences
+        self.breakers = dict(
+            observation=CircuitBreaker(urlsplit(OBSERVATION_URL).netloc, my_args.breaker_threshold,
+                                       my_args.breaker_reset),
+            forecast=CircuitBreaker(FORECAST_HOST, my_args.breaker_threshold, my_args.breaker_reset))
+        # the nodes sharing fetches in peer mode, None when fetching every place from the BoM
+        # noinspection PyUnresolvedReferences
+        self.peers = Peers(my_args.peers, my_args.node, my_args.breaker_threshold, my_args.breaker_reset) \
+            if my_args.peers else None
+        DATA_AGE.collect = self._data_ages
+        PLACES_TRACKED.collect = lambda: {("observation",): len(self.observation), ("forecast",): len(self.forecast),
+                                          ("forecast_product",): len(self.products)}
+        UPSTREAM_SUSPENDED.collect = lambda: {(kind,): int(breaker.is_open())
+                                              for kind, breaker in self.breakers.items()}
+        return
+
+    def _data_ages(self):
+        """
+        :return: {(kind, place):seconds since last fetched} for the metrics endpoint
+        """
+        time_now = time.time()
+        with self.weather_lock:
+            ages = {("observation", place): time_now - info.fetched
+                    for place, info in self.observation.items() if info.fetched}
+            ages.update({("forecast", place): time_now - info.fetched
+                         for place, info in self.forecast.items() if info.fetched})
+        return ages
+
+    def _next_version(self):
+        # NOTE: call with weather_lock held
+        self.last_version += 1
+        self.updated.notify_all()
+        return self.last_version
+
+    def _publish(self, place_info, data):
+        # NOTE: call with weather_lock held
+        place_info.published = (self._next_version(), data)
+        return
+
+    def wait_for_update(self, since, timeout):
+        """
+        wait for any place's data to change
+
+        :param since: the data version last seen, None => don't wait
+        :param timeout: max seconds to wait
+        :return: (current data version, True => changed since the given version)
+        """
+        with self.weather_lock:
+            if since is None:
+                return self.last_version, True
+            self.updated.wait_for(lambda: self.last_version != since or not self.globals.running, timeout)
+            return self.last_version, self.last_version != since
+
+    def _in_demand(self, place_info):
+        """
+        check a place has been requested lately, and if not, stop refreshing it until it is
+
+        NOTE: call with weather_lock held
+        :return: True => place should be refreshed
+        """
+        # noinspection PyUnresolvedReferences
+        if place_info.fetched and time.time() - place_info.touched > self.my_args.demand_window:
+            place_info.dormant = True
+            self.scheduler.remove(place_info.periodic)
+            return False
+        return True
+
+    def _wake(self, registry, place):
+        """
+        resume refreshing a dormant place, starting straight away
+        """
+        with self.weather_lock:
+            place_info = registry.get(place)
+            if place_info is not None and place_info.dormant:
+                place_info.dormant = False
+                self.scheduler.add(place_info.periodic, place)
+        return
+
+    def _refresh_observation(self, place_info, records):
+        """
+        schedule an observation's next refresh for when its next record is due
+
+        NOTE: call with weather_lock held
+        :param records: newest records just fetched, None if unchanged
+        """
+        time_now = time.time()
+        timing = place_info.timing
+        if records:
+            try:
+                timing.update(records, place_info.fetched, self.observation_interval, time_now)
+            except (KeyError, ValueError) as ex:
+                print(f"Error: observation record time {type(ex)}/{ex}")
+        # noinspection PyUnresolvedReferences
+        place_info.periodic.reschedule(next_refresh(timing.expected(), self.observation_interval,
+                                                       self.my_args.max_refresh, time_now))
+        return
+
+    @staticmethod
+    def _next_issue(amoc):
+        try:
+            return parse_timestamp(amoc["next-routine-issue-time-utc"])
+        except (KeyError, TypeError, ValueError):
+            # no routine issue planned, or not one we understand
+            return None
+
+    def _refresh_forecast(self, place_info):
+        """
+        schedule a forecast's next refresh for its next routine issue
+
+        NOTE: call with weather_lock held
+        """
+        # noinspection PyUnresolvedReferences
+        place_info.periodic.reschedule(next_refresh(place_info.next_issue, self.forecast_interval,
+                                                       self.my_args.max_refresh, time.time()))
+        return
+
+    def _fetch_failed(self, registry, kind, place, interval, reason, server_fault=False):
+        """
+        count a failed fetch against a place, and back off its refreshes until one succeeds
+
+        :param server_fault: True => the server failed rather than just this place,
+        which is left to the server's circuit breaker, so the place resumes as soon as the server does
+        """
+        UPSTREAM_ERRORS.inc(kind, place)
+        print(f"Error: {kind} {place} {reason}")
+        with self.weather_lock:
+            place_info = registry.get(place)
+            if place_info is not None:
+                place_info.failures += 1
+                failures = 1 if server_fault else place_info.failures
+                # noinspection PyUnresolvedReferences
+                place_info.periodic.reschedule(backoff_refresh(failures, interval, self.my_args.max_refresh,
+                                                               time.time()))
         return
 
+    def _suspended(self, registry, place, breaker, interval):
+        """
+        put off a place's refresh while fetches from its server are suspended
+        """
+        with self.weather_lock:
+            place_info = registry.get(place)
+            if place_info is not None:
+                # spread out, so the places don't all pile in once fetches resume
+                place_info.periodic.reschedule(breaker.retry_time() + random.uniform(0, interval))
+        return
+
+    def _session(self):
+        """
+        :return: the requests.Session observations are fetched with
+        """
+        # requests takes a while to import (seconds on a Pi), so is left until there's something to fetch
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self.session_lock:
+            if self.http_session is None:
+                # one pooled connection per fetch worker, to the BoM and to each peer
+                session = requests.Session()
+                # noinspection PyUnresolvedReferences
+                adapter = HTTPAdapter(pool_connections=1 + len(self.peers.breakers if self.peers else ()),
+                                      pool_maxsize=self.my_args.fetch_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.http_session = session
+            return self.http_session
+
+    def _download(self, url, headers):
+        """
+        :return: (response, content), content read in full within OBSERVATION_DEADLINE
+        :raise requests.RequestException: failed, or took too long
+        """
+        import requests
+        deadline = time.time() + OBSERVATION_DEADLINE
+        chunks = []
+        with self._session().get(url, headers=headers, timeout=OBSERVATION_TIMEOUT, stream=True) as resp:
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                if time.time() > deadline:
+                    raise requests.Timeout(f"download took over {OBSERVATION_DEADLINE}s")
+                chunks.append(chunk)
+        return resp, b"".join(chunks)
+
     def get_observation(self, observation_place):
+        import requests
         # noinspection PyUnresolvedReferences
         if self.my_args.verbose:
             print(f"Getting observation for {observation_place}")
         url = OBSERVATION_URL.format(observation_place, observation_place)
+        with self.weather_lock:
+            place_info = self.observation.get(observation_place)
+            if place_info is None:
+                # evicted since this fetch was scheduled
+                return
+            if not self._in_demand(place_info):
+                return
+            validators = place_info.validators
+            history = place_info.history
+            peer_etag = place_info.peer_etag
+            since = history.high_water() if history is not None else MISSING
+        owner = self.peers and self.peers.owner(observation_place)
+        if owner and self._observation_from_peer(owner, observation_place, peer_etag,
+                                                 since if present(since) else None):
+            return
+        breaker = self.breakers["observation"]
+        if not breaker.allow():
+            self._suspended(self.observation, observation_place, breaker, self.observation_interval)
+            return
+        headers = {}
+        if history is None or present(since):
+            # not while the history is empty (i.e. restored from a snapshot, which doesn't hold it),
+            # as a 304 would leave it so until the next new record
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last_modified" in validators:
+                headers["If-Modified-Since"] = validators["last_modified"]
+        try:
+            with FETCH_DURATION.time("observation", observation_place), STAGE_DURATION.time("observation_download"):
+                resp, content = self._download(url, headers)
+        except requests.RequestException as ex:
+            breaker.record_failure()
+            self._fetch_failed(self.observation, "observation", observation_place, self.observation_interval,
+                               f"{type(ex)}/{ex}", server_fault=True)
+            return
+        server_fault = resp.status_code >= 500
+        if server_fault:
+            breaker.record_failure()
+        else:
+            # the server is up, whether or not it has this place
+            breaker.record_success()
         try:
-            resp = requests.get(url)
-            if resp:
-                # observations typically contains many (hundreds, perhaps),
-                # lets just grab the current observation.
-                content_json = resp.content
-                content = json.loads(content_json)
-                observation = content["observations"]["data"][0]
+            if resp.status_code == 304:
+                # not modified since the last fetch, nothing to do
                 with self.weather_lock:
-                    self.observation[observation_place]["observation"]["temp_now"] = observation["air_temp"]
+                    place_info = self.observation.get(observation_place)
+                    if place_info is not None:
+                        self._mark_fetched(place_info)
+                        self._refresh_observation(place_info, None)
+                return
+            if not resp:
+                self._fetch_failed(self.observation, "observation", observation_place, self.observation_interval,
+                                   f"HTTP {resp.status_code}", server_fault)
+                return
+            # observations typically contains many (hundreds, perhaps), newest first.
+            # lets just decode those newer than the history holds, and at least the current observation
+            # and the one before for its cadence.
+            wanted = history.is_newer if history is not None else lambda record: False
+            with PARSE_DURATION.time("observation", observation_place), STAGE_DURATION.time("observation_decode"):
+                records, num_new = leading_records(content.decode("utf8"), ("observations", "data"), wanted, 2)
+            observation = records[0]
+            validators = {}
+            if "ETag" in resp.headers:
+                validators["etag"] = resp.headers["ETag"]
+            if "Last-Modified" in resp.headers:
+                validators["last_modified"] = resp.headers["Last-Modified"]
+            with self.weather_lock:
+                place_info = self.observation.get(observation_place)
+                if place_info is None:
+                    return
+                place_info.validators = validators
+                if place_info.history is not None:
+                    place_info.history.merge(records[:num_new])
+                self._refresh_observation(place_info, records)
+                self._mark_fetched(place_info)
+                _, published = place_info.published
+                if published.temp_now != observation["air_temp"]:
+                    self._publish(place_info, published.replace(temp_now=observation["air_temp"]))
         except Exception as ex:
-            print(f"Error: {type(ex)}/{ex}")
+            # i.e. a product we can't make sense of
+            self._fetch_failed(self.observation, "observation", observation_place, self.observation_interval,
+                               f"{type(ex)}/{ex}")
         return
 
     @staticmethod
     def _decode_elements(forecast_elements, timestamp=None):
-        info = {}
-        # NOTE: sometimes this is a single dict, other times it's a list of dicts.
-        if "type" in forecast_elements:
-            # it's a single dict
-            if forecast_elements["type"] == "forecast_icon_code":
-                icon_code = forecast_elements.cdata
-                info["icon_name"] = BOMWeatherMonitor.BOM_ICONS.get(icon_code, "blank")
-            elif forecast_elements["type"] == "air_temperature_maximum":
-                info["temp_max"] = float(forecast_elements.cdata)
-            elif forecast_elements["type"] == "air_temperature_minimum":
-                info["temp_min"] = float(forecast_elements.cdata)
-        else:
-            # it's an array of dicts
-            for thisElement in forecast_elements:
-                if thisElement["type"] == "forecast_icon_code":
-                    icon_code = str(thisElement.cdata)
-                    info["icon_name"] = BOMWeatherMonitor.BOM_ICONS.get(icon_code, "blank")
-                elif thisElement["type"] == "air_temperature_maximum":
-                    info["temp_max"] = float(thisElement.cdata)
-                elif thisElement["type"] == "air_temperature_minimum":
-                    info["temp_min"] = float(thisElement.cdata)
-        if timestamp:
-            d = du_parser.parse(timestamp)
-            this_time = time.mktime(d.timetuple()) + d.microsecond / 1E6
-            info["timestamp"] = this_time
-        return info
-
-    def get_forecast(self, forecast_place):
+        """
+        :return: (icon number, min temperature, max temperature, timestamp), NO_ICON/MISSING where absent
+        """
+        icon = NO_ICON
+        temp_min = temp_max = MISSING
+        for thisElement in forecast_elements:
+            element_type = thisElement.get("type")
+            if element_type == "forecast_icon_code":
+                icon = ICON_CODES.get(thisElement.text.strip(), BLANK_ICON)
+            elif element_type == "air_temperature_maximum":
+                temp_max = float(thisElement.text)
+            elif element_type == "air_temperature_minimum":
+                temp_min = float(thisElement.text)
+        return icon, temp_min, temp_max, parse_timestamp(timestamp) if timestamp else MISSING
+
+    @staticmethod
+    def _index_areas(areas):
+        """
+        :param areas: list of (area AAC, area description, list of decoded periods)
+        :return: {area key:Forecast} - keyed by AAC and by description, and "" for the default area
+        """
+        index = {}
+        for position, (aac, description, periods) in enumerate(areas):
+            forecast = Forecast(periods)
+            if position == FORECAST_AREA:
+                index[""] = forecast
+            for key in (aac, description):
+                if key:
+                    index.setdefault(key.upper(), forecast)
+        return index
+
+    @staticmethod
+    def _today(forecast):
+        """
+        today's forecast is mixed in with the general forecast
+        we regard today's forecast as part of the observation
+
+        :return: {icon, temp_min, temp_max} of today's forecast, where present
+        """
+        forecast_today = {}
+        if len(forecast):
+            icon, temp_min, temp_max, _ = forecast.period(0)
+            if icon != NO_ICON:
+                forecast_today["icon"] = icon
+            if present(temp_min):
+                forecast_today["temp_min"] = temp_min
+            if present(temp_max):
+                forecast_today["temp_max"] = temp_max
+        return forecast_today
+
+    def _publish_area(self, forecast_place, place_info):
+        """
+        publish a forecast place's area from its product, once the product has been fetched
+
+        NOTE: call with weather_lock held
+        """
+        product_info = place_info.product
+        if not product_info.fetched:
+            return
+        forecast = product_info.areas.get(split_area_place(forecast_place)[1])
+        if forecast is None:
+            # no such area in the product, which is left unfetched so its requests are refused
+            return
+        self._mark_fetched(place_info)
+        # only bump versions on real changes, so cached encodings stay valid across unchanged refreshes
+        if place_info.published[1] != forecast:
+            self._publish(place_info, forecast)
+        observation_info = self.observation.get(self.forecast_to_observation.get(forecast_place))
+        if observation_info is None:
+            return
+        _, published = observation_info.published
+        observation = published.replace(**self._today(forecast))
+        if observation != published:
+            self._publish(observation_info, observation)
+        return
+
+    def _publish_areas(self, product_info):
+        # NOTE: call with weather_lock held
+        for forecast_place, place_info in self.forecast.items():
+            if place_info.product is product_info:
+                self._publish_area(forecast_place, place_info)
+        return
+
+    def get_forecast(self, product):
+        """
+        refresh every forecast place drawn from a product, with one download and parse of the product
+        """
         # noinspection PyUnresolvedReferences
         if self.my_args.verbose:
-            print(f"Getting forecast for {forecast_place}")
-        ftp = FTP(FORECAST_HOST)
-        ftp.login()
-        fc_path = FORECAST_PATH.format(forecast_place)
-        out_str = io.StringIO()
-        ftp.retrlines("RETR " + fc_path, out_str.write)
-        elements = untangle.parse(out_str.getvalue())
-        out_str.close()
-        area = elements.product.forecast.area[2]
-        today_elements = area.forecast_period[0]
-        tfc_elements = today_elements.element
-        info = self._decode_elements(tfc_elements)
-        periods_forecast = area.forecast_period
-        observation_place = self.forecast_to_observation[forecast_place]
-        # today's forecast is mixed in with the general forecast
-        # we regard today's forecast as part of the observation
-        forecast_today = {}
-        for key in info:
-            forecast_today[key] = info[key]
-        forecast = []
-        for day_forecast in periods_forecast:
-            day_elements = day_forecast.element
-            info = self._decode_elements(day_elements, day_forecast["start-time-local"])
-            forecast.append(info)
+            print(f"Getting forecast product {product}")
+        fc_path = FORECAST_PATH.format(product)
+        with self.weather_lock:
+            product_info = self.products.get(product)
+            if product_info is None:
+                # its places all evicted since this fetch was scheduled
+                return
+            if not self._in_demand(product_info):
+                return
+            last_stamp = product_info.stamp
+            peer_etag = product_info.peer_etag
+        owner = self.peers and self.peers.owner(product)
+        if owner and self._forecast_from_peer(owner, product, peer_etag):
+            return
+        breaker = self.breakers["forecast"]
+        if not breaker.allow():
+            self._suspended(self.products, product, breaker, self.forecast_interval)
+            return
+        try:
+            with FETCH_DURATION.time("forecast", product), STAGE_DURATION.time("forecast_download"):
+                stamp, xml_bytes = self.ftp_pool.fetch_if_changed(fc_path, last_stamp)
+        except ftplib.error_perm as ex:
+            # the server is up, but won't give us this product, i.e. no such product
+            breaker.record_success()
+            self._fetch_failed(self.products, "forecast", product, self.forecast_interval, f"{type(ex)}/{ex}")
+            return
+        except Exception as ex:
+            breaker.record_failure()
+            self._fetch_failed(self.products, "forecast", product, self.forecast_interval, f"{type(ex)}/{ex}",
+                               server_fault=True)
+            return
+        breaker.record_success()
+        if xml_bytes is None:
+            # product unchanged since the last download, nothing to do
+            with self.weather_lock:
+                product_info = self.products.get(product)
+                if product_info is not None:
+                    self._mark_fetched(product_info)
+                    self._refresh_forecast(product_info)
+                    self._publish_areas(product_info)
+            # noinspection PyUnresolvedReferences
+            if self.my_args.verbose:
+                print(f"Forecast product {product} unchanged")
+            return
+        try:
+            decode_time = [0.0]
+
+            def decode_elements(*args):
+                start = time.perf_counter()
+                try:
+                    return self._decode_elements(*args)
+                finally:
+                    decode_time[0] += time.perf_counter() - start
+
+            with PARSE_DURATION.time("forecast", product), STAGE_DURATION.time("forecast_parse"):
+                amoc = {}
+                areas = self._index_areas(parse_product_areas(xml_bytes, decode_elements, amoc))
+            # the part of the parse spent decoding periods' elements, summed rather than timed per period
+            STAGE_DURATION.observe(decode_time[0], "forecast_decode")
+        except Exception as ex:
+            # i.e. a product we can't make sense of
+            self._fetch_failed(self.products, "forecast", product, self.forecast_interval, f"{type(ex)}/{ex}")
+            return
+        with self.weather_lock:
+            product_info = self.products.get(product)
+            if product_info is None:
+                return
+            product_info.areas = areas
+            product_info.stamp = stamp
+            product_info.next_issue = self._next_issue(amoc)
+            self._mark_fetched(product_info)
+            self._refresh_forecast(product_info)
+            self._publish_areas(product_info)
+        return
+
+    def _fetch_from_peer(self, owner, kind, place, etag, since=None):
+        """
+        :return: PeerReply, None if fetches from the owner failed or are suspended, so are left to the BoM
+        """
+        try:
+            with STAGE_DURATION.time("peer_download"):
+                reply = self.peers.fetch(self._session(), owner, kind, place, etag, since)
+        except PeerUnavailable as ex:
+            PEER_FETCHES.inc(kind, "failed")
+            print(f"Error: {kind} {place} from peer {owner} {ex}, fetching from the BoM")
+            return None
+        if reply is None:
+            PEER_FETCHES.inc(kind, "suspended")
+            return None
+        PEER_FETCHES.inc(kind, {200: "ok", 304: "not_modified", 451: "pending"}[reply.status])
+        return reply
+
+    def _peer_fetched(self, place_info, reply, time_now):
+        """
+        schedule a place fetched from its owner for just after the owner next refreshes it
+
+        NOTE: call with weather_lock held
+        """
+        if reply.status == 451:
+            # the owner's first fetch is still under way
+            place_info.periodic.reschedule(time_now + reply.refresh)
+            return
+        # as old as the owner's copy, so clients see how stale it is
+        self._mark_fetched(place_info, time_now - reply.age)
+        place_info.periodic.reschedule(time_now + max(0.0, reply.refresh) + PEER_LAG)
+        return
+
+    def _observation_from_peer(self, owner, observation_place, etag, since):
+        """
+        fetch an observation from the peer owning it
+
+        :param since: time of the newest history record held, None if none
+        :return: True => fetched, or pending at the owner. False => left to the BoM
+        """
+        reply = self._fetch_from_peer(owner, "observation", observation_place, etag, since)
+        if reply is None:
+            return False
+        time_now = time.time()
+        try:
+            with self.weather_lock:
+                place_info = self.observation.get(observation_place)
+                if place_info is None:
+                    return True
+                if reply.status == 200:
+                    if place_info.history is not None and "history" in reply.state:
+                        place_info.history.merge_series(reply.state["history"])
+                    place_info.peer_etag = reply.etag
+                    _, published = place_info.published
+                    temp_now = reply.state.get("temp_now", ABSENT)
+                    if published.temp_now != temp_now:
+                        self._publish(place_info, published.replace(temp_now=temp_now))
+                self._peer_fetched(place_info, reply, time_now)
+        except (KeyError, TypeError, ValueError) as ex:
+            print(f"Error: observation {observation_place} from peer {owner} {type(ex)}/{ex}, fetching from the BoM")
+            return False
+        return True
+
+    @staticmethod
+    def _peer_areas(areas):
+        """
+        :param areas: list of {keys:[area key], forecast:[period]}, as peer_forecast() gives them
+        :return: {area key:Forecast}
+        """
+        index = {}
+        for area in areas:
+            forecast = Forecast.from_list(area["forecast"])
+            for key in area["keys"]:
+                index[key] = forecast
+        return index
+
+    def _forecast_from_peer(self, owner, product, etag):
+        """
+        fetch a forecast product from the peer owning it
+
+        :return: True => fetched, or pending at the owner. False => left to the BoM
+        """
+        reply = self._fetch_from_peer(owner, "forecast", product, etag)
+        if reply is None:
+            return False
+        areas = next_issue = None
+        if reply.status == 200:
+            try:
+                areas = self._peer_areas(reply.state["areas"])
+                next_issue = reply.state.get("next_issue")
+            except (KeyError, TypeError, ValueError) as ex:
+                print(f"Error: forecast {product} from peer {owner} {type(ex)}/{ex}, fetching from the BoM")
+                return False
+        time_now = time.time()
+        with self.weather_lock:
+            product_info = self.products.get(product)
+            if product_info is None:
+                return True
+            if areas is not None:
+                product_info.areas = areas
+                product_info.next_issue = next_issue
+                product_info.peer_etag = reply.etag
+                # not what the BoM last gave us, so downloaded in full should the owner go down
+                product_info.stamp = None
+            self._peer_fetched(product_info, reply, time_now)
+            if reply.status != 451:
+                self._publish_areas(product_info)
+        return True
+
+    def _wait_fetched(self, place_info, timeout):
+        """
+        wait for the first fetch of a place, so a peer asking for it gets it in one request rather than retrying
+
+        :return: True => fetched
+        """
+        if not place_info.fetched:
+            with self.weather_lock:
+                self.updated.wait_for(lambda: place_info.fetched or not self.globals.running, timeout)
+        return bool(place_info.fetched)
+
+    def peer_observation(self, observation_place, since=None):
+        """
+        get an observation this node owns for a peer to serve, tracking the place if need be
+
+        :param since: time of the newest history record the peer holds, None if none
+        :return: ({temp_now:<float>, history:{...}}, seconds since fetched, seconds until next refreshed)
+        :raise WeatherPending: not fetched yet
+        """
+        place_info = self._tracked_observation(observation_place)
+        if not self._wait_fetched(place_info, PEER_WAIT):
+            raise WeatherPending(observation_place, None)
+        time_now = time.time()
+        with self.weather_lock:
+            state = {}
+            temp_now = place_info.published[1].temp_now
+            if temp_now is not ABSENT:
+                state["temp_now"] = temp_now
+            if place_info.history is not None:
+                state["history"] = place_info.history.series(since)
+            return state, time_now - place_info.fetched, place_info.periodic.due_time() - time_now
+
+    def peer_forecast(self, product):
+        """
+        get a forecast product this node owns for a peer to serve, tracking the product if need be
+
+        :return: ({areas:[{keys:[area key], forecast:[period]}], next_issue:<float>}, seconds since fetched,
+        seconds until next refreshed)
+        :raise WeatherPending: not fetched yet
+        """
+        # tracked by its default area, the one place every product has
+        forecast_info = self.forecast.get(product)
+        if forecast_info is None:
+            with self.weather_lock:
+                if product not in self.forecast:
+                    self._make_room("forecast")
+                    self._add_forecast(product)
+                    self._publish_area(product, self.forecast[product])
+                forecast_info = self.forecast[product]
+        product_info = forecast_info.product
+        forecast_info.touched = product_info.touched = time.time()
+        if product_info.dormant:
+            self._wake(self.products, product)
+        if not self._wait_fetched(product_info, PEER_WAIT):
+            raise WeatherPending(None, product)
+        time_now = time.time()
+        with self.weather_lock:
+            areas, next_issue = product_info.areas, product_info.next_issue
+            fetched, due_time = product_info.fetched, product_info.periodic.due_time()
+        # areas are replaced whole rather than modified, so can be encoded without the lock
+        shared = {}
+        for key, forecast in areas.items():
+            shared.setdefault(id(forecast), (forecast, []))[1].append(key)
+        state = dict(areas=[dict(keys=keys, forecast=forecast.as_list()) for forecast, keys in shared.values()],
+                     next_issue=next_issue)
+        return state, time_now - fetched, due_time - time_now
+
+    def take_snapshot(self):
+        """
+        :return: JSON-able copy of the fetched data, with the state needed to resume fetching it
+        """
+        with self.weather_lock:
+            observation = {place: dict(observation=info.published[1].as_dict(), validators=info.validators,
+                                       fetched=info.fetched)
+                           for place, info in self.observation.items() if info.fetched}
+            forecast = {place: dict(forecast=info.published[1].as_list(), fetched=info.fetched)
+                        for place, info in self.forecast.items() if info.fetched}
+            state = dict(observation=observation, forecast=forecast,
+                         forecast_to_observation=self.forecast_to_observation)
+            # serialise while the lock still protects the data
+            return json.loads(json.dumps(state))
+
+    def write_snapshot(self, _=None):
+        # noinspection PyUnresolvedReferences
+        save_snapshot(self.my_args.snapshot, self.take_snapshot())
+        return
+
+    def _resume_time(self, fetched, interval, time_now):
+        # fresh places resume on their schedule, stale ones are spread over an interval rather than fetched at once
+        if fetched + interval > time_now:
+            return fetched + interval
+        return time_now + random.uniform(0, interval)
+
+    def restore_snapshot(self, state):
+        """
+        resume serving and fetching the places in a snapshot. Call before the monitor starts.
+        """
+        time_now = time.time()
+        with self.weather_lock:
+            for place, info in state["observation"].items():
+                self._make_room("observation")
+                self._add_observation(place, self._resume_time(info["fetched"], self.observation_interval, time_now))
+                place_info = self.observation[place]
+                place_info.validators = info["validators"]
+                place_info.fetched = info["fetched"]
+                place_info.touched = time_now
+                self._publish(place_info, ObservationRecord.from_dict(info["observation"]))
+            for place, info in state["forecast"].items():
+                self._make_room("forecast")
+                self._add_forecast(place, self._resume_time(info["fetched"], self.forecast_interval, time_now))
+                place_info = self.forecast[place]
+                # products aren't saved, so each is downloaded again to index its areas
+                place_info.fetched = info["fetched"]
+                place_info.touched = time_now
+                self._publish(place_info, Forecast.from_list(info["forecast"]))
+            # only for the pairs restored, not those dropped before the snapshot or evicted to fit --max-places
+            self.forecast_to_observation.update(
+                (forecast_place, observation_place)
+                for forecast_place, observation_place in state["forecast_to_observation"].items()
+                if forecast_place in self.forecast and observation_place in self.observation)
+        return
+
+    def prewarm(self, pairs):
+        """
+        track pairs ahead of any request for them, so their first fetches all start at once.
+        Call before the monitor starts.
+
+        :param pairs: list of (observation place, forecast place)
+        """
         with self.weather_lock:
-            self.forecast[forecast_place]["forecast"] = forecast
-            self.observation[observation_place]["observation"].update(forecast_today)
+            for observation_place, forecast_place in pairs:
+                self._register(observation_place, forecast_place)
         return
 
     def run(self):
-        while self.globals.running:
-            for place, info in self.observation.items():
-                if info["periodic"].check(place):
-                    # limit positive checks to one/loop for responsiveness
-                    break
-            for place, info in self.forecast.items():
-                if info["periodic"].check(place):
-                    # limit positive checks to one/loop for responsiveness
-                    break
-            time.sleep(1)
+        # noinspection PyUnresolvedReferences
+        if self.my_args.snapshot:
+            # noinspection PyUnresolvedReferences
+            periodic = Periodic(self.my_args.snapshot_interval, self.write_snapshot, "snapshot")
+            # noinspection PyUnresolvedReferences
+            self.scheduler.add(periodic, due_time=time.time() + self.my_args.snapshot_interval)
+        # noinspection PyUnresolvedReferences
+        sweep_interval = max(1.0, min(60.0, self.my_args.place_ttl / 4))
+        periodic = Periodic(sweep_interval, self.evict_idle, "evict-idle")
+        self.scheduler.add(periodic, due_time=time.time() + sweep_interval)
+        self.scheduler.run(lambda: self.globals.running)
+        return
+
+    def stop(self):
+        with self.weather_lock:
+            # release anyone waiting for updates
+            self.updated.notify_all()
+        self.scheduler.stop()
+        self.ftp_pool.close()
+        with self.session_lock:
+            if self.http_session is not None:
+                self.http_session.close()
+        return
+
+    def _evict(self, kind, place, reason):
+        # NOTE: call with weather_lock held
+        registry = self.observation if kind == "observation" else self.forecast
+        place_info = registry.pop(place)
+        # what's fetched for the place, and the label of its fetch metrics
+        fetched, fetched_label = place_info, place
+        if kind == "forecast":
+            self.forecast_to_observation.pop(place, None)
+            fetched, fetched_label = place_info.product, split_area_place(place)[0]
+            if any(info.product is fetched for info in self.forecast.values()):
+                # the product still serves other places
+                fetched = None
+            else:
+                self.products.pop(fetched_label)
+        if fetched is not None:
+            self.scheduler.remove(fetched.periodic)
+            for metric in (FETCH_DURATION, PARSE_DURATION, UPSTREAM_ERRORS):
+                metric.remove(kind, fetched_label)
+        PLACES_EVICTED.inc(kind, reason)
+        for listener in self.eviction_listeners:
+            listener(kind, place)
+        # noinspection PyUnresolvedReferences
+        if self.my_args.verbose:
+            print(f"Evicted {kind} {place} ({reason})")
+        return
+
+    def _make_room(self, kind):
+        # NOTE: call with weather_lock held
+        registry = self.observation if kind == "observation" else self.forecast
+        # noinspection PyUnresolvedReferences
+        while len(registry) >= self.my_args.max_places:
+            least_recent = min(registry, key=lambda place: registry[place].touched)
+            self._evict(kind, least_recent, "capacity")
+        return
+
+    def evict_idle(self, _=None):
+        """
+        stop tracking places no request has touched within the place TTL
+        """
+        # noinspection PyUnresolvedReferences
+        cutoff = time.time() - self.my_args.place_ttl
+        with self.weather_lock:
+            for kind, registry in (("observation", self.observation), ("forecast", self.forecast)):
+                for place in [place for place, info in registry.items() if info.touched < cutoff]:
+                    self._evict(kind, place, "idle")
+        return
+
+    def _register(self, observation_place, forecast_place):
+        # NOTE: call with weather_lock held
+        # map before adding, as a newly added forecast may be fetched straight away
+        self.forecast_to_observation[forecast_place] = observation_place
+        if observation_place not in self.observation:
+            self._make_room("observation")
+            self._add_observation(observation_place)
+        if forecast_place not in self.forecast:
+            self._make_room("forecast")
+            self._add_forecast(forecast_place)
+        # a forecast area from a product already in hand is served straight away, with no download of its own
+        self._publish_area(forecast_place, self.forecast[forecast_place])
+        return
+
+    def _published(self, observation_place, forecast_place):
+        """
+        get the published weather of a pair, registering the pair if need be.
+        Only registration takes the lock, reading known places is lock free.
+
+        :return: ((observation version, observation), (forecast version, forecast))
+        :raise WeatherPending: not fetched yet
+        :raise AreaNotFound: the forecast product has no such area
+        """
+        observation_info = self.observation.get(observation_place)
+        forecast_info = self.forecast.get(forecast_place)
+        if observation_info is None or forecast_info is None or \
+                self.forecast_to_observation.get(forecast_place) != observation_place:
+            with self.weather_lock:
+                self._register(observation_place, forecast_place)
+                observation_info = self.observation[observation_place]
+                forecast_info = self.forecast[forecast_place]
+        # unlocked - a lost race between two requests touching the same place makes no difference
+        time_now = time.time()
+        product_info = forecast_info.product
+        observation_info.touched = time_now
+        forecast_info.touched = time_now
+        product_info.touched = time_now
+        if observation_info.dormant:
+            self._wake(self.observation, observation_place)
+        if product_info.dormant:
+            self._wake(self.products, split_area_place(forecast_place)[0])
+        if not forecast_info.fetched and product_info.fetched:
+            raise AreaNotFound(forecast_place)
+        if not observation_info.fetched or not forecast_info.fetched:
+            # still waiting on the first fetch of one or the other
+            raise WeatherPending(observation_place, forecast_place)
+        return observation_info.published, forecast_info.published
+
+    def _mark_fetched(self, place_info, fetched=None):
+        # NOTE: call with weather_lock held
+        if not place_info.fetched:
+            # first fetch, which requests may be waiting on even if it changed nothing
+            self.updated.notify_all()
+        place_info.fetched = fetched or time.time()
+        place_info.failures = 0
+        return
+
+    def is_tracked(self, observation_place, forecast_place=None):
+        """
+        :param forecast_place: None => just the observation place
+        :return: True => the places are already tracked, so a request for them registers nothing new
+        """
+        return observation_place in self.observation and (forecast_place is None or forecast_place in self.forecast)
+
+    def has_weather(self, observation_place, forecast_place):
+        """
+        :return: True => the pair has its weather, or never will as its forecast product lacks the area
+        """
+        observation_info = self.observation.get(observation_place)
+        forecast_info = self.forecast.get(forecast_place)
+        if forecast_info is not None and not forecast_info.fetched and forecast_info.product.fetched:
+            return True
+        return observation_info is not None and forecast_info is not None and \
+            observation_info.fetched and forecast_info.fetched
+
+    def wait_for_pairs(self, pairs, timeout):
+        """
+        wait for the first fetches of many pairs, i.e. those prewarmed at startup
+
+        :param pairs: list of (observation place, forecast place)
+        :param timeout: max seconds to wait
+        :return: list of the pairs still without weather when the wait is over
+        """
+        with self.weather_lock:
+            self.updated.wait_for(lambda: all(self.has_weather(*pair) for pair in pairs) or not self.globals.running,
+                                  timeout)
+        return [pair for pair in pairs if not self.has_weather(*pair)]
+
+    def wait_for_weather(self, observation_place, forecast_place, timeout):
+        """
+        wait for the first fetch of a pair, registering it if need be.
+        All requests waiting on a pair share the one fetch.
+
+        :param timeout: max seconds to wait
+        :raise WeatherPending: still no weather for the pair when the wait is over
+        """
+        try:
+            self._published(observation_place, forecast_place)
+            return
+        except WeatherPending:
+            if timeout <= 0:
+                raise
+        with self.weather_lock:
+            self.updated.wait_for(lambda: self.has_weather(observation_place, forecast_place) or
+                                  not self.globals.running, timeout)
+        self._published(observation_place, forecast_place)
         return
 
+    def retry_after(self, observation_place, forecast_place):
+        """
+        estimate when a pending pair will have its weather
+
+        :return: seconds to wait before asking again
+        """
+        time_now = time.time()
+        ready_time = time_now
+        forecast_info = self.forecast.get(forecast_place)
+        # a forecast place is fetched with its product
+        for place_info in (self.observation.get(observation_place), forecast_info and forecast_info.product):
+            if place_info is None or place_info.fetched:
+                continue
+            periodic = place_info.periodic
+            if periodic.running or periodic.num_periods < 0:
+                # first fetch is under way or about to be, allow it a round trip
+                ready_time = max(ready_time, periodic.start_time + PENDING_RETRY)
+            else:
+                # first fetch failed, so wait for the next
+                ready_time = max(ready_time, periodic.due_time() + PENDING_RETRY)
+        return max(1, math.ceil(ready_time - time_now))
+
+    def weather_age(self, observation_place, forecast_place):
+        """
+        check how fresh a pair's weather is, i.e. to warn clients it's being served from what was last fetched
+
+        :return: (seconds since the older of the pair's last fetches, True => its refreshes are failing),
+        None if not fetched yet
+        """
+        observation_info = self.observation.get(observation_place)
+        forecast_info = self.forecast.get(forecast_place)
+        if observation_info is None or forecast_info is None or \
+                not observation_info.fetched or not forecast_info.fetched:
+            return None
+        failing = observation_info.failures > 0 or forecast_info.product.failures > 0 or \
+            self.breakers["observation"].is_open() or self.breakers["forecast"].is_open()
+        return time.time() - min(observation_info.fetched, forecast_info.fetched), failing
+
+    def get_weather_version(self, observation_place, forecast_place):
+        """
+        get the current data version of an observation/forecast pair, without building the results
+
+        :return: (observation version, forecast version) - changes whenever either place's data changes
+        """
+        (observation_version, _), (forecast_version, _) = self._published(observation_place, forecast_place)
+        return observation_version, forecast_version
+
+    def get_weather_versioned(self, observation_place, forecast_place):
+        """
+        get the weather for an observation/forecast pair, along with the version it was taken at.
+        The results share the published data, and must not be modified.
+
+        :return: ((observation version, forecast version), results)
+        """
+        (observation_version, observation), (forecast_version, forecast) = \
+            self._published(observation_place, forecast_place)
+        return (observation_version, forecast_version), weather_results(observation, forecast)
+
+    def published_pairs(self):
+        """
+        get the weather of every pair fetched so far, without counting as a request for any of them
+
+        :return: {(observation place, forecast place):((observation version, forecast version),
+                  (ObservationRecord, Forecast))}, (None, None) for pairs whose forecast product lacks the area
+        """
+        pairs = {}
+        with self.weather_lock:
+            for forecast_place, observation_place in self.forecast_to_observation.items():
+                observation_info = self.observation.get(observation_place)
+                forecast_info = self.forecast.get(forecast_place)
+                if observation_info is None or forecast_info is None:
+                    continue
+                if not forecast_info.fetched and forecast_info.product.fetched:
+                    pairs[(observation_place, forecast_place)] = (None, None)
+                    continue
+                if not observation_info.fetched or not forecast_info.fetched:
+                    continue
+                (observation_version, observation), (forecast_version, forecast) = \
+                    observation_info.published, forecast_info.published
+                pairs[(observation_place, forecast_place)] = \
+                    ((observation_version, forecast_version), (observation, forecast))
+        return pairs
+
     def get_weather(self, observation_place, forecast_place):
+        _, results = self.get_weather_versioned(observation_place, forecast_place)
+        return results
+
+    def get_history(self, observation_place, start=None, end=None, bucket=None, fields=HISTORY_FIELDS):
+        """
+        get the observation records held for a place, tracking the place if need be
+
+        :param start: earliest record time wanted, None => from the oldest held
+        :param end: record times wanted are before this, None => up to the newest
+        :param bucket: seconds per bucket to downsample records into, None => every record
+        :param fields: members wanted, from HISTORY_FIELDS
+        :return: as ObservationHistory.series(), or ObservationHistory.buckets() if downsampled
+        :raise WeatherPending: not fetched yet
+        """
+        place_info = self._tracked_observation(observation_place)
+        if not place_info.fetched:
+            raise WeatherPending(observation_place, None)
         with self.weather_lock:
-            new_forecast = False
-            new_observation = False
-            if observation_place not in self.observation:
-                new_observation = True
-                self._add_observation(observation_place)
-            if forecast_place not in self.forecast:
-                new_forecast = True
-                self._add_forecast(forecast_place)
-            self.forecast_to_observation[forecast_place] = observation_place
-            if new_observation or new_forecast:
-                raise WeatherPending(observation_place, forecast_place)
-            results = dict(observation=self.observation[observation_place]["observation"],
-                           forecast=self.forecast[forecast_place]["forecast"])
-            return results
-
-    def _add_observation(self, observation_place):
-        periodic = Periodic(self.observation_interval, self.get_observation, f"observation-{observation_place}")
-        self.observation[observation_place] = dict(observation={}, periodic=periodic)
-        return
-
-    def _add_forecast(self, forecast_place):
-        periodic = Periodic(self.forecast_interval, self.get_forecast, f"forecast-{forecast_place}")
-        self.forecast[forecast_place] = dict(forecast={}, periodic=periodic)
+            if bucket:
+                return place_info.history.buckets(bucket, start, end, fields)
+            return place_info.history.series(start, end, fields)
+
+    def _tracked_observation(self, observation_place):
+        """
+        get an observation place's bookkeeping, tracking the place on its own if need be,
+        and count this as a request for it
+
+        :return: TrackedPlace
+        """
+        place_info = self.observation.get(observation_place)
+        if place_info is None:
+            with self.weather_lock:
+                if observation_place not in self.observation:
+                    self._make_room("observation")
+                    self._add_observation(observation_place)
+                place_info = self.observation[observation_place]
+        place_info.touched = time.time()
+        if place_info.dormant:
+            self._wake(self.observation, observation_place)
+        return place_info
+
+    def _add_observation(self, observation_place, due_time=None):
+        periodic = Periodic(self.observation_interval, self.get_observation, f"observation-{observation_place}",
+                            start_time=due_time)
+        # noinspection PyUnresolvedReferences
+        history = ObservationHistory(self.my_args.history_length) if self.my_args.history_length > 0 else None
+        self.observation[observation_place] = TrackedPlace((0, ObservationRecord()), periodic, time.time(),
+                                                           validators={}, timing=ObservationTiming(),
+                                                           history=history)
+        self.scheduler.add(periodic, observation_place, due_time)
+        return
+
+    def _add_forecast(self, forecast_place, due_time=None):
+        # NOTE: call with weather_lock held
+        product = split_area_place(forecast_place)[0]
+        product_info = self.products.get(product)
+        if product_info is None:
+            periodic = Periodic(self.forecast_interval, self.get_forecast, f"forecast-{product}", start_time=due_time)
+            product_info = TrackedPlace(None, periodic, time.time(), areas={})
+            self.products[product] = product_info
+            self.scheduler.add(periodic, product, due_time)
+        place_info = TrackedPlace((0, Forecast()), None, time.time(), product=product_info)
+        self.forecast[forecast_place] = place_info
         return
 
@@ -2,16 +2,42 @@
 # coding=utf-8
 
 from http.server import BaseHTTPRequestHandler
+from threading import Lock
 from urllib import parse
+import hashlib
 import json
+import math
 import re
+import time
 
+from BOMWeatherServer import metrics, weather_formats
+from BOMWeatherServer.admission import AdmissionControl, Refused, server_busy
+from BOMWeatherServer.forecast_parser import AreaNotFound, area_place, split_area_place
+from BOMWeatherServer.history import HISTORY_FIELDS
+from BOMWeatherServer.peers import REFRESH_HEADER, RING_HEADER
+from BOMWeatherServer.profiling import Profiler, ProfilerBusy
+from BOMWeatherServer.servers import PooledHTTPServer
 from BOMWeatherServer.weather_pending import WeatherPending
 
 # =============================================================================
 
 
 PLACE_CODE_REGEX = r"^[A-Z]{3}\d{5}$"
+AREA_REGEX = r"^[A-Z0-9_ '().-]{1,64}$"     # forecast area AAC or description
+ENDPOINTS = ("/", "/batch", "/events", "/history", "/metrics", "/peer", "/profile", "/ready")
+UNLIMITED_ENDPOINTS = ("/metrics", "/ready")    # exempt from the in-flight budget and client rates
+MAX_BATCH_PAIRS = 100
+STREAM_HEARTBEAT = 15   # seconds
+MAX_WAIT = 30000        # milliseconds
+READY_RETRY = 2         # seconds between readiness checks while places are still being prewarmed
+BUSY_IDLE = 0.1         # seconds a connection is given to send its request while others are waiting for a worker
+BATCH_USAGE = "observation:forecast place code pairs required: http://<host>:<port>/batch?pair=<place>:<place>&..., " \
+              "the forecast place optionally followed by /<area>"
+HISTORY_USAGE = "observation place code required: http://<host>:<port>/history?observation=<place>" \
+                "[&start=<epoch seconds>][&end=<epoch seconds>][&bucket=<seconds>][&fields=<field>,...]"
+PROFILE_USAGE = "http://<host>:<port>/profile?cpu=<seconds> or http://<host>:<port>/profile?memory=start|snapshot|stop"
+PEER_USAGE = "http://<host>:<port>/peer?observation=<place>[&since=<epoch seconds>] or " \
+             "http://<host>:<port>/peer?forecast=<product>"
 
 
 # =============================================================================
@@ -34,61 +60,723 @@ class InvalidParameters(Exception):
 # =============================================================================
 
 
-class MyServerHandler(BaseHTTPRequestHandler):
-    def __init__(self, my_args, monitor, *args, **kwargs):
+class Response(object):
+    """
+    a fully formed response, independent of the front end that delivers it
+    """
+    def __init__(self, code, body=b"", content_type="application/json", headers=None, stream=None):
+        self.code = code
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or []
+        self.stream = stream        # ResponseStream, sent until exhausted instead of body
+        return
+
+    def all_headers(self):
+        """
+        :return: list of (name, value) header pairs, including content type and length
+        """
+        if self.code == 304:
+            # not modified - no body, no body headers
+            return list(self.headers)
+        if self.stream is not None:
+            # length unknown, the body ends when the connection closes
+            return [("Content-Type", self.content_type), ("Connection", "close")] + self.headers
+        headers = [("Content-Type", self.content_type), ("Content-Length", str(len(self.body)))]
+        headers.extend(self.headers)
+        return headers
+
+
+# =============================================================================
+
+
+class ResponseStream(object):
+    """
+    the chunks of a streamed response body. Must be closed once sent, whether or not it was iterated.
+    """
+    def __init__(self, chunks, on_close=None):
+        self.chunks = chunks
+        self.on_close = on_close
+        self.closed = False
+        return
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+            if self.on_close:
+                self.on_close()
+        return
+
+
+# =============================================================================
+
+
+class WeatherVariant(object):
+    """
+    one representation of a pair's weather - a format, possibly compressed - with its own entity tag
+    """
+    def __init__(self, body, content_type, content_encoding=None):
+        self.body = body
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        return
+
+    def matches(self, if_none_match):
+        """
+        check an If-None-Match request header against this entity
+
+        :param if_none_match: the header value, or None
+        :return: True => client already holds this entity
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == self.etag:
+                return True
+        return False
+
+
+# =============================================================================
+
+
+class EncodedWeather(object):
+    """
+    weather for an observation/forecast pair, encoded once and reused until the data version changes.
+    Other formats and compressed variants are built the first time a client asks for them, then reused likewise.
+    """
+    def __init__(self, version, body, weather=None):
+        self.version = version
+        self.body = body            # JSON, as spliced into batches and event streams
+        self.weather = weather      # as encoded, None => decoded from body if another format is asked for
+        self.variants = {(weather_formats.JSON, None): WeatherVariant(body, weather_formats.JSON)}
+        return
+
+    def variant(self, media_type, coding):
+        """
+        get a variant of the weather, building it if this is the first request for it
+
+        :param media_type: weather_formats.JSON, MSGPACK or CBOR
+        :param coding: weather_formats.GZIP, or None for uncompressed
+        :return: WeatherVariant
+        """
+        variant = self.variants.get((media_type, coding))
+        if variant is not None:
+            return variant
+        if coding is None:
+            with metrics.STAGE_DURATION.time("weather_encode"):
+                if self.weather is None:
+                    self.weather = json.loads(self.body)
+                variant = WeatherVariant(weather_formats.encode(self.weather, media_type), media_type)
+        else:
+            body = self.variant(media_type, None).body
+            with metrics.STAGE_DURATION.time("weather_compress"):
+                variant = WeatherVariant(weather_formats.compress(body), media_type, coding)
+        # built at most a few times over if requests race for it, and any of them will do
+        return self.variants.setdefault((media_type, coding), variant)
+
+
+# =============================================================================
+
+
+class WeatherService(object):
+    """
+    builds responses to weather queries. Shared by all requests, whichever front end is serving them.
+    """
+    place_code_re = re.compile(PLACE_CODE_REGEX)
+    area_re = re.compile(AREA_REGEX)
+
+    def __init__(self, my_args, monitor):
         self.my_args = my_args
         self.monitor = monitor
-        self.place_code_re = re.compile(PLACE_CODE_REGEX)
-        super(MyServerHandler, self).__init__(*args, **kwargs)
+        self.started = time.time()
+        self.cache_lock = Lock()
+        self.encoded_cache = {}     # {(observation_place, forecast_place):EncodedWeather}
+        self.streams = 0            # event streams currently open, under cache_lock
+        self.profiler = Profiler(my_args.profile) if my_args.profile else None
+        self.admission = AdmissionControl(my_args.max_inflight, my_args.client_rate, my_args.client_burst,
+                                          my_args.client_places)
+        metrics.REQUESTS_IN_FLIGHT.collect = lambda: {(): self.admission.load()}
+        monitor.eviction_listeners.append(self._forget_place)
         return
 
-    # noinspection PyPep8Naming
-    def do_HEAD(self, code):
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
+    def _forget_place(self, kind, place):
+        index = 0 if kind == "observation" else 1
+        with self.cache_lock:
+            for key in [key for key in self.encoded_cache if key[index] == place]:
+                del self.encoded_cache[key]
         return
 
-    def validate_parameters(self):
+    @classmethod
+    def validate_place(cls, place_code):
+        place_code = place_code.upper()
+        if not cls.place_code_re.match(place_code):
+            raise InvalidPlaceCode(place_code)
+        return place_code
+
+    @classmethod
+    def validate_forecast_place(cls, place_code, area=None):
+        """
+        :param place_code: forecast product code, optionally followed by /<area AAC or description>
+        :param area: area AAC or description, if not part of place_code
+        :return: the forecast place code
+        """
+        product, place_area = split_area_place(place_code)
+        area = (area or place_area).upper()
+        if area and not cls.area_re.match(area):
+            raise InvalidPlaceCode(area_place(product, area))
+        return area_place(cls.validate_place(product), area)
+
+    @classmethod
+    def validate_pair(cls, pair):
+        """
+        :param pair: <observation place>:<forecast place>, the forecast place optionally followed by /<area>
+        :return: (observation place, forecast place)
+        :raise ValueError: not a pair of place codes
+        """
+        observation_place, forecast_place = pair.split(":")
+        return cls.validate_place(observation_place), cls.validate_forecast_place(forecast_place)
+
+    def validate_parameters(self, path):
         try:
-            query = parse.urlparse(self.path).query
+            query = parse.urlparse(path).query
             parameters = parse.parse_qs(query)
-            observation_place = parameters["observation"][0].upper()
-            if not self.place_code_re.match(observation_place):
-                raise InvalidPlaceCode(observation_place)
-            forecast_place = parameters["forecast"][0].upper()
-            if not self.place_code_re.match(forecast_place):
-                raise InvalidPlaceCode(forecast_place)
+            observation_place = self.validate_place(parameters["observation"][0])
+            area = parameters["area"][0] if "area" in parameters else None
+            forecast_place = self.validate_forecast_place(parameters["forecast"][0], area)
         except InvalidPlaceCode:
             raise
         except:
             raise InvalidParameters()
         return observation_place, forecast_place
 
-    # noinspection PyPep8Naming
-    def do_GET(self):
+    @staticmethod
+    def validate_wait(path):
+        """
+        :param path: the request path, optionally with a wait=<milliseconds> parameter
+        :return: seconds to wait for weather still pending, capped at MAX_WAIT
+        """
+        parameters = parse.parse_qs(parse.urlparse(path).query)
+        if "wait" not in parameters:
+            return 0
+        try:
+            wait = int(parameters["wait"][0])
+        except ValueError:
+            wait = -1
+        if wait < 0:
+            raise InvalidParameters(f"wait must be a number of milliseconds, at most {MAX_WAIT}")
+        return min(wait, MAX_WAIT) / 1000
+
+    def validate_pairs(self, query):
+        """
+        :param query: query string holding pair=<observation place>:<forecast place> parameters
+        :return: list of (observation place, forecast place)
+        """
         try:
-            observation_place, forecast_place = self.validate_parameters()
-            weather = self.monitor.get_weather(observation_place, forecast_place)
-            self.do_HEAD(200)
-            json_text = json.dumps(weather)
-            self.wfile.write(json_text.encode("utf8"))
+            pairs = [self.validate_pair(pair) for pair in parse.parse_qs(query)["pair"]]
+        except InvalidPlaceCode:
+            raise
+        except:
+            raise InvalidParameters(BATCH_USAGE)
+        if len(pairs) > MAX_BATCH_PAIRS:
+            raise InvalidParameters(f"at most {MAX_BATCH_PAIRS} pairs per request")
+        return pairs
+
+    def validate_history(self, query):
+        """
+        :param query: query string holding the observation place, and optionally the time range,
+        bucket width and fields wanted
+        :return: (observation place, start, end, bucket, fields), None where not given
+        """
+        try:
+            parameters = parse.parse_qs(query)
+            observation_place = self.validate_place(parameters["observation"][0])
+            start, end, bucket = [float(parameters[name][0]) if name in parameters else None
+                                  for name in ("start", "end", "bucket")]
+            fields = parameters["fields"][0].split(",") if "fields" in parameters else HISTORY_FIELDS
+        except InvalidPlaceCode:
+            raise
+        except:
+            raise InvalidParameters(HISTORY_USAGE)
+        if not all(math.isfinite(value) for value in (start, end, bucket) if value is not None):
+            raise InvalidParameters(HISTORY_USAGE)
+        if bucket is not None and bucket <= 0:
+            raise InvalidParameters("bucket must be a number of seconds")
+        unknown = [field for field in fields if field not in HISTORY_FIELDS]
+        if unknown:
+            raise InvalidParameters(f"unknown fields {','.join(unknown)}, choose from {','.join(HISTORY_FIELDS)}")
+        return observation_place, start, end, bucket, fields
+
+    @staticmethod
+    def _json_response(code, content):
+        json_text = json.dumps(content)
+        return Response(code, json_text.encode("utf8"))
+
+    def _encode_weather(self, key, version, weather):
+        """
+        encode the weather for a pair, reusing the cached encoding if it is of the same version
+
+        :return: EncodedWeather
+        """
+        with self.cache_lock:
+            encoded = self.encoded_cache.get(key)
+        if encoded and encoded.version == version:
+            return encoded
+        with metrics.STAGE_DURATION.time("weather_encode"):
+            encoded = EncodedWeather(version, json.dumps(weather).encode("utf8"), weather)
+        with self.cache_lock:
+            self.encoded_cache[key] = encoded
+        return encoded
+
+    def get_encoded_weather(self, observation_place, forecast_place):
+        """
+        get the encoded weather for a pair, re-encoding only if the monitor has new data for it
+
+        :return: EncodedWeather
+        """
+        key = (observation_place, forecast_place)
+        version = self.monitor.get_weather_version(observation_place, forecast_place)
+        with self.cache_lock:
+            encoded = self.encoded_cache.get(key)
+        if encoded and encoded.version == version:
+            return encoded
+        version, weather = self.monitor.get_weather_versioned(observation_place, forecast_place)
+        return self._encode_weather(key, version, weather)
+
+    def _admit_places(self, client, observation_place, forecast_place=None):
+        """
+        admit a request for places, which registers them if they aren't tracked yet
+
+        :param client: the client's address, None if not over the network
+        :raise Refused: too busy to take on new places, or the client has registered its share lately
+        """
+        if not self.monitor.is_tracked(observation_place, forecast_place):
+            self.admission.admit_registration(client)
+        return
+
+    def get_encoded_batch(self, pairs, client=None):
+        """
+        get the encoded weather for many pairs at once
+
+        :param client: the client's address, None if not over the network
+        :return: list of (status, EncodedWeather) in the order of pairs, EncodedWeather None unless status is 200
+        """
+        # pair by pair, so the weather of pairs already encoded isn't rebuilt just to be discarded
+        batch = []
+        for observation_place, forecast_place in pairs:
+            try:
+                self._admit_places(client, observation_place, forecast_place)
+                batch.append((200, self.get_encoded_weather(observation_place, forecast_place)))
+            except Refused as ex:
+                # the pairs already tracked are still served
+                metrics.REQUESTS_REFUSED.inc(ex.cause)
+                batch.append((ex.code, None))
+            except WeatherPending:
+                batch.append((451, None))
+            except AreaNotFound:
+                batch.append((404, None))
+        return batch
+
+    @staticmethod
+    def _pair_entry(pair, status, body=None):
+        # splices the already encoded weather into the entry, rather than decoding and re-encoding it
+        observation_place, forecast_place = pair
+        entry = f'{{"observation_place": "{observation_place}", "forecast_place": "{forecast_place}", ' \
+                f'"status": {status}'.encode("utf8")
+        if body is None:
+            return entry + b"}"
+        return entry + b', "weather": ' + body + b"}"
+
+    def handle_weather(self, path, headers, client=None):
+        observation_place, forecast_place = self.validate_parameters(path)
+        wait = self.validate_wait(path)
+        self._admit_places(client, observation_place, forecast_place)
+        if wait and not self.admission.shedding():
+            # requests for a new place share its first fetch rather than each retrying after a 451.
+            # not while shedding, when a waiting request holds up a worker that could be serving others
+            self.monitor.wait_for_weather(observation_place, forecast_place, wait)
+        with metrics.STAGE_DURATION.time("weather_lookup"):
+            encoded = self.get_encoded_weather(observation_place, forecast_place)
+        variant = encoded.variant(weather_formats.negotiate_format(headers.get("Accept")),
+                                  weather_formats.negotiate_encoding(headers.get("Accept-Encoding")))
+        response_headers = [("ETag", variant.etag), ("Cache-Control", "no-cache"), ("Vary", weather_formats.VARY)]
+        if variant.content_encoding:
+            response_headers.append(("Content-Encoding", variant.content_encoding))
+        age = self.monitor.weather_age(observation_place, forecast_place)
+        if age is not None:
+            seconds, failing = age
+            response_headers.append(("Age", str(int(seconds))))
+            if failing:
+                # served from what was last fetched, as the BoM isn't giving us anything fresher
+                response_headers.append(("Warning", '111 - "Revalidation Failed"'))
+        if variant.matches(headers.get("If-None-Match")):
+            return Response(304, headers=response_headers)
+        return Response(200, variant.body, content_type=variant.content_type, headers=response_headers)
+
+    def handle_batch(self, query, client=None):
+        pairs = self.validate_pairs(query)
+        entries = []
+        for pair, (status, encoded) in zip(pairs, self.get_encoded_batch(pairs, client)):
+            entries.append(self._pair_entry(pair, status, encoded.body if encoded else None))
+        return Response(200, b'{"results": [' + b", ".join(entries) + b"]}", headers=[("Cache-Control", "no-cache")])
+
+    def handle_history(self, query, client=None):
+        observation_place, start, end, bucket, fields = self.validate_history(query)
+        if self.my_args.history_length <= 0:
+            return self._json_response(404, dict(reason="observation history isn't kept (--history-length 0)"))
+        self._admit_places(client, observation_place)
+        history = self.monitor.get_history(observation_place, start, end, bucket, fields)
+        results = dict(observation_place=observation_place)
+        if bucket:
+            results["bucket"] = bucket
+        results.update(history)
+        response = self._json_response(200, results)
+        response.headers.append(("Cache-Control", "no-cache"))
+        return response
+
+    def handle_ready(self):
+        """
+        :return: 200 once the places to prewarm all have their weather (or have had --prewarm-timeout seconds to),
+        503 until then
+        """
+        pending = [f"{observation_place}:{forecast_place}" for observation_place, forecast_place in self.my_args.prewarm
+                   if not self.monitor.has_weather(observation_place, forecast_place)]
+        if pending and time.time() < self.started + self.my_args.prewarm_timeout:
+            response = self._json_response(503, dict(ready=False, pending=pending))
+            response.headers.append(("Retry-After", str(READY_RETRY)))
+        else:
+            # given up on any still pending, so as not to hold up serving the rest
+            response = self._json_response(200, dict(ready=True, pending=pending))
+        response.headers.append(("Cache-Control", "no-cache"))
+        return response
+
+    def validate_peer(self, query):
+        """
+        :param query: query string holding an observation place (and optionally the time of the newest
+        history record held), or a forecast product
+        :return: (observation place, since, forecast product), None where not given
+        """
+        try:
+            parameters = parse.parse_qs(query)
+            observation_place = self.validate_place(parameters["observation"][0]) \
+                if "observation" in parameters else None
+            since = float(parameters["since"][0]) if "since" in parameters else None
+            product = self.validate_place(parameters["forecast"][0]) if "forecast" in parameters else None
+        except InvalidPlaceCode:
+            raise
+        except:
+            raise InvalidParameters(PEER_USAGE)
+        if (observation_place is None) == (product is None) or since is not None and not math.isfinite(since):
+            raise InvalidParameters(PEER_USAGE)
+        return observation_place, since, product
+
+    def handle_peer(self, query, headers):
+        """
+        serve a place this node owns to a peer, which serves it rather than fetching it from the BoM
+        """
+        observation_place, since, product = self.validate_peer(query)
+        if not self.my_args.peers:
+            return self._json_response(404, dict(reason="not in peer mode, start the server with --peers"))
+        if headers.get(RING_HEADER) != self.monitor.peers.ring.fingerprint:
+            # the nodes would disagree on which of them owns what
+            return self._json_response(409, dict(reason="peer lists differ, start every node with the same --peers"))
+        if observation_place is not None:
+            state, age, refresh = self.monitor.peer_observation(observation_place, since)
+        else:
+            state, age, refresh = self.monitor.peer_forecast(product)
+        body = json.dumps(state, separators=(",", ":")).encode("utf8")
+        variant = WeatherVariant(body, weather_formats.JSON)
+        # weak, as it stands for the state whether or not it's compressed - so an unchanged place isn't compressed
+        response_headers = [("ETag", f"W/{variant.etag}"), ("Age", str(int(age))), (REFRESH_HEADER, f"{refresh:.1f}"),
+                            ("Cache-Control", "no-cache"), ("Vary", "Accept-Encoding")]
+        if variant.matches(headers.get("If-None-Match")):
+            return Response(304, headers=response_headers)
+        if weather_formats.negotiate_encoding(headers.get("Accept-Encoding")):
+            response_headers.append(("Content-Encoding", weather_formats.GZIP))
+            body = weather_formats.compress(body)
+        return Response(200, body, headers=response_headers)
+
+    def handle_profile(self, query):
+        if self.profiler is None:
+            return self._json_response(404, dict(reason="profiling is off, start the server with --profile <folder>"))
+        parameters = parse.parse_qs(query)
+        action = parameters.get("memory", [None])[0]
+        try:
+            seconds = float(parameters["cpu"][0]) if "cpu" in parameters else None
+        except ValueError:
+            seconds = -1
+        if seconds is None and action not in ("start", "snapshot", "stop") or \
+                seconds is not None and not 0 < seconds < math.inf:
+            raise InvalidParameters(PROFILE_USAGE)
+        try:
+            if seconds is not None:
+                results = self.profiler.profile_cpu(seconds)
+            else:
+                results = self.profiler.profile_memory(action)
+        except ProfilerBusy:
+            return self._json_response(409, dict(reason="another profile is under way"))
+        response = self._json_response(200, results)
+        response.headers.append(("Cache-Control", "no-cache"))
+        return response
+
+    def _event_stream(self, pairs, client=None):
+        """
+        generate server-sent events - one per pair whenever its weather changes, and heartbeats in between
+        """
+        versions = {}
+        since = None
+        while self.monitor.globals.running:
+            since, changed = self.monitor.wait_for_update(since, STREAM_HEARTBEAT)
+            if not changed:
+                # keeps the streamed places in demand, and lets the client (and us) notice a dead connection
+                self.get_encoded_batch(pairs, client)
+                yield b": heartbeat\n\n"
+                continue
+            for pair, (_, encoded) in zip(pairs, self.get_encoded_batch(pairs, client)):
+                if encoded is not None and versions.get(pair) != encoded.version:
+                    versions[pair] = encoded.version
+                    yield b"event: weather\ndata: " + self._pair_entry(pair, 200, encoded.body) + b"\n\n"
+        return
+
+    def _close_stream(self):
+        with self.cache_lock:
+            self.streams -= 1
+        return
+
+    def handle_events(self, query, client=None):
+        pairs = self.validate_pairs(query)
+        with self.cache_lock:
+            if self.streams >= self.my_args.max_streams:
+                msg = dict(reason="too many event streams, try again later")
+                response = self._json_response(503, msg)
+                response.headers.append(("Retry-After", str(STREAM_HEARTBEAT)))
+                return response
+            self.streams += 1
+        return Response(200, content_type="text/event-stream", headers=[("Cache-Control", "no-cache")],
+                        stream=ResponseStream(self._event_stream(pairs, client), self._close_stream))
+
+    def _refused_response(self, ex):
+        metrics.REQUESTS_REFUSED.inc(ex.cause)
+        response = self._json_response(ex.code, dict(reason=ex.reason))
+        response.headers.append(("Retry-After", str(ex.retry_after)))
+        return response
+
+    def refuse_busy(self):
+        """
+        :return: Response turning away a request before it reaches a worker, as the in-flight budget is spent
+        """
+        return self._refused_response(server_busy())
+
+    @staticmethod
+    def limited(path):
+        """
+        :return: False => the request is answered however busy, so the server can be watched through overload
+        """
+        return parse.urlparse(path).path not in UNLIMITED_ENDPOINTS
+
+    def handle(self, path, headers, client=None):
+        """
+        handle a GET request
+
+        :param path: the request path, including query
+        :param headers: the request headers (http.client.HTTPMessage)
+        :param client: the client's address, None if not over the network
+        :return: Response
+        """
+        url = parse.urlparse(path)
+        endpoint = url.path if url.path in ENDPOINTS else "/"
+        # noinspection PyUnresolvedReferences
+        if client is not None and self.my_args.forwarded_for and headers.get("X-Forwarded-For"):
+            # behind a load balancer every request comes from the load balancer, so take the address it appended
+            client = headers["X-Forwarded-For"].split(",")[-1].strip()
+        with metrics.REQUEST_LATENCY.time(endpoint):
+            try:
+                # peers fetch every place they don't own from us, so aren't held to a client's rate
+                self.admission.begin(None if endpoint == "/peer" else client, self.limited(path))
+            except Refused as ex:
+                response = self._refused_response(ex)
+            else:
+                try:
+                    response = self._route(endpoint, url, path, headers, client)
+                finally:
+                    self.admission.end()
+        metrics.REQUESTS.inc(endpoint, str(response.code))
+        return response
+
+    def _route(self, endpoint, url, path, headers, client):
+        try:
+            if endpoint == "/batch":
+                response = self.handle_batch(url.query, client)
+            elif endpoint == "/events":
+                response = self.handle_events(url.query, client)
+            elif endpoint == "/history":
+                response = self.handle_history(url.query, client)
+            elif endpoint == "/ready":
+                response = self.handle_ready()
+            elif endpoint == "/peer":
+                response = self.handle_peer(url.query, headers)
+            elif endpoint == "/profile":
+                response = self.handle_profile(url.query)
+            elif endpoint == "/metrics":
+                response = Response(200, metrics.render(), content_type=metrics.CONTENT_TYPE)
+            else:
+                response = self.handle_weather(path, headers, client)
+        except Refused as ex:
+            response = self._refused_response(ex)
         except WeatherPending as ex:
-            self.do_HEAD(451)
-            msg = dict(reason=f"weather pending for location {ex.observation_place}/{ex.forecast_place}")
-            json_text = json.dumps(msg)
-            self.wfile.write(json_text.encode("utf8"))
-        except InvalidParameters:
-            self.do_HEAD(400)
-            msg = dict(reason=f"place codes for observation and forecast required: "
-                              f"http://<host>:<port>?observation=<place>&forecast=<place>")
-            json_text = json.dumps(msg)
-            self.wfile.write(json_text.encode("utf8"))
+            location = "/".join(place for place in (ex.observation_place, ex.forecast_place) if place)
+            msg = dict(reason=f"weather pending for location {location}")
+            response = self._json_response(451, msg)
+            retry_after = self.monitor.retry_after(ex.observation_place, ex.forecast_place)
+            response.headers.append(("Retry-After", str(retry_after)))
+        except InvalidParameters as ex:
+            msg = dict(reason=str(ex) or f"place codes for observation and forecast required: "
+                                         f"http://<host>:<port>?observation=<place>&forecast=<place>")
+            response = self._json_response(400, msg)
         except InvalidPlaceCode as ex:
-            self.do_HEAD(400)
             msg = dict(reason=f"place code {ex.place_code} is not valid")
-            json_text = json.dumps(msg)
-            self.wfile.write(json_text.encode("utf8"))
+            response = self._json_response(400, msg)
+        except AreaNotFound as ex:
+            msg = dict(reason=str(ex))
+            response = self._json_response(404, msg)
+        return response
+
+
+# =============================================================================
+
+
+class SharedWeatherService(WeatherService):
+    """
+    serves the weather a fetcher process publishes to shared memory, for the workers of the prefork front end.
+    Bodies are published already encoded, so are served as they are.
+    """
+    def get_encoded_weather(self, observation_place, forecast_place):
+        key = (observation_place, forecast_place)
+        with self.cache_lock:
+            encoded = self.encoded_cache.get(key)
+        version, body = self.monitor.get(key, encoded.version if encoded else None)
+        if body is None:
+            return encoded
+        encoded = EncodedWeather(version, body)
+        with self.cache_lock:
+            self.encoded_cache[key] = encoded
+        return encoded
+
+    def handle_history(self, query, client=None):
+        # the history is held by the fetcher process, and isn't published to the workers
+        self.validate_history(query)
+        return self._json_response(501, dict(reason="observation history isn't served in prefork mode"))
+
+    def handle_peer(self, query, headers):
+        # peer mode isn't offered with the prefork front end
+        self.validate_peer(query)
+        return self._json_response(404, dict(reason="not in peer mode, start the server with --peers"))
+
+
+# =============================================================================
+
+
+class MyServerHandler(BaseHTTPRequestHandler):
+    # headers and body are written separately, and delayed ACKs would hold up the body of every keep-alive response
+    disable_nagle_algorithm = True
+
+    def __init__(self, service, *args, **kwargs):
+        self.service = service
+        if service.my_args.server != "simple":
+            # HTTP/1.1 so clients can keep their connections alive between polls.
+            # not in simple mode, where one idle connection would hold up every other client.
+            self.protocol_version = "HTTP/1.1"
+            # idle keep-alive connections are dropped after this many seconds
+            self.timeout = service.my_args.keepalive
+        super(MyServerHandler, self).__init__(*args, **kwargs)
+        return
+
+    def send_weather_response(self, response):
+        if response.stream is not None:
+            self.send_stream(response)
+            return
+        self.send_response(response.code)
+        for name, value in response.all_headers():
+            self.send_header(name, value)
+        if self.service.admission.busy():
+            # connections are waiting for a worker, so this one gives up its worker rather than idling on it
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(response.body)
+        return
+
+    def send_stream(self, response):
+        self.close_connection = True
+        stream = response.stream
+        try:
+            # within the try, as the stream must be closed even if the client is gone before the headers are sent
+            self.send_response(response.code)
+            for name, value in response.all_headers():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            # no timeout between chunks, the stream paces itself with heartbeats
+            self.connection.settimeout(None)
+            for chunk in stream:
+                self.wfile.write(chunk)
+        except OSError:
+            # client went away
+            pass
+        finally:
+            stream.close()
+        return
+
+    def handle(self):
+        if not isinstance(self.server, PooledHTTPServer):
+            super(MyServerHandler, self).handle()
+            return
+        # as BaseHTTPRequestHandler.handle, but waiting for each request as idle
+        self.close_connection = True
+        while self.await_request():
+            self.handle_one_request()
+            if self.close_connection:
+                break
+        return
+
+    def await_request(self):
+        """
+        wait for the next request on the connection, which the front end may close meanwhile
+        to free this worker for another connection
+
+        :return: False => the connection closed or timed out without one
+        """
+        self.server.set_idle(self.connection, True)
+        try:
+            if self.service.admission.busy():
+                self.connection.settimeout(BUSY_IDLE)
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+            self.server.set_idle(self.connection, False)
+
+    # noinspection PyPep8Naming
+    def do_GET(self):
+        response = self.service.handle(self.path, self.headers, self.client_address[0])
+        self.send_weather_response(response)
+        return
+
+    # noinspection PyPep8Naming
+    def do_HEAD(self):
+        self.do_GET()
         return
 
     # noinspection PyShadowingBuiltins
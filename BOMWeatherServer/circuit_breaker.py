@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from threading import Lock
+import time
+
+
+# =============================================================================
+
+
+class CircuitBreaker(object):
+    """
+    suspends fetches from an upstream host once it keeps failing, so fetches for every place don't each wait out
+    a timeout against it. Once suspended for reset_timeout seconds, a single trial fetch is let through -
+    its success resumes fetching, its failure suspends fetches for another reset_timeout seconds.
+    """
+    def __init__(self, name, threshold, reset_timeout, clock=time.time):
+        self.name = name
+        self.threshold = threshold          # consecutive failures before fetches are suspended
+        self.reset_timeout = reset_timeout  # seconds suspended before a trial fetch
+        self.lock = Lock()
+        self.failures = 0           # consecutive failures
+        self.opened = None          # time fetches were suspended, None while fetching normally
+        self.trial = False          # True while a trial fetch is in progress
+        self.clock = clock          # returns the current time, in seconds
+        return
+
+    def is_open(self):
+        """
+        :return: True => fetches from the host are suspended
+        """
+        return self.opened is not None
+
+    def allow(self):
+        """
+        check a fetch may go ahead. The caller must then record its success or failure.
+
+        :return: True => go ahead, False => fetches are suspended
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or self.clock() < self.opened + self.reset_timeout:
+                return False
+            self.trial = True
+            return True
+
+    def retry_time(self):
+        """
+        :return: time a suspended fetch is next worth trying
+        """
+        with self.lock:
+            if self.opened is None:
+                return self.clock()
+            return max(self.opened + self.reset_timeout, self.clock() + (self.reset_timeout if self.trial else 0))
+
+    def record_success(self):
+        with self.lock:
+            if self.opened is not None:
+                print(f"{self.name} is back, resuming fetches")
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+        return
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened is None and self.failures >= self.threshold):
+                if self.opened is None:
+                    print(f"Error: {self.name} failed {self.failures} times in a row, "
+                          f"suspending fetches for {self.reset_timeout}s")
+                self.opened = self.clock()
+                self.trial = False
+        return
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from xml.etree.ElementTree import iterparse
+import io
+
+
+# =============================================================================
+
+
+AREA_SEPARATOR = "/"
+
+
+# =============================================================================
+
+
+class AreaNotFound(Exception):
+    def __init__(self, area):
+        super(AreaNotFound, self).__init__(f"forecast area {area} not found")
+        self.area = area
+        return
+
+
+# =============================================================================
+
+
+def area_place(product, area=None):
+    """
+    :param product: forecast product code, i.e. IDV10450
+    :param area: the area's AAC or description, None for the product's default area
+    :return: the forecast place code for an area of a product
+    """
+    return f"{product}{AREA_SEPARATOR}{area}" if area else product
+
+
+def split_area_place(forecast_place):
+    """
+    :return: (forecast product code, area AAC or description), area "" for the product's default area
+    """
+    product, _, area = forecast_place.partition(AREA_SEPARATOR)
+    return product, area
+
+
+# =============================================================================
+
+
+def parse_product_areas(xml_bytes, decode, amoc=None):
+    """
+    stream a forecast product, decoding the forecast periods of every area
+
+    :param xml_bytes: the forecast product XML
+    :param decode: called with (list of period <element>s, period start-time-local) for each period
+    :param amoc: optional dict, filled in with the product's <amoc> header fields, i.e. next-routine-issue-time-utc
+    :return: list of (area AAC, area description, list of decode results, one per period), in product order
+    """
+    areas = []
+    periods = None
+    depth = 0
+    section = None
+    for event, elem in iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            # product(1)/forecast(2)/area(3)
+            if depth == 2:
+                section = elem.tag
+            elif depth == 3 and elem.tag == "area":
+                periods = []
+                areas.append((elem.get("aac"), elem.get("description"), periods))
+            continue
+        depth -= 1
+        if depth == 2 and section == "amoc":
+            if amoc is not None:
+                amoc[elem.tag] = elem.text
+        elif depth == 2 and elem.tag == "area":
+            elem.clear()
+        elif periods is not None and elem.tag == "forecast-period":
+            periods.append(decode(elem.findall("element"), elem.get("start-time-local")))
+            elem.clear()
+    return areas
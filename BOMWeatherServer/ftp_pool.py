@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+import ftplib
+import io
+import time
+
+
+# =============================================================================
+
+
+FTP_TIMEOUT = (10, 30)      # (connect, read) seconds
+FTP_DEADLINE = 120          # seconds a whole download may take, however steadily it trickles in
+KEEPALIVE_INTERVAL = 60     # seconds idle before a session is probed with NOOP
+MAX_IDLE = 240              # seconds idle before a session is dropped rather than reused
+
+
+# =============================================================================
+
+
+class FTPPool(object):
+    """
+    a pool of logged-in anonymous FTP sessions to one host, reused across downloads
+    """
+    def __init__(self, host, port=21, size=4, timeout=FTP_TIMEOUT, deadline=FTP_DEADLINE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.deadline = deadline
+        self.lock = Lock()
+        self.idle = []              # [(FTP, last used time)], most recently used last
+        self.slots = BoundedSemaphore(size)
+        return
+
+    def _connect(self):
+        connect_timeout, read_timeout = self.timeout
+        ftp = ftplib.FTP(timeout=connect_timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login()
+        # binary mode throughout, so SIZE is meaningful and RETR needs no line translation
+        ftp.voidcmd("TYPE I")
+        # data connections are opened with the same timeout
+        ftp.timeout = read_timeout
+        ftp.sock.settimeout(read_timeout)
+        return ftp
+
+    @staticmethod
+    def _discard(ftp):
+        try:
+            ftp.close()
+        except Exception:
+            pass
+        return
+
+    def _checkout(self, fresh):
+        while not fresh:
+            with self.lock:
+                if not self.idle:
+                    break
+                ftp, last_used = self.idle.pop()
+            idle_time = time.time() - last_used
+            if idle_time > MAX_IDLE:
+                self._discard(ftp)
+                continue
+            if idle_time > KEEPALIVE_INTERVAL:
+                try:
+                    ftp.voidcmd("NOOP")
+                except ftplib.all_errors:
+                    self._discard(ftp)
+                    continue
+            return ftp
+        return self._connect()
+
+    @contextmanager
+    def session(self, fresh=False):
+        """
+        borrow a session from the pool, blocking while all sessions are busy.
+        A session that raises is closed rather than returned to the pool.
+
+        :param fresh: True => don't reuse an idle session
+        """
+        with self.slots:
+            ftp = self._checkout(fresh)
+            try:
+                yield ftp
+            except BaseException:
+                self._discard(ftp)
+                raise
+            with self.lock:
+                self.idle.append((ftp, time.time()))
+        return
+
+    @staticmethod
+    def _stamp(ftp, path):
+        try:
+            modified = ftp.sendcmd("MDTM " + path)
+            size = ftp.size(path)
+        except ftplib.error_perm:
+            # server won't tell us, so the file can't be checked for changes
+            return None
+        return modified, size
+
+    def fetch_if_changed(self, path, stamp=None):
+        """
+        download a file, unless its modification time and size match a previous download.
+        A stale pooled session is replaced and the download retried once, within the one deadline.
+
+        :param path: path of the file on the server
+        :param stamp: the stamp returned by a previous download of this file, or None
+        :return: (stamp, file content as bytes), content is None if the file is unchanged
+        """
+        deadline = time.time() + self.deadline
+
+        def write(data):
+            if time.time() > deadline:
+                raise TimeoutError(f"download of {path} took over {self.deadline}s")
+            out_bytes.write(data)
+            return
+
+        for attempt in range(2):
+            try:
+                with self.session(fresh=(attempt > 0)) as ftp:
+                    new_stamp = self._stamp(ftp, path)
+                    if new_stamp is not None and new_stamp == stamp:
+                        return stamp, None
+                    out_bytes = io.BytesIO()
+                    ftp.retrbinary("RETR " + path, write)
+                    return new_stamp, out_bytes.getvalue()
+            except (OSError, EOFError, ftplib.error_temp, ftplib.error_reply):
+                if attempt > 0 or time.time() > deadline:
+                    raise
+        return stamp, None
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for ftp, _ in idle:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                self._discard(ftp)
+        return
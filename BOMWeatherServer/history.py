@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from array import array
+import math
+
+from BOMWeatherServer.records import MISSING, present
+from BOMWeatherServer.timestamps import parse_aifstime
+
+
+# =============================================================================
+
+
+# observation record members kept, all numbers (rain_trace being rain since 9am, as text)
+HISTORY_FIELDS = ("air_temp", "apparent_t", "dewpt", "rel_hum", "wind_spd_kmh", "gust_kmh", "press", "rain_trace")
+HISTORY_DIGITS = 2          # values are held single precision, so are rounded to this many decimal places when served
+
+
+# =============================================================================
+
+
+def _decode_value(value):
+    # missing values are null, or "-" in the text members
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def _served(value):
+    # JSON has no NaN
+    return round(value, HISTORY_DIGITS) if present(value) else None
+
+
+def record_time(record):
+    """
+    :param record: an observation record
+    :return: its time in seconds since the epoch, MISSING if it has none
+    """
+    try:
+        return parse_aifstime(record["aifstime_utc"])
+    except (KeyError, TypeError, ValueError):
+        return MISSING
+
+
+# =============================================================================
+
+
+class ObservationHistory(object):
+    """
+    a place's recent observation records, in a fixed-size ring of arrays - one of times, one per field.
+    Once full, each record merged in overwrites the oldest.
+    """
+    __slots__ = ("capacity", "times", "values", "start", "count")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array("d", [MISSING]) * capacity
+        self.values = tuple(array("f", [MISSING]) * capacity for _ in HISTORY_FIELDS)
+        self.start = 0              # ring position of the oldest record
+        self.count = 0
+        return
+
+    def high_water(self):
+        """
+        :return: time of the newest record held, MISSING if none
+        """
+        if not self.count:
+            return MISSING
+        return self.times[(self.start + self.count - 1) % self.capacity]
+
+    def is_newer(self, record):
+        """
+        :return: True => the record is newer than any held
+        """
+        newest = self.high_water()
+        timestamp = record_time(record)
+        return present(timestamp) and (not present(newest) or timestamp > newest)
+
+    def merge(self, records):
+        """
+        add the records newer than any held
+
+        :param records: observation records, newest first
+        :return: number of records added
+        """
+        newest = self.high_water()
+        added = []
+        for record in records:
+            timestamp = record_time(record)
+            if not present(timestamp):
+                continue
+            if present(newest) and timestamp <= newest:
+                break
+            added.append((timestamp, record))
+        # only the newest capacity of them would survive
+        for timestamp, record in reversed(added[:self.capacity]):
+            self._append(timestamp, [_decode_value(record.get(field)) for field in HISTORY_FIELDS])
+        return len(added)
+
+    def merge_series(self, series):
+        """
+        add the records of a series newer than any held, i.e. as another node's history serves them
+
+        :param series: as series() returns it, with every field
+        :return: number of records added
+        """
+        newest = self.high_water()
+        columns = [series[field] for field in HISTORY_FIELDS]
+        added = 0
+        for index, timestamp in enumerate(series["timestamp"]):
+            if present(newest) and timestamp <= newest:
+                continue
+            self._append(timestamp, [_decode_value(column[index]) for column in columns])
+            newest = timestamp
+            added += 1
+        return added
+
+    def _append(self, timestamp, record_values):
+        # NOTE: the record must be newer than any held
+        if self.count < self.capacity:
+            position = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[position] = timestamp
+        for value, values in zip(record_values, self.values):
+            values[position] = value
+        return
+
+    def _position(self, index):
+        return (self.start + index) % self.capacity
+
+    def _first_at(self, timestamp):
+        """
+        :return: index (oldest first) of the first record at or after the time
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._position(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _indices(self, start, end):
+        """
+        :return: range of indices (oldest first) of the records from start up to, but not including, end
+        """
+        first = 0 if start is None else self._first_at(start)
+        last = self.count if end is None else self._first_at(end)
+        return range(first, max(first, last))
+
+    def series(self, start=None, end=None, fields=HISTORY_FIELDS):
+        """
+        :param start: earliest record time wanted, None => from the oldest
+        :param end: record times wanted are before this, None => up to the newest
+        :param fields: members wanted, from HISTORY_FIELDS
+        :return: {timestamp:[<float>], <field>:[<float or None>], ...}, oldest first
+        """
+        positions = [self._position(index) for index in self._indices(start, end)]
+        results = dict(timestamp=[self.times[position] for position in positions])
+        for field in fields:
+            values = self.values[HISTORY_FIELDS.index(field)]
+            results[field] = [_served(values[position]) for position in positions]
+        return results
+
+    def buckets(self, width, start=None, end=None, fields=HISTORY_FIELDS):
+        """
+        downsample records into buckets of a fixed width, aligned to multiples of it since the epoch
+
+        :param width: bucket width in seconds
+        :param start: earliest record time wanted, None => from the oldest
+        :param end: record times wanted are before this, None => up to the newest
+        :param fields: members wanted, from HISTORY_FIELDS
+        :return: {timestamp:[<bucket start>], count:[<int>], <field>:{min:[...], max:[...], mean:[...]}, ...},
+        oldest first, skipping empty buckets. Values are None for buckets without any of a field.
+        """
+        columns = [(field, self.values[HISTORY_FIELDS.index(field)]) for field in fields]
+        results = dict(timestamp=[], count=[])
+        for field in fields:
+            results[field] = dict(min=[], max=[], mean=[])
+        bucket = None
+        positions = []
+        for index in list(self._indices(start, end)) + [None]:
+            position = None if index is None else self._position(index)
+            this_bucket = None if index is None else math.floor(self.times[position] / width) * width
+            if this_bucket != bucket and positions:
+                results["timestamp"].append(float(bucket))
+                results["count"].append(len(positions))
+                for field, values in columns:
+                    present_values = [values[held] for held in positions if present(values[held])]
+                    summary = results[field]
+                    if present_values:
+                        summary["min"].append(_served(min(present_values)))
+                        summary["max"].append(_served(max(present_values)))
+                        summary["mean"].append(_served(sum(present_values) / len(present_values)))
+                    else:
+                        for statistic in summary.values():
+                            statistic.append(None)
+                positions = []
+            bucket = this_bucket
+            if position is not None:
+                positions.append(position)
+        return results
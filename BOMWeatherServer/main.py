@@ -2,19 +2,45 @@
 # coding=utf-8
 
 from functools import partial
-from http.server import HTTPServer
+from multiprocessing.connection import wait
+from threading import Thread
 import argparse
+import math
+import multiprocessing
+import os
+import time
 
 import BOMWeatherServer
 from BOMWeatherServer.version import __version__, __description__
 from bom_weather_monitor import BOMWeatherMonitor
-from bom_weather_server import MyServerHandler
+from bom_weather_server import InvalidPlaceCode, MyServerHandler, SharedWeatherService, WeatherService
+from BOMWeatherServer.servers import SERVER_MODES, make_server
+from BOMWeatherServer.shared_cache import SharedWeatherPublisher, SharedWeatherReader, SharedWeatherWriter, \
+    shared_cache_size
+from BOMWeatherServer.snapshot import load_snapshot
 
 # =============================================================================
 
 
 OBSERVATION_INTERVAL = 10  # 10 seconds
 FORECAST_INTERVAL = 15  # 15 seconds
+MAX_REFRESH = 1800  # 30 minutes
+DEMAND_WINDOW = 900  # 15 minutes
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 60  # 60 seconds
+HTTP_WORKERS = 16
+KEEPALIVE_TIMEOUT = 15  # 15 seconds
+FETCH_WORKERS = 8
+MAX_STREAMS = 16
+MAX_INFLIGHT = 64
+CLIENT_RATE = 10  # 10 requests a second
+CLIENT_BURST = 50
+CLIENT_PLACES = 30  # 30 new places a minute
+SNAPSHOT_INTERVAL = 60  # 60 seconds
+MAX_PLACES = 500
+PLACE_TTL = 3600  # 1 hour
+HISTORY_LENGTH = 288  # 6 days of half-hourly observations
+PREWARM_TIMEOUT = 120  # 2 minutes
 
 
 # =============================================================================
@@ -29,6 +55,64 @@ class Globals(object):
 # =============================================================================
 
 
+def _number(value, convert):
+    try:
+        number = convert(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid {convert.__name__} value: '{value}'")
+    if not -math.inf < number < math.inf:
+        raise argparse.ArgumentTypeError(f"must be a finite number, not {value}")
+    return number
+
+
+def positive_int(value):
+    """
+    argparse type for counts that must be at least 1
+
+    :raise ArgumentTypeError: not an integer, or less than 1
+    """
+    number = _number(value, int)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def non_negative_int(value):
+    """
+    argparse type for counts where 0 turns something off
+
+    :raise ArgumentTypeError: not an integer, or less than 0
+    """
+    number = _number(value, int)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, not {number}")
+    return number
+
+
+def positive_float(value):
+    """
+    argparse type for durations and rates that must be more than 0
+
+    :raise ArgumentTypeError: not a finite number, or not more than 0
+    """
+    number = _number(value, float)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be more than 0, not {value}")
+    return number
+
+
+def non_negative_float(value):
+    """
+    argparse type for durations and rates where 0 turns something off
+
+    :raise ArgumentTypeError: not a finite number, or less than 0
+    """
+    number = _number(value, float)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, not {value}")
+    return number
+
+
 def arg_parser():
     """
     parse arguments
@@ -39,28 +123,250 @@ def arg_parser():
                                      description=f"{BOMWeatherServer.__name__} - {__description__}", add_help=False)
     parser.add_argument("-l", "--listener", help="listener name/address. 0.0.0.0 for any listener.", required=True)
     parser.add_argument("-p", "--port", type=int, help="port#", required=True)
+    parser.add_argument("-s", "--server", choices=SERVER_MODES, default="threaded",
+                        help="HTTP front end. simple serves one request at a time, "
+                             "prefork serves from --processes worker processes (default: threaded)")
+    parser.add_argument("--processes", type=positive_int, default=os.cpu_count(),
+                        help=f"worker processes for the prefork front end (default: {os.cpu_count()})")
+    parser.add_argument("-w", "--workers", type=positive_int, default=HTTP_WORKERS,
+                        help=f"max concurrent request workers for threaded/asyncio front ends (default: {HTTP_WORKERS})")
+    parser.add_argument("--max-streams", type=positive_int, default=MAX_STREAMS,
+                        help=f"max concurrent /events streams (default: {MAX_STREAMS})")
+    parser.add_argument("--max-inflight", type=non_negative_int, default=MAX_INFLIGHT,
+                        help=f"max requests served or waiting for a worker at once, beyond which requests are "
+                             f"refused with 503. New places are refused from half this. 0 for no limit "
+                             f"(default: {MAX_INFLIGHT})")
+    parser.add_argument("--client-rate", type=non_negative_float, default=CLIENT_RATE,
+                        help=f"requests a second allowed each client on average, beyond which requests are "
+                             f"refused with 429. 0 for no limit (default: {CLIENT_RATE})")
+    parser.add_argument("--client-burst", type=non_negative_int, default=CLIENT_BURST,
+                        help=f"requests each client may make at once (default: {CLIENT_BURST})")
+    parser.add_argument("--client-places", type=non_negative_int, default=CLIENT_PLACES,
+                        help=f"new places each client may request a minute, 0 for no limit (default: {CLIENT_PLACES})")
+    parser.add_argument("--forwarded-for", action="store_true",
+                        help="identify clients by the address a load balancer appends to X-Forwarded-For")
+    parser.add_argument("--keepalive", type=positive_float, default=KEEPALIVE_TIMEOUT,
+                        help=f"idle keep-alive connection timeout in seconds (default: {KEEPALIVE_TIMEOUT})")
+    parser.add_argument("--fetch-workers", type=positive_int, default=FETCH_WORKERS,
+                        help=f"max concurrent observation/forecast fetches (default: {FETCH_WORKERS})")
+    parser.add_argument("--observation-interval", type=positive_float, default=OBSERVATION_INTERVAL,
+                        help=f"seconds between observation refreshes while a new record is overdue "
+                             f"(default: {OBSERVATION_INTERVAL})")
+    parser.add_argument("--forecast-interval", type=positive_float, default=FORECAST_INTERVAL,
+                        help=f"seconds between forecast refreshes while a new issue is overdue "
+                             f"(default: {FORECAST_INTERVAL})")
+    parser.add_argument("--max-refresh", type=positive_float, default=MAX_REFRESH,
+                        help=f"max seconds between refreshes of a place, however far off its next update "
+                             f"(default: {MAX_REFRESH})")
+    parser.add_argument("--demand-window", type=positive_float, default=DEMAND_WINDOW,
+                        help=f"seconds without a request before a place stops being refreshed, "
+                             f"until it is requested again (default: {DEMAND_WINDOW})")
+    parser.add_argument("--breaker-threshold", type=positive_int, default=BREAKER_THRESHOLD,
+                        help=f"consecutive failed fetches from a BoM server before fetches from it are suspended "
+                             f"(default: {BREAKER_THRESHOLD})")
+    parser.add_argument("--breaker-reset", type=positive_float, default=BREAKER_RESET,
+                        help=f"seconds fetches are suspended before a trial fetch (default: {BREAKER_RESET})")
+    parser.add_argument("--max-places", type=positive_int, default=MAX_PLACES,
+                        help=f"max observation (and forecast) places tracked. "
+                             f"The least recently requested is dropped to make room (default: {MAX_PLACES})")
+    parser.add_argument("--place-ttl", type=positive_float, default=PLACE_TTL,
+                        help=f"seconds without a request before a place is dropped (default: {PLACE_TTL})")
+    parser.add_argument("--history-length", type=non_negative_int, default=HISTORY_LENGTH,
+                        help=f"observation records kept per place for /history, 0 to keep none "
+                             f"(default: {HISTORY_LENGTH})")
+    parser.add_argument("--places", nargs="+", default=[], metavar="PAIR",
+                        help="observation:forecast[/area] place code pairs to fetch at startup")
+    parser.add_argument("--places-file",
+                        help="file of observation:forecast[/area] place code pairs to fetch at startup, one per line")
+    parser.add_argument("--prewarm-timeout", type=non_negative_float, default=PREWARM_TIMEOUT,
+                        help=f"max seconds /ready waits for the places to fetch at startup "
+                             f"(default: {PREWARM_TIMEOUT})")
+    parser.add_argument("--peers", nargs="+", default=[], metavar="URL",
+                        help="base URLs (http://<host>:<port>) of every node sharing fetches, this one included. "
+                             "Each node fetches its share of the places from the BoM, and the rest from the others")
+    parser.add_argument("--node", metavar="URL", help="base URL of this node, as given in --peers")
+    parser.add_argument("--snapshot", help="file to save fetched weather to, and resume from on startup")
+    parser.add_argument("--snapshot-interval", type=positive_float, default=SNAPSHOT_INTERVAL,
+                        help=f"seconds between snapshot saves (default: {SNAPSHOT_INTERVAL})")
+    parser.add_argument("--profile", metavar="FOLDER",
+                        help="serve /profile, writing CPU and memory profiles taken on demand to this folder")
     parser.add_argument("-v", "--verbose", help="verbose mode", action="store_true")
     parser.add_argument("--version", action="version", version=f"{BOMWeatherServer.__name__} {__version__}")
     parser.add_argument("-?", "--help", help="show help message and quit", action="help")
     args = parser.parse_args()
+    if args.client_rate > 0 and args.client_burst < 1:
+        parser.error("--client-burst must be at least 1, or every request would be refused")
+    args.prewarm = prewarm_pairs(parser, args)
+    args.peers = peer_nodes(parser, args)
     return args
 
 
+def prewarm_pairs(parser, my_args):
+    """
+    :return: list of (observation place, forecast place) to fetch at startup, from --places and --places-file
+    """
+    texts = list(my_args.places)
+    if my_args.places_file:
+        try:
+            with open(my_args.places_file) as places_file:
+                for line in places_file:
+                    line = line.split("#")[0].strip()
+                    if line:
+                        texts.append(line)
+        except OSError as ex:
+            parser.error(f"can't read --places-file {type(ex)}/{ex}")
+    pairs = []
+    for text in texts:
+        try:
+            pair = WeatherService.validate_pair(text)
+        except InvalidPlaceCode as ex:
+            parser.error(f"place code {ex.place_code} is not valid")
+        except ValueError:
+            parser.error(f"{text} is not an observation:forecast place code pair")
+        else:
+            if pair not in pairs:
+                pairs.append(pair)
+    if len(pairs) > my_args.max_places:
+        parser.error(f"{len(pairs)} places to fetch at startup, but only --max-places {my_args.max_places} tracked")
+    return pairs
+
+
+def peer_nodes(parser, my_args):
+    """
+    :return: list of the base URLs of the nodes sharing fetches, empty unless in peer mode
+    """
+    nodes = []
+    for url in my_args.peers:
+        url = url.rstrip("/")
+        if not url.startswith(("http://", "https://")):
+            parser.error(f"peer {url} is not an http://<host>:<port> URL")
+        if url not in nodes:
+            nodes.append(url)
+    if not nodes:
+        return nodes
+    if my_args.server == "prefork":
+        parser.error("--peers isn't supported with the prefork front end")
+    if my_args.node is None or my_args.node.rstrip("/") not in nodes:
+        parser.error("--node must give this node's URL, as in --peers")
+    my_args.node = my_args.node.rstrip("/")
+    return nodes
+
+
+# =============================================================================
+
+
+def report_prewarm(my_args, monitor):
+    """
+    report once the places to fetch at startup have all been fetched, or --prewarm-timeout is up
+    """
+    start = time.time()
+    pending = monitor.wait_for_pairs(my_args.prewarm, my_args.prewarm_timeout)
+    print(f"Fetched {len(my_args.prewarm) - len(pending)} of {len(my_args.prewarm)} places at startup "
+          f"in {time.time() - start:.1f}s")
+    for observation_place, forecast_place in pending:
+        print(f"Error: no weather for {observation_place}:{forecast_place} after {my_args.prewarm_timeout}s")
+    return
+
+
+def make_monitor(my_args, my_globals):
+    monitor = BOMWeatherMonitor(my_args, my_globals, my_args.observation_interval, my_args.forecast_interval)
+    if my_args.snapshot:
+        state = load_snapshot(my_args.snapshot)
+        if state:
+            monitor.restore_snapshot(state)
+    monitor.prewarm(my_args.prewarm)
+    return monitor
+
+
+def start_monitor(my_args, monitor):
+    monitor.start()
+    if my_args.prewarm:
+        Thread(target=report_prewarm, args=(my_args, monitor), name="prewarm", daemon=True).start()
+    return
+
+
+def stop_monitor(my_args, monitor):
+    monitor.stop()
+    if my_args.snapshot:
+        monitor.write_snapshot()
+    return
+
+
+# =============================================================================
+
+
+def serve_worker(my_args, shm, demand_queue):
+    """
+    serve requests in a prefork worker process, from the weather the fetcher process publishes
+    """
+    my_globals = Globals()
+    reader = SharedWeatherReader(shm, demand_queue, my_globals)
+    service = SharedWeatherService(my_args, reader)
+    handler = partial(MyServerHandler, service)
+    server = make_server(my_args, ('', my_args.port), handler, service)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    my_globals.running = False
+    server.server_close()
+    return
+
+
+def serve_prefork(my_args, my_globals):
+    """
+    fetch weather in this process, and serve requests from worker processes forked off it
+    """
+    writer = SharedWeatherWriter(shared_cache_size(my_args.max_places))
+    context = multiprocessing.get_context("fork")
+    demand_queue = context.Queue()
+    # fork before the monitor starts any threads
+    workers = [context.Process(target=serve_worker, args=(my_args, writer.shm, demand_queue), name=f"worker-{n}")
+               for n in range(my_args.processes)]
+    for worker in workers:
+        worker.start()
+    monitor = make_monitor(my_args, my_globals)
+    publisher = SharedWeatherPublisher(monitor, writer, demand_queue, my_globals)
+    print(f"{BOMWeatherServer.__name__} started http://{my_args.listener}:{my_args.port} "
+          f"({my_args.server} x {my_args.processes})")
+    start_monitor(my_args, monitor)
+    publisher.start()
+    try:
+        wait([worker.sentinel for worker in workers])
+        print("Error: worker process exited")
+    except KeyboardInterrupt:
+        pass
+    my_globals.running = False
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    stop_monitor(my_args, monitor)
+    writer.close()
+    return
+
+
 # =============================================================================
 
 
 def main():
     my_args = arg_parser()
     my_globals = Globals()
-    monitor = BOMWeatherMonitor(my_args, my_globals, OBSERVATION_INTERVAL, FORECAST_INTERVAL)
-    handler = partial(MyServerHandler, my_args, monitor)
-    server = HTTPServer(('', my_args.port), handler)
-    print(f"{BOMWeatherServer.__name__} started http://{my_args.listener}:{my_args.port}")
-    monitor.start()
+    if my_args.server == "prefork":
+        serve_prefork(my_args, my_globals)
+        print(f"{BOMWeatherServer.__name__} stopped")
+        return
+    monitor = make_monitor(my_args, my_globals)
+    service = WeatherService(my_args, monitor)
+    handler = partial(MyServerHandler, service)
+    server = make_server(my_args, ('', my_args.port), handler, service)
+    print(f"{BOMWeatherServer.__name__} started http://{my_args.listener}:{my_args.port} ({my_args.server})")
+    start_monitor(my_args, monitor)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         my_globals.running = False
+    stop_monitor(my_args, monitor)
     server.server_close()
     print(f"{BOMWeatherServer.__name__} stopped")
     return
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from bisect import bisect_left
+from threading import Lock
+import time
+
+
+# =============================================================================
+
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# =============================================================================
+
+
+def _format_labels(label_names, label_values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# =============================================================================
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.lock = Lock()
+        self.values = {}            # {(label value, ...):value}
+        REGISTRY.append(self)
+        return
+
+    def remove(self, *label_values):
+        """
+        forget one set of label values, i.e. for a place no longer tracked
+        """
+        with self.lock:
+            self.values.pop(label_values, None)
+        return
+
+    def _samples(self):
+        with self.lock:
+            return [(key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in sorted(self._samples()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+# =============================================================================
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+        return
+
+
+# =============================================================================
+
+
+class Gauge(Metric):
+    """
+    a gauge whose samples are collected when rendered
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name, description, label_names=(), collect=None):
+        super(Gauge, self).__init__(name, description, label_names)
+        self.collect = collect      # callable returning {(label value, ...):value}
+        return
+
+    def _samples(self):
+        return list(self.collect().items()) if self.collect else []
+
+
+# =============================================================================
+
+
+class CollectedCounter(Gauge):
+    """
+    a counter kept elsewhere, i.e. by another process, whose samples are collected when rendered
+    """
+    metric_type = "counter"
+
+
+# =============================================================================
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = buckets
+        return
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # per bucket counts (the last for +Inf), then the sum
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        return
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            samples = sorted((key, list(counts)) for key, counts in self.values.items())
+        for label_values, counts in samples:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# =============================================================================
+
+
+class _Timer(object):
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+        self.start = None
+        return
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+# =============================================================================
+
+
+class TimedLock(object):
+    """
+    a Lock recording how long each acquisition waited
+    """
+    def __init__(self, histogram):
+        self.lock = Lock()
+        self.histogram = histogram
+        return
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self.histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+        return
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+        return False
+
+
+# =============================================================================
+
+
+REGISTRY = []
+
+
+def render():
+    """
+    :return: every metric, in Prometheus text exposition format (bytes)
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode("utf8")
+
+
+REQUESTS = Counter("bom_http_requests_total", "HTTP requests served, by endpoint and status code",
+                   ("endpoint", "code"))
+REQUEST_LATENCY = Histogram("bom_http_request_duration_seconds", "time to build HTTP responses, by endpoint",
+                            ("endpoint",))
+LOCK_WAIT = Histogram("bom_weather_lock_wait_seconds", "time spent waiting to acquire the weather lock")
+FETCH_DURATION = Histogram("bom_fetch_duration_seconds", "upstream download time, by product kind and place",
+                           ("kind", "place"))
+PARSE_DURATION = Histogram("bom_parse_duration_seconds", "upstream product parse time, by product kind and place",
+                           ("kind", "place"))
+STAGE_DURATION = Histogram("bom_stage_duration_seconds", "time taken by each stage of fetching and serving weather, "
+                           "by stage, across all places", ("stage",))
+PEER_FETCHES = Counter("bom_peer_fetches_total", "places fetched from the peer nodes owning them, by product kind "
+                       "and result (ok, not_modified, pending, failed or suspended)", ("kind", "result"))
+UPSTREAM_ERRORS = Counter("bom_upstream_errors_total", "failed upstream fetches, by product kind and place",
+                          ("kind", "place"))
+DATA_AGE = Gauge("bom_data_age_seconds", "time since data was last fetched, by product kind and place",
+                 ("kind", "place"))
+UPSTREAM_SUSPENDED = Gauge("bom_upstream_suspended", "1 while fetches from a BoM server are suspended, by product kind",
+                           ("kind",))
+PLACES_TRACKED = Gauge("bom_places_tracked", "places currently tracked, by product kind", ("kind",))
+PLACES_EVICTED = Counter("bom_places_evicted_total", "places no longer tracked, by product kind and reason",
+                         ("kind", "reason"))
+REQUESTS_REFUSED = Counter("bom_http_requests_refused_total", "HTTP requests turned away by admission control, "
+                           "by reason (busy, shed, rate or places)", ("reason",))
+REQUESTS_IN_FLIGHT = Gauge("bom_http_requests_in_flight", "HTTP requests being served or waiting for a worker")
+SHARED_CACHE_OVERFLOWS = CollectedCounter("bom_shared_cache_overflows_total", "publishes of the weather to prefork "
+                                          "workers dropped as too big for the shared cache")
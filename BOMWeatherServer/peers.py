@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from bisect import bisect
+from urllib.parse import urlencode
+import hashlib
+
+from BOMWeatherServer.circuit_breaker import CircuitBreaker
+
+
+# =============================================================================
+
+
+RING_POINTS = 64            # points per node on the hash ring, so places split evenly between a few nodes
+PEER_TIMEOUT = (2, 5)       # (connect, read) seconds - a peer slower than this is left for the BoM
+PEER_LAG = 2                # seconds after the owner's refresh to fetch from it, allowing for the refresh itself
+PEER_WAIT = 3               # seconds the owner holds a peer's request for a place it's yet to fetch
+RING_HEADER = "X-Peer-Ring"         # fingerprint of the requesting node's peer list
+REFRESH_HEADER = "X-Peer-Refresh"   # seconds until the owner next refreshes the place
+
+
+# =============================================================================
+
+
+class PeerUnavailable(Exception):
+    pass
+
+
+# =============================================================================
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode("utf8")).digest()[:8], "big")
+
+
+# =============================================================================
+
+
+class HashRing(object):
+    """
+    consistent hashing of places to nodes. Every node builds the same ring from the same node list,
+    so they all agree on each place's owner, and adding or removing a node moves only the places it owns.
+    """
+    def __init__(self, nodes, points=RING_POINTS):
+        ring = sorted((_ring_hash(f"{node}#{point}"), node) for node in nodes for point in range(points))
+        self.hashes = [point_hash for point_hash, _ in ring]
+        self.nodes = [node for _, node in ring]
+        self.fingerprint = hashlib.sha1("\n".join(sorted(nodes)).encode("utf8")).hexdigest()
+        return
+
+    def owner(self, key):
+        """
+        :param key: observation place or forecast product code
+        :return: the node that fetches it from the BoM
+        """
+        return self.nodes[bisect(self.hashes, _ring_hash(key)) % len(self.nodes)]
+
+
+# =============================================================================
+
+
+class PeerReply(object):
+    """
+    a place as fetched from the node owning it
+    """
+    def __init__(self, status, state=None, etag=None, age=0.0, refresh=0.0):
+        self.status = status        # 200, 304 => unchanged since etag, 451 => owner's first fetch still pending
+        self.state = state          # what the owner serves to peers, as decoded JSON, None unless status is 200
+        self.etag = etag
+        self.age = age              # seconds since the owner fetched the place
+        self.refresh = refresh      # seconds until the owner next refreshes it, or retries if pending
+        return
+
+
+# =============================================================================
+
+
+class Peers(object):
+    """
+    the nodes sharing their fetches, each fetching its share of the places from the BoM and the rest from each other
+    """
+    def __init__(self, nodes, node, breaker_threshold, breaker_reset):
+        """
+        :param nodes: base URLs of every node, this one included
+        :param node: base URL of this node
+        """
+        self.node = node
+        self.ring = HashRing(nodes)
+        # one per peer, so a peer that's down is left alone and its places fetched from the BoM
+        self.breakers = {peer: CircuitBreaker(f"peer {peer}", breaker_threshold, breaker_reset)
+                         for peer in nodes if peer != node}
+        return
+
+    def owner(self, key):
+        """
+        :param key: observation place or forecast product code
+        :return: base URL of the node owning it, None if this node does
+        """
+        owner = self.ring.owner(key)
+        return None if owner == self.node else owner
+
+    def fetch(self, session, owner, kind, place, etag=None, since=None):
+        """
+        fetch a place from the node owning it
+
+        :param session: requests.Session to fetch with
+        :param kind: observation or forecast
+        :param place: observation place, or forecast product
+        :param etag: entity tag of the place as last fetched from the owner, None if not fetched from it
+        :param since: time of the newest observation history record held, None if none
+        :return: PeerReply, None if fetches from the owner are suspended
+        :raise PeerUnavailable: the owner is down, or wouldn't give us the place
+        """
+        import requests
+        breaker = self.breakers[owner]
+        if not breaker.allow():
+            return None
+        parameters = {kind: place}
+        if since is not None:
+            parameters["since"] = repr(since)
+        headers = {RING_HEADER: self.ring.fingerprint}
+        if etag:
+            headers["If-None-Match"] = etag
+        try:
+            resp = session.get(f"{owner}/peer?{urlencode(parameters)}", headers=headers, timeout=PEER_TIMEOUT)
+            if resp.status_code not in (200, 304, 451):
+                raise PeerUnavailable(f"HTTP {resp.status_code} {resp.text[:200]}")
+            if resp.status_code == 451:
+                reply = PeerReply(451, refresh=float(resp.headers.get("Retry-After", PEER_LAG)))
+            else:
+                reply = PeerReply(resp.status_code, resp.json() if resp.status_code == 200 else None,
+                                  resp.headers.get("ETag"), float(resp.headers.get("Age", 0)),
+                                  float(resp.headers.get(REFRESH_HEADER, 0)))
+        except (requests.RequestException, ValueError) as ex:
+            breaker.record_failure()
+            raise PeerUnavailable(f"{type(ex)}/{ex}")
+        except PeerUnavailable:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return reply
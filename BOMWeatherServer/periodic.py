@@ -3,28 +3,46 @@ import math
 
 
 class Periodic(object):
-    def __init__(self, period, task, name=None):
+    # one per tracked place
+    __slots__ = ("period", "task", "name", "start_time", "num_periods", "running", "next_time")
+
+    def __init__(self, period, task, name=None, start_time=None):
         self.period = period
         self.task = task
         self.name = name
-        self.start_time = time.time()
+        self.start_time = start_time or time.time()
         self.num_periods = -1
-        self.last_time = 0
+        self.running = False
+        self.next_time = None
         return
 
-    def check(self, arg=None):
+    def run(self, arg=None):
         """
-        check the periodic action
+        perform the task now, skipping any periods missed while it was waiting
         :param arg: optional argument for managed task
-        :return: True => performed task, False => otherwise, time left to next task performance
         """
         time_now = time.time()
-        elapsed_periods = math.floor((time_now - self.start_time) / self.period)
-        remainder = (time_now - self.start_time) % self.period
-        time_left = max(0, (self.period - remainder))
-        if elapsed_periods > self.num_periods:
-            self.num_periods += 1
-            self.last_time = time_now
+        self.num_periods = max(self.num_periods + 1, math.floor((time_now - self.start_time) / self.period))
+        self.next_time = None
+        self.running = True
+        try:
             self.task(arg)
-            return True, time_left
-        return False, time_left
+        finally:
+            self.running = False
+        return
+
+    def reschedule(self, due_time):
+        """
+        perform the task next at due_time rather than at the end of the period, i.e. when the task knows better
+        :param due_time: time of the next task performance
+        """
+        self.next_time = due_time
+        return
+
+    def due_time(self):
+        """
+        :return: time of the next task performance
+        """
+        if self.next_time is not None:
+            return self.next_time
+        return self.start_time + (self.num_periods + 1) * self.period
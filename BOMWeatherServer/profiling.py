@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from threading import Lock, enumerate as threads, get_ident
+import os
+import sys
+import time
+import tracemalloc
+
+
+# =============================================================================
+
+
+SAMPLE_INTERVAL = 0.005     # seconds between CPU profile samples
+MAX_PROFILE_SECONDS = 300
+TRACEMALLOC_FRAMES = 16     # frames kept per traced allocation
+TOP_ENTRIES = 20            # functions or lines summarised in responses
+
+
+# =============================================================================
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+# =============================================================================
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _cpu_clock(ident):
+    """
+    :return: CPU clock id of a thread, None if its CPU time can't be read (i.e. not on Linux)
+    """
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+def _top(totals, count=TOP_ENTRIES):
+    return [dict(function=label, cpu_seconds=round(seconds, 6))
+            for label, seconds in sorted(totals.items(), key=lambda item: -item[1])[:count]]
+
+
+# =============================================================================
+
+
+class Profiler(object):
+    """
+    profiles a running server on demand, writing the profiles to a folder.
+    CPU profiles sample every thread's stack, weighting each sample by the CPU time the thread used since the one
+    before (where thread CPU clocks can be read), so threads waiting on the network or a lock don't count.
+    Memory profiles are tracemalloc snapshots, traced only between start and stop, as tracing slows every allocation.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = Lock()          # one profile at a time
+        self.last_snapshot = None   # tracemalloc.Snapshot, to compare the next with
+        os.makedirs(folder, exist_ok=True)
+        return
+
+    def _path(self, kind, suffix):
+        return os.path.join(self.folder, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{suffix}")
+
+    def profile_cpu(self, seconds):
+        """
+        sample the stacks of every thread for a while, writing them as collapsed stacks (i.e. for flamegraph.pl)
+
+        :param seconds: how long to sample for, capped at MAX_PROFILE_SECONDS
+        :return: {file:<path>, stacks:<int>, cpu_seconds:<float>, top_self:[...], top_total:[...]}
+        :raise ProfilerBusy: another profile is under way
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            stacks = self._sample(min(seconds, MAX_PROFILE_SECONDS))
+        finally:
+            self.lock.release()
+        path = self._path("cpu", "folded")
+        with open(path, "w") as out:
+            for stack, weight in sorted(stacks.items(), key=lambda item: -item[1]):
+                # microseconds, as collapsed stack counts are integers
+                out.write(f"{';'.join(stack)} {max(1, round(weight * 1E6))}\n")
+        self_totals = {}
+        total_totals = {}
+        for stack, weight in stacks.items():
+            self_totals[stack[-1]] = self_totals.get(stack[-1], 0.0) + weight
+            for label in set(stack[1:]):
+                total_totals[label] = total_totals.get(label, 0.0) + weight
+        return dict(file=path, stacks=len(stacks), cpu_seconds=round(sum(stacks.values()), 6),
+                    top_self=_top(self_totals), top_total=_top(total_totals))
+
+    @staticmethod
+    def _sample(seconds):
+        """
+        :return: {(thread name, outermost frame, ..., innermost frame):CPU seconds (or samples)}
+        """
+        sampler = get_ident()
+        stacks = {}
+        clocks = {}                 # {thread ident:CPU clock id or None}
+        last_cpu = {}               # {thread ident:CPU seconds at the previous sample}
+        end_time = time.perf_counter() + seconds
+        while time.perf_counter() < end_time:
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+                if ident not in clocks:
+                    clocks[ident] = _cpu_clock(ident)
+                weight = 1.0
+                if clocks[ident] is not None:
+                    try:
+                        cpu = time.clock_gettime(clocks[ident])
+                    except OSError:
+                        # thread just exited
+                        continue
+                    weight = cpu - last_cpu.get(ident, cpu)
+                    last_cpu[ident] = cpu
+                    if weight <= 0:
+                        continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack = (names.get(ident, str(ident)),) + tuple(reversed(labels))
+                stacks[stack] = stacks.get(stack, 0.0) + weight
+            time.sleep(SAMPLE_INTERVAL)
+        return stacks
+
+    def profile_memory(self, action):
+        """
+        :param action: start => begin tracing allocations, snapshot => write a snapshot of them, stop => stop tracing
+        :return: {tracing:<bool>, ...} - for a snapshot, also {file:<path>, top:[...], growth:[...]},
+        growth being since the previous snapshot
+        :raise ProfilerBusy: another profile is under way
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            if action == "start":
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                return dict(tracing=True)
+            if action == "stop":
+                tracemalloc.stop()
+                self.last_snapshot = None
+                return dict(tracing=False)
+            if not tracemalloc.is_tracing():
+                return dict(tracing=False, reason="not tracing, start it first")
+            snapshot = tracemalloc.take_snapshot()
+            path = self._path("memory", "tracemalloc")
+            snapshot.dump(path)
+            top = [dict(line=str(stat.traceback[0]), size=stat.size, count=stat.count)
+                   for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]]
+            growth = []
+            if self.last_snapshot is not None:
+                growth = [dict(line=str(stat.traceback[0]), size_diff=stat.size_diff, count_diff=stat.count_diff)
+                          for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:TOP_ENTRIES]]
+            self.last_snapshot = snapshot
+            traced, peak = tracemalloc.get_traced_memory()
+            return dict(tracing=True, file=path, traced=traced, peak=peak, top=top, growth=growth)
+        finally:
+            self.lock.release()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+compact records for the weather of every tracked place.
+Icons are held as small integer codes, and forecast periods column-wise in arrays.
+"""
+
+from array import array
+import math
+
+# =============================================================================
+
+
+BOM_ICONS = {
+    '1': "sunny",
+    '2': "clear",
+    '3': "partly-cloudy",
+    '3n': "partly-cloudy-night",
+    '4': "cloudy",
+    '6': "haze",
+    '6n': "haze-night",
+    '8': "light-rain",
+    '9': "wind",
+    '10': "fog",
+    '10n': "fog-night",
+    '11': "showers",
+    '11n': "showers-night",
+    '12': "rain",
+    '13': "dust",
+    '14': "frost",
+    '15': "snow",
+    '16': "storm",
+    '17': "light-showers",
+    '17n': "light-showers-night",
+    '18': "heavy-showers",
+    '19': "tropicalcyclone"
+}
+
+ICON_NAMES = tuple(dict.fromkeys(list(BOM_ICONS.values()) + ["blank"]))
+ICON_NUMBERS = {name: number for number, name in enumerate(ICON_NAMES)}
+ICON_CODES = {code: ICON_NUMBERS[name] for code, name in BOM_ICONS.items()}    # {BoM icon code:icon number}
+BLANK_ICON = ICON_NUMBERS["blank"]
+NO_ICON = -1
+MISSING = math.nan      # absent forecast values
+ABSENT = object()       # absent observation values - None is a value, if the BoM sends null
+
+
+# =============================================================================
+
+
+def present(value):
+    # NaN is the only value not equal to itself
+    return value == value
+
+
+# =============================================================================
+
+
+class ObservationRecord(object):
+    """
+    a place's current observation, along with today's forecast. Not modified once published.
+    """
+    __slots__ = ("temp_now", "icon", "temp_min", "temp_max")
+
+    def __init__(self, temp_now=ABSENT, icon=NO_ICON, temp_min=ABSENT, temp_max=ABSENT):
+        self.temp_now = temp_now
+        self.icon = icon
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        return
+
+    def _values(self):
+        return self.temp_now, self.icon, self.temp_min, self.temp_max
+
+    def __eq__(self, other):
+        return isinstance(other, ObservationRecord) and self._values() == other._values()
+
+    def replace(self, **changes):
+        """
+        :return: a copy with the given values changed
+        """
+        values = dict(temp_now=self.temp_now, icon=self.icon, temp_min=self.temp_min, temp_max=self.temp_max)
+        values.update(changes)
+        return ObservationRecord(**values)
+
+    def as_dict(self):
+        """
+        :return: the record as served, i.e. {temp_now:<float>, icon_name:<str>, temp_max:<float>}
+        """
+        info = {}
+        if self.temp_now is not ABSENT:
+            info["temp_now"] = self.temp_now
+        if self.icon != NO_ICON:
+            info["icon_name"] = ICON_NAMES[self.icon]
+        if self.temp_min is not ABSENT:
+            info["temp_min"] = self.temp_min
+        if self.temp_max is not ABSENT:
+            info["temp_max"] = self.temp_max
+        return info
+
+    @classmethod
+    def from_dict(cls, info):
+        icon_name = info.get("icon_name")
+        return cls(info.get("temp_now", ABSENT), NO_ICON if icon_name is None else ICON_NUMBERS[icon_name],
+                   info.get("temp_min", ABSENT), info.get("temp_max", ABSENT))
+
+
+# =============================================================================
+
+
+class Forecast(object):
+    """
+    a place's forecast periods, one array per value. Not modified once published.
+    """
+    __slots__ = ("icons", "temps_min", "temps_max", "timestamps")
+
+    def __init__(self, periods=()):
+        """
+        :param periods: (icon number, min temperature, max temperature, timestamp) for each period,
+        NO_ICON/MISSING where absent
+        """
+        self.icons = array("b", (period[0] for period in periods))
+        self.temps_min = array("d", (period[1] for period in periods))
+        self.temps_max = array("d", (period[2] for period in periods))
+        self.timestamps = array("d", (period[3] for period in periods))
+        return
+
+    def __len__(self):
+        return len(self.icons)
+
+    def __eq__(self, other):
+        # compared as bytes, as NaN (absent) never equals itself
+        return isinstance(other, Forecast) and self.icons == other.icons and \
+            self.temps_min.tobytes() == other.temps_min.tobytes() and \
+            self.temps_max.tobytes() == other.temps_max.tobytes() and \
+            self.timestamps.tobytes() == other.timestamps.tobytes()
+
+    def period(self, index):
+        """
+        :return: (icon number, min temperature, max temperature, timestamp)
+        """
+        return self.icons[index], self.temps_min[index], self.temps_max[index], self.timestamps[index]
+
+    def as_list(self):
+        """
+        :return: the periods as served, i.e. [{icon_name:<str>, temp_min:<float>, temp_max:<float>, timestamp:<float>}]
+        """
+        periods = []
+        for icon, temp_min, temp_max, timestamp in zip(self.icons, self.temps_min, self.temps_max, self.timestamps):
+            info = {}
+            if icon != NO_ICON:
+                info["icon_name"] = ICON_NAMES[icon]
+            if present(temp_min):
+                info["temp_min"] = temp_min
+            if present(temp_max):
+                info["temp_max"] = temp_max
+            if present(timestamp):
+                info["timestamp"] = timestamp
+            periods.append(info)
+        return periods
+
+    @classmethod
+    def from_list(cls, periods):
+        return cls([(ICON_NUMBERS[info["icon_name"]] if "icon_name" in info else NO_ICON,
+                     info.get("temp_min", MISSING), info.get("temp_max", MISSING), info.get("timestamp", MISSING))
+                    for info in periods])
+
+
+# =============================================================================
+
+
+def weather_results(observation, forecast):
+    """
+    :param observation: ObservationRecord
+    :param forecast: Forecast
+    :return: the weather of a pair as served
+    """
+    return dict(observation=observation.as_dict(), forecast=forecast.as_list())
+
+
+# =============================================================================
+
+
+class TrackedPlace(object):
+    """
+    the monitor's bookkeeping for one observation place, forecast place or forecast product.
+    Forecast places are refreshed with the product holding their area, so only products have a periodic.
+    """
+    __slots__ = ("published", "validators", "timing", "history", "product", "areas", "stamp", "next_issue",
+                 "peer_etag", "fetched", "failures", "touched", "dormant", "periodic")
+
+    def __init__(self, published, periodic, touched, validators=None, timing=None, history=None, product=None,
+                 areas=None):
+        self.published = published      # (version, ObservationRecord or Forecast), replaced whole
+        self.validators = validators    # observation: {etag:<str>, last_modified:<str>}
+        self.timing = timing            # observation: ObservationTiming
+        self.history = history          # observation: ObservationHistory, None if history isn't kept
+        self.product = product          # forecast: TrackedPlace of the product holding the place's area
+        self.areas = areas              # forecast product: {area key:Forecast}
+        self.stamp = None               # forecast product: (modified time, size)
+        self.next_issue = None          # forecast product: time of the next routine issue
+        self.peer_etag = None           # observation, forecast product: entity tag as last fetched from its owner
+        self.fetched = None
+        self.failures = 0               # consecutive failed fetches
+        self.touched = touched
+        self.dormant = False
+        self.periodic = periodic
+        return
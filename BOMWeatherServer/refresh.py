@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import random
+
+from BOMWeatherServer.timestamps import parse_aifstime
+
+
+# =============================================================================
+
+
+OBSERVATION_CADENCE = 1800          # seconds between observation records, until the product shows otherwise
+MIN_CADENCE = 60
+MAX_CADENCE = 3600
+OBSERVATION_LAG = 120               # seconds from record time to publication, until measured
+
+
+# =============================================================================
+
+
+def next_refresh(expected, interval, max_refresh, time_now):
+    """
+    decide when to next refresh a place
+
+    :param expected: when the place's data is next expected to change, None if it can't be predicted
+    :param interval: refresh interval while a change is overdue or can't be predicted, and the shortest wait
+    :param max_refresh: the longest wait between refreshes
+    :param time_now: the current time
+    :return: time of the next refresh
+    """
+    if expected is None or expected <= time_now:
+        return time_now + interval
+    return time_now + max(interval, min(expected - time_now, max_refresh))
+
+
+def backoff_refresh(failures, interval, max_refresh, time_now):
+    """
+    decide when to retry a place whose fetches are failing.
+    The wait doubles with each failure, and is jittered so places failing together don't retry together.
+
+    :param failures: consecutive failed fetches of the place
+    :param interval: the wait after the first failure
+    :param max_refresh: the longest wait
+    :param time_now: the current time
+    :return: time of the next attempt
+    """
+    wait = min(max_refresh, interval * 2 ** min(failures - 1, 32))
+    return time_now + random.uniform(wait / 2, wait)
+
+
+# =============================================================================
+
+
+class ObservationTiming(object):
+    """
+    predicts when a place's next observation record will be published.
+    The cadence comes from the gap between the product's newest records,
+    the publication lag from how long after its record time a new record was first seen.
+    """
+    __slots__ = ("record_time", "cadence", "lag")
+
+    def __init__(self):
+        self.record_time = None
+        self.cadence = OBSERVATION_CADENCE
+        self.lag = OBSERVATION_LAG
+        return
+
+    def update(self, records, last_checked, interval, time_now):
+        """
+        :param records: the product's newest records, newest first
+        :param last_checked: time of the previous successful fetch, None if none
+        :param interval: the refresh interval while a record is overdue
+        :param time_now: the current time
+        """
+        record_time = parse_aifstime(records[0]["aifstime_utc"])
+        if len(records) > 1:
+            gap = record_time - parse_aifstime(records[1]["aifstime_utc"])
+            self.cadence = min(MAX_CADENCE, max(MIN_CADENCE, gap))
+        if self.record_time is not None and record_time > self.record_time:
+            if last_checked is not None and time_now - last_checked <= 2 * interval:
+                # polled while overdue, so the record was published within an interval of now
+                self.lag = min(self.cadence, max(0.0, time_now - record_time))
+            else:
+                # found waiting on arrival, so it may well have been published sooner - edge closer
+                self.lag = max(0.0, self.lag - interval)
+        self.record_time = record_time
+        return
+
+    def expected(self):
+        """
+        :return: when the next record should be published, None if not yet known
+        """
+        if self.record_time is None:
+            return None
+        return self.record_time + self.cadence + self.lag
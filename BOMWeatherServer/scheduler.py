@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+import heapq
+import itertools
+import time
+
+
+# =============================================================================
+
+
+class Scheduler(object):
+    """
+    runs Periodic tasks when they fall due, on a bounded pool of worker threads.
+    Due times are kept in a heap, so the scheduler sleeps until the earliest one rather than polling.
+    """
+    def __init__(self, workers):
+        self.condition = Condition()
+        self.heap = []              # [(due_time, sequence#, Periodic)]
+        self.active = {}            # {Periodic:(sequence#, arg)}
+        self.sequence = itertools.count()
+        self.stopped = False
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+        return
+
+    def add(self, periodic, arg=None, due_time=None):
+        """
+        start scheduling a periodic task
+
+        :param periodic: the Periodic to run
+        :param arg: argument passed to the task
+        :param due_time: when to first run the task (default: now)
+        """
+        with self.condition:
+            sequence = next(self.sequence)
+            self.active[periodic] = (sequence, arg)
+            heapq.heappush(self.heap, (due_time or time.time(), sequence, periodic))
+            self.condition.notify()
+        return
+
+    def remove(self, periodic):
+        """
+        stop scheduling a periodic task. A run already in progress is allowed to finish.
+        """
+        with self.condition:
+            # heap entries are dropped lazily, when they come due
+            self.active.pop(periodic, None)
+        return
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.pool.shutdown(wait=False)
+        return
+
+    def _perform(self, periodic, sequence, arg):
+        try:
+            periodic.run(arg)
+        except Exception as ex:
+            print(f"Error: {periodic.name} {type(ex)}/{ex}")
+        finally:
+            with self.condition:
+                # reschedule unless removed (or removed and re-added) in the meantime
+                if self.active.get(periodic, (None,))[0] == sequence:
+                    heapq.heappush(self.heap, (periodic.due_time(), sequence, periodic))
+                    self.condition.notify()
+        return
+
+    def run(self, running):
+        """
+        dispatch due tasks until stopped
+
+        :param running: callable returning False once the scheduler should stop
+        """
+        with self.condition:
+            while running() and not self.stopped:
+                time_now = time.time()
+                while self.heap and self.heap[0][0] <= time_now:
+                    _, sequence, periodic = heapq.heappop(self.heap)
+                    active_sequence, arg = self.active.get(periodic, (None, None))
+                    if active_sequence == sequence:
+                        try:
+                            self.pool.submit(self._perform, periodic, sequence, arg)
+                        except RuntimeError:
+                            # pool shut down beneath us, i.e. the interpreter is exiting
+                            return
+                timeout = (self.heap[0][0] - time_now) if self.heap else None
+                self.condition.wait(timeout)
+        return
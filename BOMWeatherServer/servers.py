@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+from threading import Lock, Thread
+import asyncio
+import http.client
+import io
+import os
+import selectors
+import socket
+import time
+
+# =============================================================================
+
+
+# prefork needs worker processes that can each listen on the one port
+SERVER_MODES = ("simple", "threaded", "asyncio") + \
+    (("prefork",) if hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT") else ())
+MAX_HEADER_BYTES = 65536
+REFUSE_BACKLOG = 256    # connections awaiting refusal, beyond which more are closed without a response
+REFUSE_TIMEOUT = 0.5    # seconds a connection over the budget is given to send its request line
+
+
+# =============================================================================
+
+
+def response_head(response, keep_alive):
+    """
+    :param response: Response
+    :param keep_alive: False => the connection closes after the response
+    :return: the status line and headers of the response, as sent
+    """
+    lines = [f"HTTP/1.1 {response.code} {http.client.responses.get(response.code, '')}"]
+    lines.extend(f"{name}: {value}" for name, value in response.all_headers())
+    if response.stream is None:
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
+
+
+# =============================================================================
+
+
+class Refuser(Thread):
+    """
+    refuses connections over the in-flight budget, once their request lines show they aren't exempt from it.
+    One thread waits on them all at once, so slow clients hold up neither the listening thread nor each other.
+    """
+    def __init__(self, server):
+        super(Refuser, self).__init__(name="refuse", daemon=True)
+        self.server = server
+        self.selector = selectors.DefaultSelector()
+        self.lock = Lock()
+        self.incoming = []          # [(request, client address)] handed over by the listening thread, under lock
+        self.waiting = 0            # connections incoming or awaiting their request lines, under lock
+        self.running = True
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        return
+
+    def add(self, request, client_address):
+        """
+        :return: False => too many connections are awaiting refusal already, so this one wasn't taken
+        """
+        with self.lock:
+            if self.waiting >= REFUSE_BACKLOG:
+                return False
+            self.waiting += 1
+            self.incoming.append((request, client_address))
+        self._wake()
+        return True
+
+    def _wake(self):
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError:
+            # already due a wake up
+            pass
+        return
+
+    def close(self):
+        self.running = False
+        self._wake()
+        return
+
+    def _take_incoming(self, time_now):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            incoming, self.incoming = self.incoming, []
+        for request, client_address in incoming:
+            request.setblocking(False)
+            self.selector.register(request, selectors.EVENT_READ, (client_address, time_now + REFUSE_TIMEOUT))
+        return
+
+    def _settle(self, request, client_address):
+        self.selector.unregister(request)
+        with self.lock:
+            self.waiting -= 1
+        try:
+            request_line = request.recv(MAX_HEADER_BYTES, socket.MSG_PEEK).split(b"\r\n", 1)[0].split()
+        except OSError:
+            request_line = []
+        if len(request_line) >= 2 and not self.server.service.limited(request_line[1].decode("iso-8859-1")):
+            # i.e. /metrics, served however busy
+            request.setblocking(True)
+            self.server.service.admission.enqueue(limited=False)
+            self.server.submit(request, client_address)
+        else:
+            self.server.refuse(request)
+        return
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(REFUSE_TIMEOUT):
+                if key.fileobj is self.wake_reader:
+                    self._take_incoming(time.monotonic())
+                else:
+                    self._settle(key.fileobj, key.data[0])
+            time_now = time.monotonic()
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None and key.data[1] <= time_now:
+                    # no request line in time
+                    self._settle(key.fileobj, key.data[0])
+        self.selector.close()
+        return
+
+
+# =============================================================================
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each connection to a bounded pool of worker threads.
+    Connections beyond the pool size wait in the pool queue until a worker frees up.
+    Once the in-flight budget is spent they're handed to a Refuser instead,
+    so the listening thread never waits on a client.
+    """
+    daemon_threads = True
+    # a burst of connections waits to be accepted, rather than having its SYNs dropped and retried a second later
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, server_address, handler, workers, service):
+        super(PooledHTTPServer, self).__init__(server_address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self.workers = workers
+        self.service = service
+        self.lock = Lock()
+        self.held = 0               # connections held by workers, under lock
+        self.idle = set()           # held keep-alive connections waiting for their next request, under lock
+        self.refuser = Refuser(self)
+        self.refuser.start()
+        return
+
+    def process_request(self, request, client_address):
+        if not self.service.admission.enqueue():
+            if not self.refuser.add(request, client_address):
+                self.shutdown_request(request)
+            return
+        self.submit(request, client_address)
+        return
+
+    def submit(self, request, client_address):
+        # NOTE: call with the connection counted as queued
+        with self.lock:
+            if self.held >= self.workers and self.idle:
+                # every worker is held, so one idle keep-alive connection is closed to free its worker,
+                # rather than holding it until the client's next poll or the keep-alive timeout
+                try:
+                    self.idle.pop().shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        self.pool.submit(self._process_request_worker, request, client_address)
+        return
+
+    def set_idle(self, connection, idle):
+        """
+        :param connection: a connection held by a worker
+        :param idle: True => waiting for its next request, False => serving one
+        """
+        with self.lock:
+            if idle:
+                self.idle.add(connection)
+            else:
+                self.idle.discard(connection)
+        return
+
+    def refuse(self, request):
+        response = self.service.refuse_busy()
+        try:
+            request.setblocking(False)
+            try:
+                # read the request, so closing with it unread doesn't reset the connection under the response
+                request.recv(MAX_HEADER_BYTES)
+            except BlockingIOError:
+                pass
+            # a client too slow to take the refusal in one go just loses its connection, rather than holding us up
+            request.send(response_head(response, False) + response.body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+        return
+
+    def _process_request_worker(self, request, client_address):
+        self.service.admission.dequeue()
+        with self.lock:
+            self.held += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock:
+                self.held -= 1
+                self.idle.discard(request)
+            self.shutdown_request(request)
+        return
+
+    def server_close(self):
+        super(PooledHTTPServer, self).server_close()
+        self.pool.shutdown(wait=False)
+        self.refuser.close()
+        return
+
+
+# =============================================================================
+
+
+class ReusePortHTTPServer(PooledHTTPServer):
+    """
+    PooledHTTPServer sharing its port with the other worker processes.
+    The kernel spreads new connections between them.
+    """
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super(ReusePortHTTPServer, self).server_bind()
+        return
+
+
+# =============================================================================
+
+
+class AsyncHTTPServer(object):
+    """
+    asyncio HTTP/1.1 front end. Connections are multiplexed on one event loop,
+    responses are built by a bounded pool of worker threads so the monitor's lock never blocks the loop.
+    """
+    def __init__(self, server_address, service, workers, keepalive):
+        self.server_address = server_address
+        self.service = service
+        self.keepalive = keepalive
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self.loop = None
+        self.server = None
+        return
+
+    async def _read_request(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive)
+        if len(head) > MAX_HEADER_BYTES:
+            raise ValueError("request header too large")
+        request_line, _, header_bytes = head.partition(b"\r\n")
+        method, path, version = request_line.decode("iso-8859-1").split()
+        headers = http.client.parse_headers(io.BytesIO(header_bytes))
+        return method, path, version, headers
+
+    @staticmethod
+    def _wants_keepalive(version, headers):
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def _handle(self, path, headers, client):
+        self.service.admission.dequeue()
+        return self.service.handle(path, headers, client)
+
+    async def _handle_connection(self, reader, writer):
+        client = writer.get_extra_info("peername")[0]
+        try:
+            while True:
+                try:
+                    method, path, version, headers = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError,
+                        ConnectionError, ValueError):
+                    break
+                keep_alive = self._wants_keepalive(version, headers)
+                if method not in ("GET", "HEAD"):
+                    writer.write(b"HTTP/1.1 501 Not Implemented\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                if self.service.admission.enqueue(self.service.limited(path)):
+                    response = await self.loop.run_in_executor(self.pool, self._handle, path, headers, client)
+                else:
+                    # refused on the loop, rather than left waiting for a worker only to be refused
+                    response = self.service.refuse_busy()
+                if response.stream is not None:
+                    keep_alive = False
+                writer.write(response_head(response, keep_alive))
+                if response.stream is not None:
+                    await self._send_stream(writer, response.stream, method)
+                elif method != "HEAD":
+                    writer.write(response.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        return
+
+    async def _send_stream(self, writer, stream, method):
+        try:
+            if method == "HEAD":
+                return
+            chunks = iter(stream)
+            while True:
+                # chunks may block waiting for updates, so they are produced on the worker pool
+                chunk = await self.loop.run_in_executor(self.pool, next, chunks, None)
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            stream.close()
+        return
+
+    async def _serve(self):
+        host, port = self.server_address
+        self.server = await asyncio.start_server(self._handle_connection, host or None, port)
+        async with self.server:
+            await self.server.serve_forever()
+        return
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+        return
+
+    def server_close(self):
+        self.pool.shutdown(wait=False)
+        return
+
+
+# =============================================================================
+
+
+def make_server(my_args, server_address, handler, service):
+    """
+    build the HTTP front end selected on the command line
+
+    :param my_args: the parsed command line arguments
+    :param server_address: (host, port) to listen on
+    :param handler: request handler class for the http.server based modes
+    :param service: the WeatherService building responses
+    :return: server offering serve_forever()/server_close()
+    """
+    # each open event stream ties up a worker, so they get workers of their own
+    workers = my_args.workers + my_args.max_streams
+    if my_args.server == "threaded":
+        return PooledHTTPServer(server_address, handler, workers, service)
+    if my_args.server == "prefork":
+        return ReusePortHTTPServer(server_address, handler, workers, service)
+    if my_args.server == "asyncio":
+        return AsyncHTTPServer(server_address, service, workers, my_args.keepalive)
+    return HTTPServer(server_address, handler)
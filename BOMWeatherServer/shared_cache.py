@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from threading import Lock, Thread
+import json
+import struct
+import time
+
+from BOMWeatherServer.forecast_parser import AreaNotFound
+from BOMWeatherServer.metrics import SHARED_CACHE_OVERFLOWS
+from BOMWeatherServer.records import weather_results
+from BOMWeatherServer.weather_pending import WeatherPending
+
+
+# =============================================================================
+
+
+PAIR_SIZE = 4096                        # bytes allowed each pair in a slot, several times an encoded pair's size
+DEMAND_FLUSH = 1.0                      # seconds between workers reporting the pairs requested
+POLL_INTERVAL = 0.05                    # seconds between workers checking for new weather while waiting
+PENDING_RETRY = 2                       # seconds a first fetch is expected to take
+
+# the region starts with a generation number and a count of publishes dropped as too big for a slot,
+# followed by two slots each holding:
+# index length, index (JSON {"<observation place>:<forecast place>":[offset, length, version, version]}), bodies.
+# A length of -1 marks a pair whose forecast product lacks the area.
+_generation = struct.Struct("<Q")
+_overflows = struct.Struct("<Q")
+_index_length = struct.Struct("<I")
+_HEADER_SIZE = _generation.size + _overflows.size
+
+
+# =============================================================================
+
+
+def _slot_offset(generation, slot_size):
+    # publish n writes slot n % 2, and the generation is 2n - 1 while it does so, 2n once done
+    return _HEADER_SIZE + (generation // 2) % 2 * slot_size
+
+
+def shared_cache_size(max_places):
+    """
+    :param max_places: max forecast places tracked, so max pairs published
+    :return: bytes of shared memory needed to publish every pair
+    """
+    return _HEADER_SIZE + 2 * max_places * PAIR_SIZE
+
+
+# =============================================================================
+
+
+class SharedWeatherWriter(object):
+    """
+    publishes encoded weather to worker processes through shared memory.
+    Each publish writes the slot not being read, then flips the generation to point readers at it.
+    """
+    def __init__(self, size):
+        """
+        :param size: bytes of shared memory, i.e. shared_cache_size(max places)
+        """
+        self.shm = SharedMemory(create=True, size=size)
+        self.slot_size = (size - _HEADER_SIZE) // 2
+        self.generation = 0
+        self.overflows = 0
+        _generation.pack_into(self.shm.buf, 0, self.generation)
+        _overflows.pack_into(self.shm.buf, _generation.size, self.overflows)
+        _index_length.pack_into(self.shm.buf, _HEADER_SIZE, 0)
+        return
+
+    def publish(self, pairs):
+        """
+        replace the published weather. Only one thread may publish.
+
+        :param pairs: {(observation place, forecast place):((observation version, forecast version), body)},
+        (None, None) for pairs whose forecast product lacks the area
+        :return: True => published, False => too big for a slot, so the workers keep the weather last published
+        """
+        index = {}
+        bodies = []
+        offset = 0
+        for (observation_place, forecast_place), (version, body) in pairs.items():
+            if body is None:
+                index[f"{observation_place}:{forecast_place}"] = [0, -1, 0, 0]
+                continue
+            observation_version, forecast_version = version
+            index[f"{observation_place}:{forecast_place}"] = [offset, len(body), observation_version, forecast_version]
+            bodies.append(body)
+            offset += len(body)
+        index_bytes = json.dumps(index, separators=(",", ":")).encode("utf8")
+        header_size = _index_length.size + len(index_bytes)
+        if header_size + offset > self.slot_size:
+            # counted where the workers can see it, as they serve the metrics
+            self.overflows += 1
+            _overflows.pack_into(self.shm.buf, _generation.size, self.overflows)
+            print(f"Error: {len(pairs)} pairs ({header_size + offset} bytes) overflow the shared weather cache "
+                  f"({self.slot_size} bytes a slot)")
+            return False
+        # odd while writing - readers of the other slot carry on regardless
+        self.generation += 1
+        _generation.pack_into(self.shm.buf, 0, self.generation)
+        base = _slot_offset(self.generation + 1, self.slot_size)
+        _index_length.pack_into(self.shm.buf, base, len(index_bytes))
+        self.shm.buf[base + _index_length.size:base + header_size] = index_bytes
+        position = base + header_size
+        for body in bodies:
+            self.shm.buf[position:position + len(body)] = body
+            position += len(body)
+        self.generation += 1
+        _generation.pack_into(self.shm.buf, 0, self.generation)
+        return True
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+        return
+
+
+# =============================================================================
+
+
+class SharedWeatherReader(object):
+    """
+    a worker process's view of the weather published by the fetcher process.
+    Stands in for the monitor, so requests register their places with the fetcher through the demand queue.
+    """
+    def __init__(self, shm, demand_queue, my_globals):
+        self.buf = shm.buf
+        self.slot_size = (shm.size - _HEADER_SIZE) // 2
+        self.demand_queue = demand_queue
+        self.globals = my_globals
+        self.eviction_listeners = []    # callables taking (kind, place), called when a pair is unpublished
+        self.index_lock = Lock()
+        self.view = (None, {})      # (generation, index), replaced whole
+        self.demand_lock = Lock()
+        self.demand = set()         # pairs requested since last reported, under demand_lock
+        self.flusher = Thread(target=self._flush_demand, name="demand", daemon=True)
+        self.flusher.start()
+        SHARED_CACHE_OVERFLOWS.collect = lambda: {(): self.overflows()}
+        return
+
+    def _generation(self):
+        return _generation.unpack_from(self.buf, 0)[0]
+
+    def overflows(self):
+        """
+        :return: publishes dropped by the fetcher process as too big for the shared cache
+        """
+        return _overflows.unpack_from(self.buf, _generation.size)[0]
+
+    def _valid(self, generation):
+        # the slot read is only rewritten once the publish after next begins
+        return self._generation() <= generation // 2 * 2 + 2
+
+    def _refresh_index(self):
+        """
+        :return: the current (generation, index)
+        """
+        while True:
+            generation = self._generation()
+            view = self.view
+            if generation == view[0]:
+                return view
+            base = _slot_offset(generation, self.slot_size)
+            length = _index_length.unpack_from(self.buf, base)[0]
+            index_bytes = bytes(self.buf[base + _index_length.size:base + _index_length.size + length])
+            if not self._valid(generation):
+                continue
+            index = json.loads(index_bytes) if index_bytes else {}
+            with self.index_lock:
+                previous_generation, previous_index = self.view
+                if previous_generation is not None and previous_generation >= generation:
+                    return self.view
+                self.view = (generation, index)
+            for key in previous_index:
+                if key not in index:
+                    for listener in self.eviction_listeners:
+                        listener("forecast", key.split(":")[1])
+            return generation, index
+
+    def get(self, pair, known_version=None):
+        """
+        get the encoded weather of a pair, counting it as a request for the pair
+
+        :param pair: (observation place, forecast place)
+        :param known_version: version already held by the caller
+        :return: (version, body), body None if still at known_version
+        :raise WeatherPending: pair not published yet
+        :raise AreaNotFound: the forecast product has no such area
+        """
+        generation, index = self._refresh_index()
+        self.touch(pair, index)
+        while True:
+            entry = index.get(f"{pair[0]}:{pair[1]}")
+            if entry is None:
+                raise WeatherPending(*pair)
+            offset, length, observation_version, forecast_version = entry
+            if length < 0:
+                raise AreaNotFound(pair[1])
+            version = (observation_version, forecast_version)
+            if version == known_version:
+                return version, None
+            base = _slot_offset(generation, self.slot_size)
+            start = base + _index_length.size + _index_length.unpack_from(self.buf, base)[0] + offset
+            body = bytes(self.buf[start:start + length])
+            if self._valid(generation):
+                return version, body
+            generation, index = self._refresh_index()
+
+    def touch(self, pair, index):
+        with self.demand_lock:
+            if pair in self.demand:
+                return
+            self.demand.add(pair)
+        if f"{pair[0]}:{pair[1]}" not in index:
+            # new to the fetcher (as far as we know) - tell it now rather than at the next flush
+            self.demand_queue.put([pair])
+        return
+
+    def _flush_demand(self):
+        while self.globals.running:
+            time.sleep(DEMAND_FLUSH)
+            with self.demand_lock:
+                demand, self.demand = self.demand, set()
+            if demand:
+                self.demand_queue.put(list(demand))
+        return
+
+    def wait_for_update(self, since, timeout):
+        """
+        wait for any pair's weather to change
+
+        :param since: the generation last seen, None => don't wait
+        :param timeout: max seconds to wait
+        :return: (current generation, True => changed since the given generation)
+        """
+        deadline = time.time() + timeout
+        while True:
+            generation, _ = self._refresh_index()
+            if since is None or generation != since:
+                return generation, True
+            if time.time() >= deadline or not self.globals.running:
+                return generation, False
+            time.sleep(POLL_INTERVAL)
+
+    def wait_for_weather(self, observation_place, forecast_place, timeout):
+        """
+        wait for a pair's weather to be published
+
+        :param timeout: max seconds to wait
+        :raise WeatherPending: still no weather for the pair when the wait is over
+        """
+        pair = (observation_place, forecast_place)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.get(pair, known_version=())
+                return
+            except WeatherPending:
+                if time.time() >= deadline or not self.globals.running:
+                    raise
+            time.sleep(POLL_INTERVAL)
+
+    def has_weather(self, observation_place, forecast_place):
+        """
+        :return: True => the pair has been published, with its weather or as lacking its area
+        """
+        _, index = self._refresh_index()
+        return f"{observation_place}:{forecast_place}" in index
+
+    def is_tracked(self, observation_place, forecast_place=None):
+        """
+        :return: True => the pair has been published, or already reported to the fetcher lately
+        """
+        with self.demand_lock:
+            if (observation_place, forecast_place) in self.demand:
+                return True
+        return self.has_weather(observation_place, forecast_place)
+
+    @staticmethod
+    def retry_after(observation_place, forecast_place):
+        return PENDING_RETRY
+
+    @staticmethod
+    def weather_age(observation_place, forecast_place):
+        # fetch times aren't published to the workers
+        return None
+
+
+# =============================================================================
+
+
+class SharedWeatherPublisher(object):
+    """
+    runs alongside the monitor in the fetcher process - publishing its weather for the workers,
+    and passing the pairs requested of the workers back to the monitor.
+    """
+    def __init__(self, monitor, writer, demand_queue, my_globals):
+        self.monitor = monitor
+        self.writer = writer
+        self.demand_queue = demand_queue
+        self.globals = my_globals
+        self.encoded = {}           # {(observation place, forecast place):(version, body)}
+        return
+
+    def start(self):
+        Thread(target=self._publish_updates, name="publish", daemon=True).start()
+        Thread(target=self._apply_demand, name="demand", daemon=True).start()
+        return
+
+    def _publish_updates(self):
+        since = None
+        while self.globals.running:
+            # evictions don't change any version, so also look over the pairs now and then
+            since, _ = self.monitor.wait_for_update(since, DEMAND_FLUSH)
+            encoded = {}
+            changed = False
+            for pair, (version, weather) in self.monitor.published_pairs().items():
+                previous = self.encoded.get(pair)
+                if previous and previous[0] == version:
+                    encoded[pair] = previous
+                else:
+                    encoded[pair] = (version, json.dumps(weather_results(*weather)).encode("utf8") if weather else None)
+                    changed = True
+            if changed or len(encoded) != len(self.encoded):
+                self.encoded = encoded
+                self.writer.publish(encoded)
+        return
+
+    def _apply_demand(self):
+        while self.globals.running:
+            try:
+                pairs = self.demand_queue.get(timeout=DEMAND_FLUSH)
+            except Empty:
+                continue
+            for observation_place, forecast_place in pairs:
+                try:
+                    # registers new places, and keeps known ones in demand
+                    self.monitor.get_weather_version(observation_place, forecast_place)
+                except (WeatherPending, AreaNotFound):
+                    pass
+        return
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import gzip
+import json
+import os
+import tempfile
+
+
+# =============================================================================
+
+
+SNAPSHOT_FORMAT = 1
+
+
+# =============================================================================
+
+
+def save_snapshot(path, state):
+    """
+    write a snapshot atomically - readers (and a restart after a crash) see either the old snapshot or the new one
+
+    :param path: the snapshot file
+    :param state: JSON-able dict
+    """
+    content = json.dumps(dict(format=SNAPSHOT_FORMAT, state=state), separators=(",", ":")).encode("utf8")
+    folder = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=folder)
+    try:
+        with os.fdopen(handle, "wb") as tmp_file:
+            tmp_file.write(gzip.compress(content))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return
+
+
+def load_snapshot(path):
+    """
+    :param path: the snapshot file
+    :return: the saved state, or None if there is no usable snapshot
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            content = json.loads(gzip.decompress(snapshot_file.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        print(f"Error: unreadable snapshot {path} {type(ex)}/{ex}")
+        return None
+    if content.get("format") != SNAPSHOT_FORMAT:
+        print(f"Error: snapshot {path} has unknown format {content.get('format')}")
+        return None
+    return content["state"]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from functools import lru_cache
+import calendar
+import re
+import time
+
+
+# =============================================================================
+
+
+# i.e. 2023-03-13T05:00:00+11:00 or 2023-03-12T18:00:00Z
+ISO_TIMESTAMP_REGEX = r"^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?(Z|([+-])(\d\d):?(\d\d))$"
+TIMESTAMP_CACHE_SIZE = 4096
+
+
+# =============================================================================
+
+
+_iso_timestamp_re = re.compile(ISO_TIMESTAMP_REGEX)
+
+
+def _parse_general(timestamp):
+    from dateutil import parser as du_parser
+    d = du_parser.parse(timestamp)
+    if d.tzinfo is None:
+        # no offset given, so take it as local time
+        return time.mktime(d.timetuple()) + d.microsecond / 1E6
+    return d.timestamp()
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp(timestamp):
+    """
+    convert a BoM timestamp to seconds since the epoch, honouring its UTC offset.
+    The common ISO-8601 forms are decoded directly, anything else is left to dateutil.
+    Forecast periods repeat the same few timestamps across places and refreshes, so results are memoised.
+
+    :param timestamp: the timestamp text
+    :return: seconds since the epoch (float)
+    :raise ValueError: not a valid timestamp
+    """
+    match = _iso_timestamp_re.match(timestamp)
+    if not match:
+        return _parse_general(timestamp)
+    year, month, day, hour, minute, second, fraction, zone, sign, offset_hours, offset_minutes = match.groups()
+    year, month, day, hour, minute, second = int(year), int(month), int(day), int(hour), int(minute), int(second)
+    # timegm would carry out of range fields over, i.e. take 30 February as 2 March
+    if not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(year, month)[1] or hour > 23 or minute > 59 or \
+            second > 59 or (zone != "Z" and (int(offset_hours) > 23 or int(offset_minutes) > 59)):
+        raise ValueError(f"timestamp out of range: {timestamp}")
+    seconds = calendar.timegm((year, month, day, hour, minute, second))
+    if fraction:
+        seconds += int(fraction.ljust(6, "0")) / 1E6
+    if zone != "Z":
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        seconds -= offset if sign == "+" else -offset
+    return float(seconds)
+
+
+def parse_aifstime(aifstime):
+    """
+    convert an observation record's aifstime_utc (i.e. 20230313033000) to seconds since the epoch
+
+    :param aifstime: the aifstime_utc text
+    :return: seconds since the epoch (float)
+    """
+    return float(calendar.timegm(time.strptime(aifstime, "%Y%m%d%H%M%S")))
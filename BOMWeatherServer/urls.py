@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-OBSERVATION_URL = "http://reg.bom.gov.au/fwo/{}/{}.95936.json"
-FORECAST_HOST = "ftp2.bom.gov.au"
-FORECAST_PATH = "/anon/gen/fwo/{}.xml"
+import os
+
+# the BoM's servers, unless overridden from the environment, i.e. to point at the benchmark stand-ins
+OBSERVATION_URL = os.environ.get("BOM_OBSERVATION_URL", "http://reg.bom.gov.au/fwo/{}/{}.95936.json")
+FORECAST_HOST = os.environ.get("BOM_FORECAST_HOST", "ftp2.bom.gov.au")
+FORECAST_PORT = int(os.environ.get("BOM_FORECAST_PORT", "21"))
+FORECAST_PATH = os.environ.get("BOM_FORECAST_PATH", "/anon/gen/fwo/{}.xml")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import gzip
+import json
+import struct
+
+
+# =============================================================================
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+MEDIA_TYPES = {JSON: JSON, "application/*": JSON, "*/*": JSON,
+               MSGPACK: MSGPACK, "application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK,
+               CBOR: CBOR}
+GZIP = "gzip"
+GZIP_LEVEL = 9              # compressed once per version of a pair's weather, so the best ratio is worth its CPU
+VARY = "Accept, Accept-Encoding"
+
+_float32 = struct.Struct(">f")
+_float64 = struct.Struct(">d")
+_MSGPACK_UINTS = [(0xcc, struct.Struct(">B")), (0xcd, struct.Struct(">H")), (0xce, struct.Struct(">I")),
+                  (0xcf, struct.Struct(">Q"))]
+_MSGPACK_INTS = [(0xd0, struct.Struct(">b")), (0xd1, struct.Struct(">h")), (0xd2, struct.Struct(">i")),
+                 (0xd3, struct.Struct(">q"))]
+
+
+# =============================================================================
+
+
+def _accept_list(header):
+    """
+    :param header: Accept or Accept-Encoding request header, or None
+    :return: list of (value lowercased, quality) in order of preference
+    """
+    accepted = []
+    for position, item in enumerate((header or "").split(",")):
+        value, *parameters = [part.strip() for part in item.split(";")]
+        if not value:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, setting = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(setting)
+                except ValueError:
+                    quality = 0.0
+        accepted.append((-quality, position, value.lower()))
+    return [(value, -quality) for quality, _, value in sorted(accepted)]
+
+
+def negotiate_format(accept):
+    """
+    :param accept: the Accept request header, or None
+    :return: the media type to serve - JSON unless the client prefers a binary format
+    """
+    for media_type, quality in _accept_list(accept):
+        if quality > 0 and media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+    # nothing we serve, or nothing asked for - JSON regardless rather than a 406 the client can't act on
+    return JSON
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    :param accept_encoding: the Accept-Encoding request header, or None
+    :return: GZIP if the client accepts it, else None
+    """
+    qualities = dict(reversed(_accept_list(accept_encoding)))
+    # gzip named outright overrides whatever the wildcard says
+    for coding in (GZIP, "x-gzip", "*"):
+        if coding in qualities:
+            return GZIP if qualities[coding] > 0 else None
+    return None
+
+
+# =============================================================================
+
+
+def _pack_float(value, single_code, double_code):
+    # single precision if it holds the value exactly, which BoM temperatures rarely are
+    single = _float32.pack(value)
+    if _float32.unpack(single)[0] == value:
+        return bytes((single_code,)) + single
+    return bytes((double_code,)) + _float64.pack(value)
+
+
+def _msgpack_length(length, fix_code, fix_limit, codes):
+    if length < fix_limit:
+        return bytes((fix_code | length,))
+    if length < 0x100 and codes[0] is not None:
+        return bytes((codes[0], length))
+    if length < 0x10000:
+        return bytes((codes[1],)) + struct.pack(">H", length)
+    return bytes((codes[2],)) + struct.pack(">I", length)
+
+
+def _msgpack_int(value, types):
+    # the narrowest that holds the value
+    for code, packer in types:
+        try:
+            return bytes((code,)) + packer.pack(value)
+        except struct.error:
+            continue
+    raise OverflowError(f"{value} too big for MessagePack")
+
+
+def _msgpack(value, out):
+    if value is None:
+        out.append(b"\xc0")
+    elif value is True or value is False:
+        out.append(b"\xc3" if value else b"\xc2")
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(bytes((value,)))
+        elif -0x20 <= value < 0:
+            out.append(bytes((value & 0xff,)))
+        elif value >= 0:
+            out.append(_msgpack_int(value, _MSGPACK_UINTS))
+        else:
+            out.append(_msgpack_int(value, _MSGPACK_INTS))
+    elif isinstance(value, float):
+        out.append(_pack_float(value, 0xca, 0xcb))
+    elif isinstance(value, str):
+        text = value.encode("utf8")
+        out.append(_msgpack_length(len(text), 0xa0, 32, (0xd9, 0xda, 0xdb)) + text)
+    elif isinstance(value, (list, tuple)):
+        out.append(_msgpack_length(len(value), 0x90, 16, (None, 0xdc, 0xdd)))
+        for item in value:
+            _msgpack(item, out)
+    elif isinstance(value, dict):
+        out.append(_msgpack_length(len(value), 0x80, 16, (None, 0xde, 0xdf)))
+        for key, item in value.items():
+            _msgpack(key, out)
+            _msgpack(item, out)
+    else:
+        raise TypeError(f"can't encode {type(value)} as MessagePack")
+    return
+
+
+def _cbor_head(major, length):
+    major <<= 5
+    if length < 24:
+        return bytes((major | length,))
+    if length < 0x100:
+        return bytes((major | 24, length))
+    if length < 0x10000:
+        return bytes((major | 25,)) + struct.pack(">H", length)
+    if length < 0x100000000:
+        return bytes((major | 26,)) + struct.pack(">I", length)
+    return bytes((major | 27,)) + struct.pack(">Q", length)
+
+
+def _cbor(value, out):
+    if value is None:
+        out.append(b"\xf6")
+    elif value is True or value is False:
+        out.append(b"\xf5" if value else b"\xf4")
+    elif isinstance(value, int):
+        out.append(_cbor_head(0, value) if value >= 0 else _cbor_head(1, -1 - value))
+    elif isinstance(value, float):
+        out.append(_pack_float(value, 0xfa, 0xfb))
+    elif isinstance(value, str):
+        text = value.encode("utf8")
+        out.append(_cbor_head(3, len(text)) + text)
+    elif isinstance(value, (list, tuple)):
+        out.append(_cbor_head(4, len(value)))
+        for item in value:
+            _cbor(item, out)
+    elif isinstance(value, dict):
+        out.append(_cbor_head(5, len(value)))
+        for key, item in value.items():
+            _cbor(key, out)
+            _cbor(item, out)
+    else:
+        raise TypeError(f"can't encode {type(value)} as CBOR")
+    return
+
+
+def encode(weather, media_type):
+    """
+    encode weather as served - the small subset of JSON types it holds, in any of our formats
+
+    :param weather: dicts, lists, strings and numbers
+    :param media_type: JSON, MSGPACK or CBOR
+    :return: the encoded bytes
+    """
+    if media_type == JSON:
+        return json.dumps(weather).encode("utf8")
+    out = []
+    if media_type == MSGPACK:
+        _msgpack(weather, out)
+    else:
+        _cbor(weather, out)
+    return b"".join(out)
+
+
+def compress(body):
+    # no timestamp in the header, so a variant compresses the same whichever worker builds it
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+measures the bytes on the wire and the server CPU per weather request, for each format and content coding served
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer import weather_formats
+from BOMWeatherServer.bom_weather_server import EncodedWeather, WeatherService
+from BOMWeatherServer.records import ICON_CODES, Forecast, ObservationRecord, weather_results
+from bom_products import FORECAST_ICON_CODES, FORECAST_PERIODS
+
+# =============================================================================
+
+
+ACCEPT = ((weather_formats.JSON, "application/json"), (weather_formats.MSGPACK, "application/msgpack"),
+          (weather_formats.CBOR, "application/cbor"))
+PATH = "/?observation=IDV60901&forecast=IDV10753"
+
+
+# =============================================================================
+
+
+class StandInMonitor(object):
+    """
+    just enough of the monitor for the service to serve one pair, whose weather changes on every update()
+    """
+    def __init__(self, rng):
+        self.rng = rng
+        self.eviction_listeners = []
+        self.version = (0, 0)
+        self.weather = None
+        self.update()
+        return
+
+    def update(self):
+        rng = self.rng
+        observation = ObservationRecord(round(rng.uniform(-5, 40), 1), ICON_CODES[rng.choice(FORECAST_ICON_CODES)],
+                                        float(rng.randint(-5, 25)), float(rng.randint(10, 45)))
+        forecast = Forecast([(ICON_CODES[rng.choice(FORECAST_ICON_CODES)], float(rng.randint(-5, 25)),
+                              float(rng.randint(10, 45)), 1678626000.0 + day * 86400)
+                             for day in range(FORECAST_PERIODS)])
+        self.version = (self.version[0] + 1, self.version[1] + 1)
+        self.weather = weather_results(observation, forecast)
+        return
+
+    def get_weather_version(self, observation_place, forecast_place):
+        return self.version
+
+    def get_weather_versioned(self, observation_place, forecast_place):
+        return self.version, self.weather
+
+    @staticmethod
+    def weather_age(observation_place, forecast_place):
+        return 42, False
+
+    @staticmethod
+    def is_tracked(observation_place, forecast_place=None):
+        return True
+
+
+def wire_bytes(response):
+    """
+    :return: bytes of the response as sent, status line and headers included
+    """
+    head = f"HTTP/1.1 {response.code} OK\r\n" + \
+           "".join(f"{name}: {value}\r\n" for name, value in response.all_headers()) + "\r\n"
+    return len(head.encode("latin-1")) + len(response.body)
+
+
+def cpu_per_call(call, calls, repeat=3):
+    """
+    :return: CPU seconds per call, best of repeat runs
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(calls):
+            call()
+        elapsed = (time.process_time() - start) / calls
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="compares the weather formats and content codings served",
+                                     add_help=False)
+    parser.add_argument("-n", "--requests", type=int, default=20000, help="requests per format and coding")
+    parser.add_argument("-u", "--updates", type=int, default=2000, help="weather updates to average encoding over")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    monitor = StandInMonitor(random.Random(1))
+    service = WeatherService(argparse.Namespace(profile=None, max_inflight=0, client_rate=0, client_burst=0,
+                                                client_places=0), monitor)
+    print(f"one pair, {FORECAST_PERIODS} forecast periods. CPU per request served from the variant cache, "
+          f"against encoding every request")
+    print(f"{'format':>20} {'coding':>8} {'body B':>7} {'wire B':>7} {'cached us':>10} {'encode us':>10} "
+          f"{'uncached us':>12}")
+    for media_type, accept in ACCEPT:
+        for coding in (None, weather_formats.GZIP):
+            headers = {"Accept": accept, "Accept-Encoding": coding or "identity"}
+            response = service.handle(PATH, headers)
+            assert response.code == 200 and response.content_type == media_type
+            cached = cpu_per_call(lambda: service.handle(PATH, headers), args.requests)
+            # the cost of building the variant, paid once per version of the pair's weather rather than per request
+            encode = cpu_per_call(lambda: EncodedWeather(monitor.version, json.dumps(monitor.weather).encode("utf8"),
+                                                         monitor.weather).variant(media_type, coding), args.updates)
+            print(f"{media_type:>20} {coding or 'none':>8} {len(response.body):7d} {wire_bytes(response):7d} "
+                  f"{cached * 1E6:10.1f} {encode * 1E6:10.1f} {(cached + encode) * 1E6:12.1f}")
+    return
+
+
+if __name__ == '__main__':
+    main()
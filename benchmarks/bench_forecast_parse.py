@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from xml.etree.ElementTree import iterparse
+import argparse
+import copy
+import io
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.bom_weather_monitor import BOMWeatherMonitor
+from BOMWeatherServer.forecast_parser import AreaNotFound, parse_product_areas
+from BOMWeatherServer.records import Forecast
+from BOMWeatherServer.timestamps import parse_timestamp
+from bom_products import FORECAST_AREAS, make_forecast_product
+
+# =============================================================================
+
+
+def parse_area_periods(xml_bytes, area_index, decode, amoc=None):
+    """
+    stream a forecast product, decoding the forecast periods of one area.
+    Only the wanted area is decoded, other areas are discarded as they are passed,
+    and parsing stops as soon as the wanted area ends.
+
+    :param xml_bytes: the forecast product XML
+    :param area_index: index of the wanted area amongst the product's forecast areas
+    :param decode: called with (list of period <element>s, period start-time-local) for each period
+    :param amoc: optional dict, filled in with the product's <amoc> header fields, i.e. next-routine-issue-time-utc
+    :return: list of decode results, one per period
+    """
+    records = []
+    this_area = -1
+    depth = 0
+    section = None
+    for event, elem in iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            # product(1)/forecast(2)/area(3)
+            if depth == 2:
+                section = elem.tag
+            elif depth == 3 and elem.tag == "area":
+                this_area += 1
+            continue
+        depth -= 1
+        if depth == 2 and section == "amoc":
+            if amoc is not None:
+                amoc[elem.tag] = elem.text
+        elif depth == 2 and elem.tag == "area":
+            elem.clear()
+            if this_area == area_index:
+                return records
+        elif this_area == area_index and elem.tag == "forecast-period":
+            records.append(decode(elem.findall("element"), elem.get("start-time-local")))
+            elem.clear()
+    raise AreaNotFound(area_index)
+
+
+# =============================================================================
+
+
+def untangle_decode_elements(forecast_elements, timestamp=None):
+    # the decoding used with the untangle DOM, which may hand over a single element or a list of them
+    if "type" in forecast_elements:
+        forecast_elements = [forecast_elements]
+    info = {}
+    for this_element in forecast_elements:
+        if this_element["type"] == "forecast_icon_code":
+            info["icon_name"] = BOMWeatherMonitor.BOM_ICONS.get(str(this_element.cdata), "blank")
+        elif this_element["type"] == "air_temperature_maximum":
+            info["temp_max"] = float(this_element.cdata)
+        elif this_element["type"] == "air_temperature_minimum":
+            info["temp_min"] = float(this_element.cdata)
+    if timestamp:
+        info["timestamp"] = parse_timestamp(timestamp)
+    return info
+
+
+def untangle_parse(xml_bytes, area_index):
+    import untangle
+    elements = untangle.parse(xml_bytes.decode("utf8"))
+    area = elements.product.forecast.area[area_index]
+    return [untangle_decode_elements(period.element, period["start-time-local"]) for period in area.forecast_period]
+
+
+def streaming_parse(xml_bytes, area_index):
+    # the one area, amoc header included
+    return parse_area_periods(xml_bytes, area_index, BOMWeatherMonitor._decode_elements, {})
+
+
+def indexed_parse(xml_bytes, area_index):
+    # as get_forecast does - every area decoded and indexed, for all the places drawn from the product
+    return BOMWeatherMonitor._index_areas(parse_product_areas(xml_bytes, BOMWeatherMonitor._decode_elements, {}))
+
+
+def period_elements(xml_bytes, area_index):
+    """
+    :return: [(list of period <element>s, period start-time-local)] for the area's periods
+    """
+    periods = []
+
+    def keep(elements, timestamp):
+        periods.append((elements, timestamp))
+        return None
+
+    # the elements are cleared once decoded, so copies are kept
+    parse_area_periods(xml_bytes, area_index, lambda elements, timestamp: keep(
+        [copy.copy(element) for element in elements], timestamp))
+    return periods
+
+
+def decode_periods(periods):
+    return [BOMWeatherMonitor._decode_elements(elements, timestamp) for elements, timestamp in periods]
+
+
+def peak_memory(parse, xml_bytes, area_index):
+    tracemalloc.start()
+    parse(xml_bytes, area_index)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="compares untangle and streaming forecast product parsing",
+                                     add_help=False)
+    parser.add_argument("-a", "--areas", type=int, default=FORECAST_AREAS, help="location areas per product")
+    parser.add_argument("-i", "--index", type=int, default=2, help="index of the wanted area")
+    parser.add_argument("-n", "--number", type=int, default=5, help="parses per timing")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    xml_bytes = make_forecast_product(num_areas=args.areas)
+    parsers = [("streaming", streaming_parse), ("indexed", indexed_parse)]
+    areas = parse_product_areas(xml_bytes, BOMWeatherMonitor._decode_elements)
+    assert Forecast(areas[args.index][2]) == Forecast(streaming_parse(xml_bytes, args.index))
+    try:
+        import untangle
+        parsers.insert(0, ("untangle", untangle_parse))
+        assert untangle_parse(xml_bytes, args.index) == Forecast(streaming_parse(xml_bytes, args.index)).as_list()
+    except ImportError:
+        print("untangle is not installed, only timing the streaming parsers")
+    print(f"product: {len(xml_bytes)} bytes, {args.areas} location areas, area index {args.index}")
+    for name, parse in parsers:
+        best = min(timeit.repeat(lambda: parse(xml_bytes, args.index), number=args.number, repeat=3)) / args.number
+        peak = peak_memory(parse, xml_bytes, args.index)
+        print(f"{name:>10}: {best * 1E3:9.2f} ms/parse, peak {peak / 1024:9.1f} KiB")
+    # the decoding alone, with the parsing taken out
+    periods = period_elements(xml_bytes, args.index)
+    number = args.number * 1000
+    best = min(timeit.repeat(lambda: decode_periods(periods), number=number, repeat=3)) / number
+    print(f"{'decode':>10}: {best / len(periods) * 1E6:9.2f} us/period (_decode_elements)")
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+measures the memory held per tracked place, compact records against the plain dicts they replaced
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.records import BOM_ICONS, ICON_CODES, MISSING, Forecast, ObservationRecord, TrackedPlace, \
+    weather_results
+from BOMWeatherServer.refresh import ObservationTiming
+from BOMWeatherServer.timestamps import parse_timestamp
+from bom_products import FORECAST_ICON_CODES, FORECAST_PERIODS
+from periodic import Periodic
+
+# =============================================================================
+
+
+def place_values(rng):
+    """
+    :return: (observation values, forecast periods) for one place, as text in the BoM's products
+    """
+    observation = dict(temp_now=f"{rng.uniform(-5, 40):.1f}", icon_code=rng.choice(FORECAST_ICON_CODES),
+                       temp_min=str(rng.randint(-5, 25)), temp_max=str(rng.randint(10, 45)))
+    periods = []
+    for day in range(FORECAST_PERIODS):
+        periods.append(dict(icon_code=rng.choice(FORECAST_ICON_CODES), temp_min=str(rng.randint(-5, 25)),
+                            temp_max=str(rng.randint(10, 45)), timestamp=f"2023-03-{13 + day:02d}T00:00:00+11:00"))
+    # the first period of a product issued late in the day has no minimum
+    del periods[0]["temp_min"]
+    return observation, periods
+
+
+def dict_places(values, task):
+    """
+    track places as before - a dict of bookkeeping per place, holding dicts of published values
+    """
+    observation = {}
+    forecast = {}
+    for index, (values_now, periods) in enumerate(values):
+        # decoded here, so each place's floats are counted, as they would be when fetched
+        published = dict(temp_now=float(values_now["temp_now"]), icon_name=BOM_ICONS[values_now["icon_code"]],
+                         temp_min=float(values_now["temp_min"]), temp_max=float(values_now["temp_max"]))
+        observation[f"IDV6{index:04d}"] = dict(
+            published=(1, published), validators=dict(etag=f'"{index:040x}"', last_modified="Mon, 13 Mar 2023"),
+            timing=ObservationTiming(), fetched=time.time(), touched=time.time(), dormant=False,
+            periodic=Periodic(60, task))
+        published = []
+        for period in periods:
+            info = dict(icon_name=BOM_ICONS[period["icon_code"]])
+            for key in ("temp_min", "temp_max"):
+                if key in period:
+                    info[key] = float(period[key])
+            info["timestamp"] = parse_timestamp(period["timestamp"])
+            published.append(info)
+        forecast[f"IDV1{index:04d}"] = dict(
+            published=(1, published), stamp=("20230312173000", 100000), next_issue=time.time(), fetched=time.time(),
+            touched=time.time(), dormant=False, periodic=Periodic(60, task))
+    return observation, forecast
+
+
+def compact_places(values, task):
+    """
+    track places as the monitor does now
+    """
+    observation = {}
+    forecast = {}
+    for index, (values_now, periods) in enumerate(values):
+        published = ObservationRecord(float(values_now["temp_now"]), ICON_CODES[values_now["icon_code"]],
+                                      float(values_now["temp_min"]), float(values_now["temp_max"]))
+        place_info = TrackedPlace((1, published), Periodic(60, task), time.time(),
+                                  validators=dict(etag=f'"{index:040x}"', last_modified="Mon, 13 Mar 2023"),
+                                  timing=ObservationTiming())
+        place_info.fetched = time.time()
+        observation[f"IDV6{index:04d}"] = place_info
+        published = Forecast([(ICON_CODES[period["icon_code"]], float(period.get("temp_min", MISSING)),
+                               float(period["temp_max"]), parse_timestamp(period["timestamp"]))
+                              for period in periods])
+        place_info = TrackedPlace((1, published), Periodic(60, task), time.time())
+        place_info.stamp = ("20230312173000", 100000)
+        place_info.next_issue = time.time()
+        place_info.fetched = time.time()
+        forecast[f"IDV1{index:04d}"] = place_info
+    return observation, forecast
+
+
+def held_memory(build, values):
+    """
+    :return: (the places built, bytes allocated building them)
+    """
+    gc.collect()
+    tracemalloc.start()
+    places = build(values, lambda place: None)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return places, held
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="compares the memory held per place by dicts and compact records",
+                                     add_help=False)
+    parser.add_argument("--places", type=int, nargs="+", default=[100, 1000, 5000], help="place counts to try")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    rng = random.Random(1)
+    print(f"one observation and one forecast place ({FORECAST_PERIODS} periods) per pair")
+    print(f"{'pairs':>7} {'dicts KiB':>10} {'records KiB':>12} {'dicts B/pair':>13} {'records B/pair':>15} "
+          f"{'saved':>6}")
+    for num_places in args.places:
+        values = [place_values(rng) for _ in range(num_places)]
+        (dict_observation, dict_forecast), dict_held = held_memory(dict_places, values)
+        (observation, forecast), compact_held = held_memory(compact_places, values)
+        # the same weather on the wire either way
+        for (place, dict_info), place_info in zip(dict_forecast.items(), forecast.values()):
+            observation_place = place.replace("IDV1", "IDV6")
+            assert weather_results(observation[observation_place].published[1], place_info.published[1]) == \
+                dict(observation=dict_observation[observation_place]["published"][1],
+                     forecast=dict_info["published"][1])
+        print(f"{num_places:7d} {dict_held / 1024:10.1f} {compact_held / 1024:12.1f} {dict_held / num_places:13.0f} "
+              f"{compact_held / num_places:15.0f} {1 - compact_held / dict_held:6.0%}")
+    return
+
+
+if __name__ == '__main__':
+    main()
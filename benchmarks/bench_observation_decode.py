@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.history import ObservationHistory
+from BOMWeatherServer.partial_json import leading_records
+from bom_products import OBSERVATION_RECORDS, make_observation_product
+
+# =============================================================================
+
+
+def full_decode(content):
+    return json.loads(content)["observations"]["data"][0]
+
+
+def partial_decode(content):
+    # wanting none past the first, which is decoded regardless
+    records, _ = leading_records(content, ("observations", "data"), lambda record: False, 1)
+    return records[0]
+
+
+def held_history(content):
+    """
+    :return: an ObservationHistory holding all but the newest record, as after the refresh before
+    """
+    records = json.loads(content)["observations"]["data"]
+    history = ObservationHistory(len(records))
+    history.merge(records[1:])
+    return history
+
+
+def incremental_decode(content, history):
+    # the records newer than the history holds, and the one before for the cadence
+    records, num_new = leading_records(content, ("observations", "data"), history.is_newer, 2)
+    return records[0]
+
+
+def peak_memory(decode, content):
+    tracemalloc.start()
+    decode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="compares full and partial decoding of observation products",
+                                     add_help=False)
+    parser.add_argument("-r", "--records", type=int, default=OBSERVATION_RECORDS, help="records per product")
+    parser.add_argument("-n", "--number", type=int, default=200, help="decodes per timing")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    content = make_observation_product(args.records)
+    assert full_decode(content) == partial_decode(content)
+    print(f"product: {len(content)} bytes, {args.records} records")
+    history = held_history(content)
+    assert full_decode(content) == incremental_decode(content, history)
+    for name, decode in (("full", full_decode), ("partial", partial_decode),
+                         ("history", lambda text: incremental_decode(text, history))):
+        best = min(timeit.repeat(lambda: decode(content), number=args.number, repeat=5)) / args.number
+        print(f"{name:>8}: {best * 1E6:9.1f} us/decode, peak {peak_memory(decode, content) / 1024:8.1f} KiB")
+    return
+
+
+if __name__ == '__main__':
+    main()
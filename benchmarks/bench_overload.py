@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+measures how clients polling places already fetched fare while a storm of clients requests new places,
+with and without admission control
+"""
+
+from multiprocessing import Pool
+from threading import Thread
+from urllib import parse
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from bench_serving import FIRST_FETCH_WAIT, MAIN, ROOT, STARTUP_TIMEOUT, percentile, stop_server, weather_path
+from fake_bom import FakeBoM
+
+# =============================================================================
+
+
+PORT = 18132
+STORM_PLACES = 9000     # new places the storm draws from, after the polled ones
+CONFIGS = (("off", ["--max-inflight", "0", "--client-rate", "0", "--client-places", "0"]), ("on", []))
+
+
+# =============================================================================
+
+
+def client_loop(port, address, paths, duration, interval):
+    """
+    send requests over one keep-alive connection, as the client at address behind a load balancer
+
+    :param paths: request paths, sent in turn
+    :param interval: seconds between requests, 0 => back to back, ignoring any Retry-After
+    :return: (list of latencies in seconds, {status:count})
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=FIRST_FETCH_WAIT / 1000 + 10)
+    headers = {"X-Forwarded-For": address}
+    latencies = []
+    statuses = {}
+    end_time = time.perf_counter() + duration
+    index = 0
+    while time.perf_counter() < end_time:
+        start = time.perf_counter()
+        # retried once on a new connection, as HTTP clients do when a keep-alive connection is closed under them
+        for _ in range(2):
+            try:
+                connection.request("GET", paths[index % len(paths)], headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                break
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = "reset"
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        index += 1
+        if interval:
+            time.sleep(max(0.0, interval - (time.perf_counter() - start)))
+    connection.close()
+    return latencies, statuses
+
+
+def run_clients(port, clients, duration):
+    """
+    run many clients at once, each on a thread of its own
+
+    :param clients: list of (address, paths, interval)
+    :return: (sorted latencies, {status:count})
+    """
+    results = [None] * len(clients)
+
+    def run(number, address, paths, interval):
+        results[number] = client_loop(port, address, paths, duration, interval)
+        return
+
+    threads = [Thread(target=run, args=(number,) + client) for number, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    statuses = {}
+    for _, client_statuses in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return latencies, statuses
+
+
+# =============================================================================
+
+
+def start_server(args, environment, options):
+    places = []
+    for index in range(args.places):
+        query = parse.parse_qs(parse.urlparse(weather_path(index)).query)
+        places.append(f"{query['observation'][0]}:{query['forecast'][0]}")
+    # fetched at startup, before the storm
+    command = [sys.executable, MAIN, "-l", "127.0.0.1", "-p", str(args.port), "-w", str(args.workers),
+               "--forwarded-for", "--places"] + places + options
+    server = subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL, start_new_session=True)
+    # until the polled places have been fetched
+    deadline = time.time() + STARTUP_TIMEOUT + args.latency * args.places
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", args.port, timeout=1)
+            connection.request("GET", "/ready")
+            response = connection.getresponse()
+            ready = json.loads(response.read()).get("ready")
+            connection.close()
+            if ready:
+                return server
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("server did not start")
+
+
+def bench_config(args, environment, options, pool):
+    """
+    :return: ((sorted latencies, {status:count}) of the polling clients, the same of the storm)
+    """
+    server = start_server(args, environment, options)
+    try:
+        polled = [weather_path(index) for index in range(args.places)]
+        pollers = [(f"10.0.0.{number}", polled[number::args.pollers], args.poll_interval)
+                   for number in range(args.pollers)]
+        storm = [(f"10.1.{number // 250}.{number % 250}",
+                  [f"{weather_path(args.places + (number * 100 + request) % STORM_PLACES)}&wait={FIRST_FETCH_WAIT}"
+                   for request in range(100)], 0)
+                 for number in range(args.storm)]
+        # in processes of their own, so the storm's threads don't hold up the pollers' for the GIL
+        polled_result = pool.apply_async(run_clients, (args.port, pollers, args.duration))
+        storm_result = pool.apply_async(run_clients, (args.port, storm, args.duration))
+        results = polled_result.get(), storm_result.get()
+    finally:
+        stop_server(server)
+    return results
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="load tests clients polling fetched places through a storm of "
+                                                 "requests for new places", add_help=False)
+    parser.add_argument("--pollers", type=int, default=8, help="clients polling places already fetched")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="seconds between each poller's requests")
+    parser.add_argument("--places", type=int, default=16, help="places polled, fetched before the storm")
+    parser.add_argument("--storm", type=int, default=48, help="clients requesting new places back to back")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="server request workers")
+    parser.add_argument("-d", "--duration", type=float, default=15.0, help="seconds per run")
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds the stand-ins take to respond")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="port to serve on")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    fake = FakeBoM(latency=args.latency).start()
+    environment = dict(os.environ, **fake.environment())
+    environment["PYTHONPATH"] = os.pathsep.join([ROOT, os.path.join(ROOT, "BOMWeatherServer")])
+    print(f"{args.pollers} clients polling {args.places} places every {args.poll_interval}s, {args.storm} clients "
+          f"requesting new places, {args.workers} workers, upstream latency {args.latency * 1E3:.0f} ms")
+    print(f"{'admission':>9} {'clients':>8} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    with Pool(2) as pool:
+        for name, options in CONFIGS:
+            for clients, (latencies, statuses) in zip(("polling", "storm"),
+                                                      bench_config(args, environment, options, pool)):
+                print(f"{name:>9} {clients:>8} {len(latencies):9d} {percentile(latencies, 0.5) * 1E3:9.1f} "
+                      f"{percentile(latencies, 0.99) * 1E3:9.1f} {(latencies[-1] if latencies else 0) * 1E3:9.1f}  "
+                      f"{statuses}")
+    fake.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
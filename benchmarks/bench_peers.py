@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+counts the upstream fetches made by 1..N local nodes serving the same places, fetching independently and in peer mode
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from bench_serving import FIRST_FETCH_WAIT, MAIN, ROOT, STARTUP_TIMEOUT, stop_server, weather_path
+from fake_bom import FakeBoM
+
+# =============================================================================
+
+
+PORT = 18130
+UPSTREAM_COUNTERS = ("observation_requests", "forecast_checks", "forecast_downloads")
+
+
+# =============================================================================
+
+
+def start_nodes(num_nodes, args, environment, peer_mode):
+    """
+    :return: list of (port, server process)
+    """
+    ports = [args.port + index for index in range(num_nodes)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    nodes = []
+    for port, url in zip(ports, urls):
+        command = [sys.executable, MAIN, "-l", "127.0.0.1", "-p", str(port), "--client-rate", "0",
+                   "--client-places", "0", "--observation-interval", str(args.interval),
+                   "--forecast-interval", str(args.interval)]
+        if peer_mode:
+            command += ["--peers"] + urls + ["--node", url]
+        nodes.append((port, subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL,
+                                             start_new_session=True)))
+    deadline = time.time() + STARTUP_TIMEOUT
+    for port, _ in nodes:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    for _, server in nodes:
+                        stop_server(server)
+                    raise RuntimeError(f"node on port {port} did not start")
+                time.sleep(0.1)
+    return nodes
+
+
+def get_all(port, paths):
+    """
+    :return: {path:(status, ETag)}
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    results = {}
+    for path in paths:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        results[path] = (response.status, response.getheader("ETag"))
+    connection.close()
+    return results
+
+
+def bench_nodes(num_nodes, args, environment, fake, peer_mode):
+    """
+    :return: (seconds until every node served every place, {upstream counter:count} once they all had,
+    pairs every node serves the same weather for)
+    """
+    paths = [weather_path(index) for index in range(args.places)]
+    nodes = start_nodes(num_nodes, args, environment, peer_mode)
+    try:
+        # clients of every place on every node, as a load balancer would spread them
+        start = time.perf_counter()
+        for port, _ in nodes:
+            get_all(port, [f"{path}&wait={FIRST_FETCH_WAIT}" for path in paths])
+        cold = time.perf_counter() - start
+        before = dict(fake.counters)
+        time.sleep(args.duration)
+        upstream = {counter: fake.counters[counter] - before[counter] for counter in UPSTREAM_COUNTERS}
+        served = [get_all(port, paths) for port, _ in nodes]
+        consistent = sum(1 for path in paths
+                         if all(results[path][0] == 200 and results[path] == served[0][path] for results in served))
+    finally:
+        for _, server in nodes:
+            stop_server(server)
+    return cold, upstream, consistent
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="counts upstream fetches as nodes are added, with and without "
+                                                 "peer mode", add_help=False)
+    parser.add_argument("-n", "--nodes", type=int, default=3, help="most nodes to run at once")
+    parser.add_argument("--places", type=int, default=30, help="observation/forecast pairs requested from every node")
+    parser.add_argument("-d", "--duration", type=float, default=15.0, help="seconds to count upstream fetches over")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="nodes' observation and forecast refresh interval in seconds")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-ins take to respond")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="port of the first node, the rest follow it")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    fake = FakeBoM(latency=args.latency).start()
+    environment = dict(os.environ, **fake.environment())
+    environment["PYTHONPATH"] = os.pathsep.join([ROOT, os.path.join(ROOT, "BOMWeatherServer")])
+    print(f"{args.places} places requested from every node, then upstream fetches counted over {args.duration}s "
+          f"refreshing every {args.interval}s")
+    print(f"{'mode':>12} {'nodes':>6} {'cold s':>7} {'observations':>13} {'fc checks':>10} {'fc downloads':>13} "
+          f"{'total':>7} {'consistent':>11}")
+    for peer_mode in (False, True):
+        for num_nodes in range(1, args.nodes + 1):
+            cold, upstream, consistent = bench_nodes(num_nodes, args, environment, fake, peer_mode)
+            print(f"{'peers' if peer_mode else 'independent':>12} {num_nodes:6d} {cold:7.1f} "
+                  f"{upstream['observation_requests']:13d} {upstream['forecast_checks']:10d} "
+                  f"{upstream['forecast_downloads']:13d} {sum(upstream.values()):7d} "
+                  f"{consistent:5d}/{args.places:<5d}")
+    fake.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
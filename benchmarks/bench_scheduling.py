@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+measures the scheduler's overhead and punctuality as the number of places grows
+"""
+
+from threading import Thread
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from periodic import Periodic
+from scheduler import Scheduler
+
+# =============================================================================
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_places(num_places, period, duration, workers):
+    """
+    schedule do-nothing tasks for num_places places, each due every period seconds
+
+    :return: (runs, expected runs, sorted lateness in seconds, CPU seconds)
+    """
+    scheduler = Scheduler(workers)
+    lateness = []
+    periodics = []
+
+    def task(index):
+        periodic = periodics[index]
+        # the run in progress was due at the end of the previous period
+        lateness.append(time.time() - (periodic.start_time + periodic.num_periods * period))
+        return
+
+    start_time = time.time()
+    for index in range(num_places):
+        # spread over the period, as places registered over time would be
+        periodic = Periodic(period, task, f"place-{index}", start_time=start_time + period * index / num_places)
+        periodics.append(periodic)
+        scheduler.add(periodic, index, periodic.start_time)
+    running = [True]
+    dispatcher = Thread(target=scheduler.run, args=(lambda: running[0],))
+    cpu_start = time.process_time()
+    dispatcher.start()
+    time.sleep(duration)
+    running[0] = False
+    scheduler.stop()
+    dispatcher.join()
+    cpu = time.process_time() - cpu_start
+    return len(lateness), int(num_places * duration / period), sorted(lateness), cpu
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="measures scheduling overhead with 10, 100 and 1000 places",
+                                     add_help=False)
+    parser.add_argument("--places", type=int, nargs="+", default=[10, 100, 1000], help="place counts to try")
+    parser.add_argument("--period", type=float, default=1.0, help="seconds between each place's runs")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per place count")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="scheduler worker threads")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    print(f"do-nothing tasks every {args.period}s per place, {args.workers} workers, {args.duration}s each")
+    print(f"{'places':>7} {'runs':>7} {'expected':>9} {'CPU us/run':>11} {'late p50 ms':>12} {'late p99 ms':>12}")
+    for num_places in args.places:
+        runs, expected, lateness, cpu = bench_places(num_places, args.period, args.duration, args.workers)
+        print(f"{num_places:7d} {runs:7d} {expected:9d} {cpu / max(runs, 1) * 1E6:11.1f} "
+              f"{percentile(lateness, 0.5) * 1E3:12.2f} {percentile(lateness, 0.99) * 1E3:12.2f}")
+    return
+
+
+if __name__ == '__main__':
+    main()
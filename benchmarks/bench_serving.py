@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+load tests each serving mode against local stand-ins for the BoM
+"""
+
+from multiprocessing import Pool
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.servers import SERVER_MODES
+from fake_bom import FakeBoM
+
+# =============================================================================
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MAIN = os.path.join(ROOT, "BOMWeatherServer", "main.py")
+PORT = 18124
+STARTUP_TIMEOUT = 10    # seconds
+FIRST_FETCH_WAIT = 10000    # milliseconds
+
+
+# =============================================================================
+
+
+def weather_path(index):
+    return f"/?observation=IDV6{index:04d}&forecast=IDV1{index:04d}"
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_client(port, requests, duration):
+    """
+    send requests over one keep-alive connection
+
+    :param port: the server's port
+    :param requests: list of (path, headers), sent in turn
+    :param duration: seconds to keep sending for, 0 => send each request once
+    :return: (list of latencies in seconds, {status:count})
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = []
+    statuses = {}
+    end_time = time.perf_counter() + duration
+    index = 0
+    while True:
+        if duration:
+            if time.perf_counter() >= end_time:
+                break
+        elif index >= len(requests):
+            break
+        path, headers = requests[index % len(requests)]
+        index += 1
+        start = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    connection.close()
+    return latencies, statuses
+
+
+def run_phase(pool, port, requests, clients, duration):
+    """
+    :return: (requests/sec, sorted latencies, {status:count})
+    """
+    shares = [requests[client::clients] for client in range(clients)]
+    start = time.perf_counter()
+    results = pool.starmap(run_client, [(port, share, duration) for share in shares if share])
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    statuses = {}
+    for _, client_statuses in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return len(latencies) / elapsed, latencies, statuses
+
+
+def fetch_etags(port, paths):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    etags = {}
+    for path in paths:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        etags[path] = response.getheader("ETag")
+    connection.close()
+    return etags
+
+
+# =============================================================================
+
+
+def start_server(mode, port, environment, processes):
+    # every client connects from 127.0.0.1, so would share the one client's limits
+    command = [sys.executable, MAIN, "-l", "127.0.0.1", "-p", str(port), "-s", mode,
+               "--client-rate", "0", "--client-places", "0"]
+    if mode == "prefork":
+        command += ["--processes", str(processes)]
+    server = subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    stop_server(server)
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def stop_server(server):
+    # the whole process group, as Ctrl-C would, so prefork workers stop too
+    os.killpg(server.pid, signal.SIGINT)
+    try:
+        server.wait(STARTUP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+    return
+
+
+def bench_mode(mode, args, environment, pool):
+    """
+    :return: list of (phase, requests/sec, sorted latencies, {status:count})
+    """
+    server = start_server(mode, args.port, environment, args.processes)
+    try:
+        paths = [weather_path(index) for index in range(args.places)]
+        results = []
+        # cold - each place's first request, waiting on its first fetch
+        cold = [(f"{path}&wait={FIRST_FETCH_WAIT}", {}) for path in paths]
+        results.append(("cold",) + run_phase(pool, args.port, cold, args.clients, 0))
+        # warm - places already fetched, responses already encoded
+        warm = [(path, {}) for path in paths]
+        results.append(("warm",) + run_phase(pool, args.port, warm, args.clients, args.duration))
+        # 304 - clients already holding the current weather
+        etags = fetch_etags(args.port, paths)
+        not_modified = [(path, {"If-None-Match": etags[path]}) for path in paths if etags[path]]
+        results.append(("304",) + run_phase(pool, args.port, not_modified, args.clients, args.duration))
+    finally:
+        stop_server(server)
+    return results
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="load tests each serving mode against local stand-ins for the BoM",
+                                     add_help=False)
+    parser.add_argument("-m", "--modes", nargs="+", choices=SERVER_MODES, default=list(SERVER_MODES),
+                        help="serving modes to compare (default: all)")
+    parser.add_argument("-c", "--clients", type=int, default=8, help="concurrent client connections")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per warm/304 phase")
+    parser.add_argument("--places", type=int, default=100, help="observation/forecast pairs requested")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes for prefork")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-ins take to respond")
+    parser.add_argument("--products", help="folder of recorded products, <product id>.json and <product id>.xml")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="port to serve on")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    fake = FakeBoM(args.products, args.latency).start()
+    environment = dict(os.environ, **fake.environment())
+    environment["PYTHONPATH"] = os.pathsep.join([ROOT, os.path.join(ROOT, "BOMWeatherServer")])
+    print(f"{args.places} places, {args.clients} clients, {args.duration}s per phase, "
+          f"upstream latency {args.latency * 1E3:.0f} ms")
+    print(f"{'mode':>10} {'phase':>6} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  statuses")
+    with Pool(args.clients) as pool:
+        for mode in args.modes:
+            for phase, rate, latencies, statuses in bench_mode(mode, args, environment, pool):
+                print(f"{mode:>10} {phase:>6} {len(latencies):9d} {rate:9.0f} "
+                      f"{percentile(latencies, 0.5) * 1E3:9.2f} {percentile(latencies, 0.99) * 1E3:9.2f}  "
+                      f"{statuses}")
+    fake.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.timestamps import parse_timestamp
+from bom_products import FORECAST_PERIODS
+
+# =============================================================================
+
+
+def dateutil_timestamp(timestamp):
+    # the original decoding, which drops the UTC offset and takes the time as local
+    from dateutil import parser as du_parser
+    d = du_parser.parse(timestamp)
+    return time.mktime(d.timetuple()) + d.microsecond / 1E6
+
+
+def refresh_timestamps(num_places):
+    """
+    :return: the start-time-local values decoded by one forecast refresh of every place
+    """
+    return [f"2023-03-{13 + period:02d}T00:00:00+11:00" for _ in range(num_places) for period in range(FORECAST_PERIODS)]
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="compares forecast period timestamp decoding", add_help=False)
+    parser.add_argument("-p", "--places", type=int, default=100, help="forecast places per refresh")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    timestamps = refresh_timestamps(args.places)
+
+    def uncached():
+        parse_timestamp.cache_clear()
+        for timestamp in timestamps:
+            parse_timestamp.__wrapped__(timestamp)
+
+    def cached():
+        for timestamp in timestamps:
+            parse_timestamp(timestamp)
+
+    def dateutil():
+        for timestamp in timestamps:
+            dateutil_timestamp(timestamp)
+
+    print(f"refresh: {args.places} places, {len(timestamps)} timestamps")
+    for name, refresh in (("dateutil", dateutil), ("fast path", uncached), ("memoised", cached)):
+        best = min(timeit.repeat(refresh, number=5, repeat=3)) / 5
+        print(f"{name:>10}: {best * 1E3:9.3f} ms/refresh")
+    return
+
+
+if __name__ == '__main__':
+    main()
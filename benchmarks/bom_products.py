@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+synthetic BoM products, shaped and sized like the real ones
+"""
+
+from datetime import datetime, timedelta, timezone
+import json
+
+# =============================================================================
+
+
+OBSERVATION_RECORDS = 144   # 72 hours of half-hourly observations
+OBSERVATION_INTERVAL = timedelta(minutes=30)
+NEWEST_OBSERVATION = datetime(2023, 3, 13, 3, 30, tzinfo=timezone.utc)
+OBSERVATION_ZONE = timezone(timedelta(hours=11))    # EDT, as the header says
+FORECAST_AREAS = 120        # location areas in a state precis product
+FORECAST_PERIODS = 7
+FORECAST_ICON_CODES = ["1", "2", "3", "4", "8", "11", "12", "16", "17"]
+
+
+# =============================================================================
+
+
+def make_observation_product(num_records=OBSERVATION_RECORDS):
+    """
+    build an observation product shaped like the BoM's 72 hour JSON products
+
+    :param num_records: number of observation records
+    :return: the product as JSON text
+    """
+    data = []
+    for index in range(num_records):
+        # newest first, half an hour apart
+        utc_time = NEWEST_OBSERVATION - index * OBSERVATION_INTERVAL
+        local_time = utc_time.astimezone(OBSERVATION_ZONE)
+        data.append({
+            "sort_order": index, "wmo": 95936, "name": "Melbourne (Olympic Park)", "history_product": "IDV60901",
+            "local_date_time": local_time.strftime("%d/%I:%M%p").lower(),
+            "local_date_time_full": local_time.strftime("%Y%m%d%H%M%S"),
+            "aifstime_utc": utc_time.strftime("%Y%m%d%H%M%S"), "lat": -37.8, "lon": 145.0, "apparent_t": 17.3,
+            "cloud": "-", "cloud_base_m": None, "cloud_oktas": None, "cloud_type_id": None,
+            "cloud_type": "-", "delta_t": 4.9,
+            "gust_kmh": 24, "gust_kt": 13, "air_temp": 19.7 - (index % 10) * 0.3, "dewpt": 10.1, "press": 1015.2,
+            "press_qnh": 1015.2, "press_msl": 1015.2, "press_tend": "-", "rain_trace": "0.0", "rel_hum": 53,
+            "sea_state": "-", "swell_dir_worded": "-", "swell_height": None, "swell_period": None, "vis_km": "10",
+            "weather": "-", "wind_dir": "SSW", "wind_spd_kmh": 13, "wind_spd_kt": 7,
+        })
+    product = {"observations": {
+        "notice": [{"copyright": "Copyright Commonwealth of Australia 2023, Bureau of Meteorology"}],
+        "header": [{"refresh_message": "Issued at  2:35 pm EDT Monday 13 March 2023", "ID": "IDV60901.95936",
+                    "main_ID": "IDV60900", "name": "Melbourne (Olympic Park)", "state_time_zone": "VIC",
+                    "time_zone": "EDT", "product_name": "Capital City Observations", "state": "Victoria"}],
+        "data": data}}
+    return json.dumps(product, indent=1)
+
+
+def make_forecast_product(product_id="IDV10753", num_areas=FORECAST_AREAS, num_periods=FORECAST_PERIODS):
+    """
+    build a forecast product shaped like the BoM's state precis XML products
+
+    :param product_id: the product identifier
+    :param num_areas: number of location areas, after the state and metropolitan areas
+    :param num_periods: number of daily forecast periods per location
+    :return: the product as XML bytes
+    """
+    lines = ['<?xml version="1.0"?>',
+             '<product xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="v1.7.1" '
+             'xsi:noNamespaceSchemaLocation="http://www.bom.gov.au/schema/v1.7/product.xsd">',
+             '  <amoc>',
+             '    <source><sender>Australian Government Bureau of Meteorology</sender><region>Victoria</region>'
+             '<office>VICRO</office><copyright>http://www.bom.gov.au/other/copyright.shtml</copyright>'
+             '<disclaimer>http://www.bom.gov.au/other/disclaimer.shtml</disclaimer></source>',
+             f'    <identifier>{product_id}</identifier>',
+             '    <issue-time-utc>2023-03-12T17:30:00Z</issue-time-utc>',
+             '    <issue-time-local tz="EDT">2023-03-13T04:30:00+11:00</issue-time-local>',
+             '    <sent-time>2023-03-12T17:31:02Z</sent-time>',
+             '    <expiry-time>2023-03-13T17:30:00Z</expiry-time>',
+             '    <validity-bgn-time-local tz="EDT">2023-03-13T04:30:00+11:00</validity-bgn-time-local>',
+             '    <validity-end-time-local tz="EDT">2023-03-20T23:59:00+11:00</validity-end-time-local>',
+             '    <next-routine-issue-time-utc>2023-03-13T06:10:00Z</next-routine-issue-time-utc>',
+             '    <next-routine-issue-time-local tz="EDT">2023-03-13T17:10:00+11:00</next-routine-issue-time-local>',
+             '    <status>O</status>',
+             '    <service>WSFC</service>',
+             '    <product-type>F</product-type>',
+             '    <phase>NEW</phase>',
+             '  </amoc>',
+             '  <forecast>',
+             '    <area aac="VIC_FA001" description="Victoria" type="region"/>',
+             '    <area aac="VIC_ME001" description="Melbourne" type="metropolitan" parent-aac="VIC_FA001"/>']
+    for area in range(num_areas):
+        description = "Melbourne" if area == 0 else f"Town {area:03d}"
+        lines.append(f'    <area aac="VIC_PT{area + 42:03d}" description="{description}" type="location" '
+                     f'parent-aac="VIC_ME001">')
+        for period in range(num_periods):
+            day = 13 + period
+            lines.append(f'      <forecast-period index="{period}" start-time-local="2023-03-{day:02d}T00:00:00+11:00" '
+                         f'end-time-local="2023-03-{day + 1:02d}T00:00:00+11:00" '
+                         f'start-time-utc="2023-03-{day - 1:02d}T13:00:00Z" end-time-utc="2023-03-{day:02d}T13:00:00Z">')
+            icon_code = FORECAST_ICON_CODES[(area + period) % len(FORECAST_ICON_CODES)]
+            lines.append(f'        <element type="forecast_icon_code">{icon_code}</element>')
+            if period > 0:
+                lines.append(f'        <element type="air_temperature_minimum" units="Celsius">'
+                             f'{10 + (area + period) % 8}</element>')
+            lines.append(f'        <element type="air_temperature_maximum" units="Celsius">'
+                         f'{20 + (area * 3 + period) % 12}</element>')
+            lines.append('        <text type="precis">Partly cloudy.</text>')
+            lines.append(f'        <text type="probability_of_precipitation">{(area * 7 + period) % 100}%</text>')
+            lines.append('      </forecast-period>')
+        lines.append('    </area>')
+    lines.append('  </forecast>')
+    lines.append('</product>')
+    return "\n".join(lines).encode("utf8")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+local stand-ins for the BoM's observation HTTP server and forecast FTP server
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import argparse
+import hashlib
+import os
+import socket
+import socketserver
+import time
+
+from bom_products import make_forecast_product, make_observation_product
+
+# =============================================================================
+
+
+PRODUCT_MODIFIED = "20230312173000"     # MDTM of synthetic forecast products
+PRODUCT_LAST_MODIFIED = "Sun, 12 Mar 2023 17:30:00 GMT"
+
+
+# =============================================================================
+
+
+class ObservationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        fake = self.server.fake
+        # i.e. /fwo/IDV60901/IDV60901.95936.json
+        place = self.path.strip("/").split("/")[1]
+        body = fake.product("json", place)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        fake.count("observation_requests")
+        if fake.latency:
+            time.sleep(fake.latency)
+        if self.headers.get("If-None-Match") == etag:
+            fake.count("observation_not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", PRODUCT_LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def log_message(self, format: str, *args: any) -> None:
+        return
+
+
+# =============================================================================
+
+
+class ForecastHandler(socketserver.StreamRequestHandler):
+    """
+    just enough of an anonymous FTP server for the forecast downloads
+    """
+    def reply(self, text):
+        self.wfile.write((text + "\r\n").encode("utf8"))
+        return
+
+    def _passive(self):
+        listener = socket.socket()
+        listener.bind((self.server.server_address[0], 0))
+        listener.listen(1)
+        return listener
+
+    def _product(self, path):
+        # i.e. /anon/gen/fwo/IDV10450.xml
+        return self.server.fake.product("xml", os.path.basename(path).split(".")[0])
+
+    def handle(self):
+        fake = self.server.fake
+        fake.count("forecast_sessions")
+        self.reply("220 fake BoM FTP")
+        passive = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, _, argument = line.decode("utf8").strip().partition(" ")
+            command = command.upper()
+            if command == "USER":
+                self.reply("331 send password")
+            elif command == "PASS":
+                self.reply("230 logged in")
+            elif command in ("TYPE", "NOOP", "CWD", "MODE", "STRU"):
+                self.reply("200 ok")
+            elif command == "SIZE":
+                self.reply(f"213 {len(self._product(argument))}")
+            elif command == "MDTM":
+                fake.count("forecast_checks")
+                self.reply(f"213 {fake.modified(argument)}")
+            elif command == "PASV":
+                passive = self._passive()
+                host = self.server.server_address[0].replace(".", ",")
+                port = passive.getsockname()[1]
+                self.reply(f"227 Entering Passive Mode ({host},{port >> 8},{port & 255})")
+            elif command == "EPSV":
+                passive = self._passive()
+                self.reply(f"229 Entering Extended Passive Mode (|||{passive.getsockname()[1]}|)")
+            elif command == "RETR" and passive is not None:
+                fake.count("forecast_downloads")
+                data = self._product(argument)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                self.reply("150 opening data connection")
+                connection, _ = passive.accept()
+                connection.sendall(data)
+                connection.close()
+                passive.close()
+                passive = None
+                self.reply("226 transfer complete")
+            elif command == "QUIT":
+                self.reply("221 goodbye")
+                break
+            else:
+                self.reply("502 not implemented")
+        if passive is not None:
+            passive.close()
+        return
+
+
+class ForecastServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+# =============================================================================
+
+
+class FakeBoM(object):
+    """
+    serves recorded products from a folder (<product id>.json and <product id>.xml),
+    and synthetic ones of the real size for any product not recorded
+    """
+    def __init__(self, products=None, latency=0.0, host="127.0.0.1", http_port=0, ftp_port=0):
+        self.products = products
+        self.latency = latency      # seconds added to every response, like the round trip to the BoM
+        self.lock = Lock()
+        self.cache = {}             # {(kind, product id):bytes}
+        self.counters = dict(observation_requests=0, observation_not_modified=0, forecast_sessions=0,
+                             forecast_checks=0, forecast_downloads=0)
+        self.http_server = ThreadingHTTPServer((host, http_port), ObservationHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.fake = self
+        self.ftp_server = ForecastServer((host, ftp_port), ForecastHandler)
+        self.ftp_server.fake = self
+        return
+
+    def _recorded(self, kind, product_id):
+        if self.products:
+            path = os.path.join(self.products, f"{product_id}.{kind}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def product(self, kind, product_id):
+        """
+        :param kind: json (observation) or xml (forecast)
+        :return: the product's bytes
+        """
+        with self.lock:
+            content = self.cache.get((kind, product_id))
+        if content is None:
+            path = self._recorded(kind, product_id)
+            if path:
+                with open(path, "rb") as product_file:
+                    content = product_file.read()
+            elif kind == "json":
+                content = make_observation_product().encode("utf8")
+            else:
+                content = make_forecast_product(product_id)
+            with self.lock:
+                self.cache[(kind, product_id)] = content
+        return content
+
+    def modified(self, path):
+        recorded = self._recorded("xml", os.path.basename(path).split(".")[0])
+        if recorded:
+            return time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(recorded)))
+        return PRODUCT_MODIFIED
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+        return
+
+    def environment(self):
+        """
+        :return: environment variables pointing BOMWeatherServer at these stand-ins
+        """
+        http_host, http_port = self.http_server.server_address
+        ftp_host, ftp_port = self.ftp_server.server_address
+        return dict(BOM_OBSERVATION_URL=f"http://{http_host}:{http_port}/fwo/{{}}/{{}}.95936.json",
+                    BOM_FORECAST_HOST=ftp_host, BOM_FORECAST_PORT=str(ftp_port))
+
+    def start(self):
+        Thread(target=self.http_server.serve_forever, name="fake-http", daemon=True).start()
+        Thread(target=self.ftp_server.serve_forever, name="fake-ftp", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.ftp_server.shutdown()
+        self.http_server.server_close()
+        self.ftp_server.server_close()
+        return
+
+
+# =============================================================================
+
+
+def arg_parser():
+    """
+    parse arguments
+
+    :return: the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="runs local stand-ins for the BoM observation and forecast servers",
+                                     add_help=False)
+    parser.add_argument("--products", help="folder of recorded products, <product id>.json and <product id>.xml")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--http-port", type=int, default=0, help="observation server port (default: any free)")
+    parser.add_argument("--ftp-port", type=int, default=0, help="forecast server port (default: any free)")
+    parser.add_argument("-?", "--help", help="show help message and quit", action="help")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parser()
+    fake = FakeBoM(args.products, args.latency, http_port=args.http_port, ftp_port=args.ftp_port).start()
+    print("point BOMWeatherServer at these stand-ins with:")
+    for name, value in fake.environment().items():
+        print(f"    export {name}='{value}'")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    fake.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
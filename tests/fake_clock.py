@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+# =============================================================================
+
+
+class FakeClock(object):
+    """
+    stands in for time.time, moving only when told to
+    """
+    def __init__(self, now=1678680000.0):
+        self.now = now
+        return
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return
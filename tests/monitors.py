@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+monitors for tests, never started, so nothing is fetched unless a test fetches it
+"""
+
+from argparse import Namespace
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.bom_weather_monitor import BOMWeatherMonitor
+
+# =============================================================================
+
+
+OBSERVATION_INTERVAL = 600
+FORECAST_INTERVAL = 3600
+MONITOR_ARGS = dict(fetch_workers=2, breaker_threshold=5, breaker_reset=60.0, peers=[], node=None, history_length=0,
+                    max_places=500, demand_window=900.0, max_refresh=1800.0, place_ttl=3600.0, snapshot=None,
+                    snapshot_interval=60.0, verbose=False)
+
+
+# =============================================================================
+
+
+class Globals(object):
+    def __init__(self):
+        self.running = True
+        return
+
+
+def make_monitor(**my_args):
+    """
+    :param my_args: command line arguments differing from MONITOR_ARGS
+    :return: BOMWeatherMonitor
+    """
+    return BOMWeatherMonitor(Namespace(**dict(MONITOR_ARGS, **my_args)), Globals(), OBSERVATION_INTERVAL,
+                             FORECAST_INTERVAL)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+admission control - the in-flight budget, shedding, and each client's request rate and new places
+"""
+
+from argparse import Namespace
+from threading import Event
+import json
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer import admission, servers
+from BOMWeatherServer.admission import BUSY_RETRY, REGISTRATION_WINDOW, AdmissionControl, Refused, TokenBucket
+from BOMWeatherServer.bom_weather_server import WeatherService
+from BOMWeatherServer.servers import Refuser
+from fake_clock import FakeClock
+
+# =============================================================================
+
+
+CLIENT = "192.0.2.1"
+OTHER_CLIENT = "192.0.2.2"
+
+
+# =============================================================================
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def refused(call, *args):
+    """
+    :return: the Refused raised by the call
+    """
+    with pytest.raises(Refused) as info:
+        call(*args)
+    return info.value
+
+
+def test_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(2.0, 3, clock())
+    assert [bucket.take(clock()) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(clock()) == pytest.approx(0.5)
+    clock.advance(0.25)
+    assert bucket.take(clock()) == pytest.approx(0.25)
+    clock.advance(0.25)
+    assert bucket.take(clock()) == 0
+
+
+def test_bucket_capped_at_burst(clock):
+    bucket = TokenBucket(2.0, 3, clock())
+    clock.advance(3600)
+    assert [bucket.take(clock()) for _ in range(4)][3] == pytest.approx(0.5)
+
+
+# =============================================================================
+
+
+def test_client_rate(clock):
+    control = AdmissionControl(0, 2.0, 3, 0, clock=clock)
+    for _ in range(3):
+        control.begin(CLIENT)
+        control.end()
+    ex = refused(control.begin, CLIENT)
+    assert (ex.code, ex.cause, ex.retry_after) == (429, "rate", 1)
+    # other clients, requests not over the network, and those exempt are each their own
+    control.begin(OTHER_CLIENT)
+    control.begin(None)
+    control.begin(CLIENT, limited=False)
+    assert control.inflight == 3
+    clock.advance(0.5)
+    control.begin(CLIENT)
+
+
+def test_retry_after_whole_seconds(clock):
+    control = AdmissionControl(0, 0.1, 1, 0, clock=clock)
+    control.begin(CLIENT)
+    assert refused(control.begin, CLIENT).retry_after == 10
+    clock.advance(9.5)
+    # rounded up, so a client waiting as asked isn't refused again
+    assert refused(control.begin, CLIENT).retry_after == 1
+
+
+def test_clients_forgotten(clock, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_CLIENTS", 2)
+    control = AdmissionControl(0, 1.0, 1, 0, clock=clock)
+    control.begin(CLIENT)
+    control.begin(OTHER_CLIENT)
+    control.begin("192.0.2.3")
+    # the least recently seen went first, so starts afresh
+    assert list(control.clients) == [OTHER_CLIENT, "192.0.2.3"]
+    control.begin(CLIENT)
+
+
+def test_inflight_budget():
+    control = AdmissionControl(2, 0, 1, 0)
+    control.begin(CLIENT)
+    assert control.enqueue()
+    ex = refused(control.begin, CLIENT)
+    assert (ex.code, ex.cause, ex.retry_after) == (503, "busy", BUSY_RETRY)
+    assert not control.enqueue()
+    # exempt from the budget, i.e. /metrics
+    assert control.enqueue(limited=False)
+    control.begin(CLIENT, limited=False)
+    assert control.load() == 4 and control.busy()
+    control.end()
+    control.end()
+    control.dequeue()
+    control.dequeue()
+    control.begin(CLIENT)
+    control.begin(CLIENT)
+    assert control.load() == 2 and not control.busy()
+
+
+def test_no_budget():
+    control = AdmissionControl(0, 0, 1, 0)
+    for _ in range(1000):
+        assert control.enqueue()
+        control.begin(CLIENT)
+    assert not control.shedding()
+
+
+def test_shedding(clock):
+    control = AdmissionControl(4, 0, 1, 10, clock=clock)
+    control.begin(CLIENT)
+    control.admit_registration(CLIENT)
+    assert control.enqueue()
+    # half the budget spent, so no new places, though requests are still admitted
+    assert control.shedding()
+    ex = refused(control.admit_registration, CLIENT)
+    assert (ex.code, ex.cause, ex.retry_after) == (503, "shed", BUSY_RETRY)
+    refused(control.admit_registration, None)
+    control.begin(CLIENT)
+    control.end()
+    control.end()
+    control.admit_registration(CLIENT)
+
+
+def test_place_budget(clock):
+    control = AdmissionControl(0, 0, 1, 2, clock=clock)
+    control.admit_registration(CLIENT)
+    control.admit_registration(CLIENT)
+    ex = refused(control.admit_registration, CLIENT)
+    assert (ex.code, ex.cause, ex.retry_after) == (429, "places", REGISTRATION_WINDOW / 2)
+    assert "at most 2 a minute" in ex.reason
+    control.admit_registration(OTHER_CLIENT)
+    control.admit_registration(None)
+    clock.advance(REGISTRATION_WINDOW / 2)
+    control.admit_registration(CLIENT)
+    refused(control.admit_registration, CLIENT)
+
+
+def test_no_place_budget(clock):
+    control = AdmissionControl(0, 0, 1, 0, clock=clock)
+    for _ in range(1000):
+        control.admit_registration(CLIENT)
+
+
+# =============================================================================
+
+
+class Monitor(object):
+    def __init__(self):
+        self.eviction_listeners = []
+        return
+
+
+def make_service(clock, **my_args):
+    my_args = Namespace(**dict(dict(profile=None, max_inflight=0, client_rate=0, client_burst=1, client_places=0,
+                                    max_streams=1, forwarded_for=False), **my_args))
+    service = WeatherService(my_args, Monitor())
+    service.admission.clock = clock
+    return service
+
+
+def test_too_many_requests(clock):
+    service = make_service(clock, client_rate=0.25, client_burst=1)
+    # not a place, so answered without the monitor
+    assert service.handle("/?observation=nowhere", {}, CLIENT).code == 400
+    response = service.handle("/?observation=nowhere", {}, CLIENT)
+    assert response.code == 429
+    assert ("Retry-After", "4") in response.headers
+    assert json.loads(response.body)["reason"] == "too many requests, slow down"
+    # watched however busy
+    assert service.handle("/metrics", {}, CLIENT).code == 200
+    clock.advance(4)
+    assert service.handle("/?observation=nowhere", {}, CLIENT).code == 400
+
+
+def test_refuse_busy(clock):
+    response = make_service(clock).refuse_busy()
+    assert response.code == 503
+    assert ("Retry-After", str(BUSY_RETRY)) in response.headers
+
+
+# =============================================================================
+
+
+class RefusingServer(object):
+    """
+    the parts of PooledHTTPServer a Refuser hands connections back to
+    """
+    def __init__(self, clock):
+        self.service = make_service(clock, max_inflight=1)
+        self.submitted = []
+        self.refused = []
+        self.settled = Event()
+        return
+
+    def submit(self, request, client_address):
+        self.submitted.append(client_address)
+        self.settled.set()
+        request.close()
+        return
+
+    def refuse(self, request):
+        self.refused.append(request)
+        self.settled.set()
+        request.close()
+        return
+
+
+@pytest.fixture
+def refuser(clock):
+    refuser = Refuser(RefusingServer(clock))
+    refuser.start()
+    yield refuser
+    refuser.close()
+    refuser.join()
+
+
+@pytest.mark.parametrize("request_line, exempt", [(b"GET /?observation=IDV60901 HTTP/1.1\r\n", False),
+                                                  (b"GET /metrics HTTP/1.1\r\n", True),
+                                                  (b"", False)])
+def test_refuser(refuser, request_line, exempt):
+    request, client = socket.socketpair()
+    client.sendall(request_line)
+    assert refuser.add(request, (CLIENT, 0))
+    # a client that sends nothing is refused once REFUSE_TIMEOUT is up
+    assert refuser.server.settled.wait(servers.REFUSE_TIMEOUT * 4)
+    assert refuser.server.submitted == ([(CLIENT, 0)] if exempt else [])
+    assert len(refuser.server.refused) == (0 if exempt else 1)
+    assert refuser.server.service.admission.queued == (1 if exempt else 0)
+    assert refuser.waiting == 0
+    client.close()
+
+
+def test_refuser_backlog(clock, monkeypatch):
+    monkeypatch.setattr(servers, "REFUSE_BACKLOG", 1)
+    refuser = Refuser(RefusingServer(clock))
+    connections = [socket.socketpair() for _ in range(2)]
+    assert refuser.add(connections[0][0], (CLIENT, 0))
+    # closed by the listening thread instead
+    assert not refuser.add(connections[1][0], (CLIENT, 1))
+    for pair in connections:
+        for end in pair:
+            end.close()
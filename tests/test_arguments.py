@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+command line counts and durations out of range are refused up front, rather than failing once serving
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.main import arg_parser
+
+# =============================================================================
+
+
+REQUIRED = ["-l", "127.0.0.1", "-p", "10124"]
+POSITIVE = ["--processes", "--workers", "--max-streams", "--keepalive", "--fetch-workers", "--observation-interval",
+            "--forecast-interval", "--max-refresh", "--demand-window", "--breaker-threshold", "--breaker-reset",
+            "--max-places", "--place-ttl", "--snapshot-interval"]
+NON_NEGATIVE = ["--max-inflight", "--client-rate", "--client-places", "--history-length", "--prewarm-timeout"]
+
+
+# =============================================================================
+
+
+def parse(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["BOMWeatherServer"] + REQUIRED + list(args))
+    return arg_parser()
+
+
+@pytest.mark.parametrize("flag", POSITIVE)
+@pytest.mark.parametrize("value", ["0", "-1", "nan", "inf", "x"])
+def test_positive_refused(monkeypatch, flag, value):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, f"{flag}={value}")
+
+
+@pytest.mark.parametrize("flag", NON_NEGATIVE)
+@pytest.mark.parametrize("value", ["-1", "nan", "x"])
+def test_non_negative_refused(monkeypatch, flag, value):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, f"{flag}={value}")
+
+
+@pytest.mark.parametrize("flag", NON_NEGATIVE)
+def test_zero_turns_off(monkeypatch, flag):
+    args = parse(monkeypatch, f"{flag}=0")
+    assert getattr(args, flag[2:].replace("-", "_")) == 0
+
+
+def test_defaults(monkeypatch):
+    args = parse(monkeypatch)
+    assert args.observation_interval > 0 and args.workers >= 1 and args.max_inflight >= 0
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+suspending fetches from a failing upstream, backing off failing places, and serving what was last fetched meanwhile
+"""
+
+from argparse import Namespace
+import os
+import random
+import sys
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.bom_weather_server import WeatherService
+from BOMWeatherServer.circuit_breaker import CircuitBreaker
+from BOMWeatherServer.refresh import backoff_refresh
+from fake_clock import FakeClock
+from monitors import MONITOR_ARGS, OBSERVATION_INTERVAL, make_monitor
+
+# =============================================================================
+
+
+THRESHOLD = 3
+RESET = 60.0
+PAIR = ("IDV60901", "IDV10450")
+WEATHER_PATH = f"/?observation={PAIR[0]}&forecast={PAIR[1]}"
+MAX_REFRESH = MONITOR_ARGS["max_refresh"]
+
+
+# =============================================================================
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", THRESHOLD, RESET, clock=clock)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        assert breaker.allow()
+        breaker.record_failure()
+    return
+
+
+def test_closed_below_threshold(breaker, clock):
+    fail(breaker, THRESHOLD - 1)
+    assert not breaker.is_open()
+    assert breaker.retry_time() == clock.now
+    # a success in between starts the count again
+    breaker.record_success()
+    fail(breaker, THRESHOLD - 1)
+    assert not breaker.is_open()
+
+
+def test_opens_at_threshold(breaker, clock):
+    fail(breaker, THRESHOLD)
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.retry_time() == clock.now + RESET
+    clock.advance(RESET - 1)
+    assert not breaker.allow()
+
+
+def test_half_open_trial_fails(breaker, clock):
+    fail(breaker, THRESHOLD)
+    clock.advance(RESET)
+    # one trial fetch, and no other while it's under way
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.retry_time() == clock.now + RESET
+    breaker.record_failure()
+    # suspended for another reset timeout from the trial's failure
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.retry_time() == clock.now + RESET
+    clock.advance(RESET)
+    assert breaker.allow()
+
+
+def test_half_open_trial_succeeds(breaker, clock):
+    fail(breaker, THRESHOLD)
+    clock.advance(RESET)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open()
+    assert breaker.allow() and breaker.allow()
+    # closed again, so takes the full threshold to open
+    fail(breaker, THRESHOLD - 1)
+    assert not breaker.is_open()
+
+
+# =============================================================================
+
+
+@pytest.mark.parametrize("failures", range(1, 12))
+def test_backoff_grows(failures):
+    random.seed(failures)
+    interval, max_refresh, time_now = 10.0, 1800.0, 1000.0
+    wait = min(max_refresh, interval * 2 ** (failures - 1))
+    for _ in range(20):
+        # jittered over the second half of the wait
+        assert time_now + wait / 2 <= backoff_refresh(failures, interval, max_refresh, time_now) <= time_now + wait
+
+
+def test_backoff_capped():
+    assert backoff_refresh(10 ** 6, 10.0, 1800.0, 0.0) <= 1800.0
+
+
+# =============================================================================
+
+
+@pytest.fixture
+def monitor(clock):
+    monitor = make_monitor(breaker_threshold=THRESHOLD, breaker_reset=RESET)
+    monitor.breakers["observation"] = CircuitBreaker("observation", THRESHOLD, RESET, clock=clock)
+    # fetched a minute ago, before the BoM went down
+    monitor.restore_snapshot(dict(
+        observation={PAIR[0]: dict(observation=dict(temp_now=20.5), validators={}, fetched=time.time() - 60)},
+        forecast={PAIR[1]: dict(forecast=[dict(temp_max=25.0)], fetched=time.time() - 60)},
+        forecast_to_observation={PAIR[1]: PAIR[0]}))
+    downloads = []
+
+    def download(url, headers):
+        downloads.append(url)
+        raise requests.ConnectionError("BoM is down")
+
+    monitor._download = download
+    monitor.downloads = downloads
+    yield monitor
+    monitor.stop()
+
+
+def test_failing_fetches_back_off_then_suspend(monitor):
+    periodic = monitor.observation[PAIR[0]].periodic
+    waits = []
+    for _ in range(THRESHOLD):
+        time_now = time.time()
+        monitor.get_observation(PAIR[0])
+        waits.append(periodic.due_time() - time_now)
+    assert len(monitor.downloads) == THRESHOLD
+    # a server fault backs off as a first failure, leaving the breaker to suspend the server
+    assert all(OBSERVATION_INTERVAL / 2 <= wait <= OBSERVATION_INTERVAL + 1 for wait in waits)
+    assert monitor.breakers["observation"].is_open()
+    # suspended, so no download is attempted, and the refresh put off until the trial is due
+    monitor.get_observation(PAIR[0])
+    assert len(monitor.downloads) == THRESHOLD
+    assert periodic.due_time() >= monitor.breakers["observation"].retry_time()
+
+
+def test_failing_place_backs_off(monitor):
+    # a place failing on a server that's up doubles its wait with each failure, up to --max-refresh
+    resp = type("NotFound", (), dict(status_code=404, headers={}, __bool__=lambda self: False))()
+    monitor._download = lambda url, headers: (resp, b"")
+    periodic = monitor.observation[PAIR[0]].periodic
+    random.seed(1)
+    for failures in range(1, 6):
+        time_now = time.time()
+        monitor.get_observation(PAIR[0])
+        wait = min(MAX_REFRESH, OBSERVATION_INTERVAL * 2 ** (failures - 1))
+        assert time_now + wait / 2 <= periodic.due_time() <= time.time() + wait
+    assert not monitor.breakers["observation"].is_open()
+
+
+def test_stale_weather_served_with_warning(monitor):
+    service = WeatherService(Namespace(profile=None, max_inflight=0, client_rate=0, client_burst=1, client_places=0,
+                                       max_streams=1), monitor)
+    response = service.handle_weather(WEATHER_PATH, {})
+    headers = dict(response.headers)
+    assert response.code == 200
+    assert 60 <= int(headers["Age"]) <= 62
+    assert "Warning" not in headers
+    monitor.get_observation(PAIR[0])
+    response = service.handle_weather(WEATHER_PATH, {})
+    headers = dict(response.headers)
+    assert response.code == 200
+    assert headers["Warning"] == '111 - "Revalidation Failed"'
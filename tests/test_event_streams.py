@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+event streams release their slot however the client goes away
+"""
+
+from argparse import Namespace
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from BOMWeatherServer.bom_weather_server import MyServerHandler, WeatherService
+
+# =============================================================================
+
+
+MAX_STREAMS = 2
+QUERY = "pair=IDV60901:IDV10450"
+
+
+# =============================================================================
+
+
+class Monitor(object):
+    def __init__(self):
+        self.eviction_listeners = []
+        return
+
+
+class GoneClient(object):
+    # the write end of a connection the client has already closed
+    def write(self, data):
+        raise BrokenPipeError(32, "Broken pipe")
+
+    def flush(self):
+        return
+
+
+class Connection(object):
+    def settimeout(self, timeout):
+        return
+
+
+def make_service():
+    my_args = Namespace(profile=None, max_inflight=0, client_rate=0, client_burst=1, client_places=0,
+                        max_streams=MAX_STREAMS)
+    return WeatherService(my_args, Monitor())
+
+
+def make_handler(service):
+    # not constructed, as that would serve a connection
+    handler = MyServerHandler.__new__(MyServerHandler)
+    handler.service = service
+    handler.command = "GET"
+    handler.request_version = "HTTP/1.1"
+    handler.requestline = f"GET /events?{QUERY} HTTP/1.1"
+    handler.client_address = ("127.0.0.1", 0)
+    handler.wfile = GoneClient()
+    handler.connection = Connection()
+    handler.log_message = lambda *args: None
+    return handler
+
+
+# =============================================================================
+
+
+def test_stream_closed_when_headers_fail():
+    service = make_service()
+    for _ in range(MAX_STREAMS + 1):
+        response = service.handle_events(QUERY)
+        assert response.code == 200
+        make_handler(service).send_weather_response(response)
+        assert response.stream.closed
+        assert service.streams == 0
+
+
+def test_streams_limited():
+    service = make_service()
+    responses = [service.handle_events(QUERY) for _ in range(MAX_STREAMS + 1)]
+    assert [response.code for response in responses] == [200] * MAX_STREAMS + [503]
+    for response in responses[:MAX_STREAMS]:
+        response.stream.close()
+    assert service.handle_events(QUERY).code == 200
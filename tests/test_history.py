@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+the ring of observation records kept per place, its merging, series and buckets
+"""
+
+from datetime import datetime, timezone
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.history import HISTORY_FIELDS, ObservationHistory
+from BOMWeatherServer.weather_pending import WeatherPending
+from monitors import make_monitor
+
+# =============================================================================
+
+
+BASE = datetime(2023, 3, 13, tzinfo=timezone.utc).timestamp()
+CADENCE = 600               # seconds between records
+CAPACITY = 5
+
+
+# =============================================================================
+
+
+def record_at(number, **fields):
+    """
+    :param number: the record's number, its time being that many cadences after BASE
+    :return: an observation record, air_temp being its number unless given
+    """
+    aifstime = datetime.fromtimestamp(BASE + number * CADENCE, timezone.utc).strftime("%Y%m%d%H%M%S")
+    return dict(dict(aifstime_utc=aifstime, air_temp=float(number)), **fields)
+
+
+def records(first, last):
+    # as the BoM serves them, newest first
+    return [record_at(number) for number in range(last, first - 1, -1)]
+
+
+def times(first, last):
+    return [BASE + number * CADENCE for number in range(first, last + 1)]
+
+
+# =============================================================================
+
+
+def test_merge():
+    history = ObservationHistory(CAPACITY)
+    assert history.merge([record_at(2, press="1013.5", rain_trace="-"), record_at(1, air_temp=None)]) == 2
+    series = history.series()
+    assert series["timestamp"] == times(1, 2)
+    assert series["air_temp"] == [None, 2.0]
+    assert series["press"] == [None, 1013.5]
+    assert series["rain_trace"] == [None, None]
+    assert set(series) == {"timestamp", *HISTORY_FIELDS}
+
+
+def test_merge_without_times():
+    history = ObservationHistory(CAPACITY)
+    assert history.merge([record_at(2), dict(air_temp=1.0), record_at(1, aifstime_utc="garbled")]) == 1
+    assert history.series()["timestamp"] == times(2, 2)
+
+
+def test_wraps_around():
+    history = ObservationHistory(CAPACITY)
+    history.merge(records(1, 3))
+    for last in range(4, 4 + 2 * CAPACITY):
+        assert history.merge(records(1, last)) == 1
+        # the newest CAPACITY, oldest first, wherever the ring starts
+        first = max(1, last - CAPACITY + 1)
+        assert history.series()["timestamp"] == times(first, last)
+        assert history.series()["air_temp"] == [float(number) for number in range(first, last + 1)]
+        assert history.high_water() == BASE + last * CADENCE
+
+
+def test_more_than_capacity_at_once():
+    history = ObservationHistory(CAPACITY)
+    assert history.merge(records(1, 3 * CAPACITY)) == 3 * CAPACITY
+    assert history.series()["timestamp"] == times(2 * CAPACITY + 1, 3 * CAPACITY)
+
+
+def test_remerge_deduplicated():
+    history = ObservationHistory(CAPACITY)
+    history.merge(records(1, 3))
+    assert history.merge(records(1, 3)) == 0
+    assert history.merge(records(2, 3)) == 0
+    # an older record the BoM has since corrected, or re-ordered, is not taken either
+    assert history.merge([record_at(3), record_at(2, air_temp=99.0)]) == 0
+    assert history.merge(records(2, 5)) == 2
+    assert history.series()["timestamp"] == times(1, 5)
+    assert not history.is_newer(record_at(5)) and history.is_newer(record_at(6))
+
+
+def test_merge_series():
+    history = ObservationHistory(CAPACITY)
+    history.merge(records(1, 2))
+    peer = ObservationHistory(CAPACITY)
+    peer.merge(records(1, 4))
+    # as get_observation_state serves it, since the newest record held
+    assert history.merge_series(peer.series(history.high_water())) == 2
+    assert history.merge_series(peer.series()) == 0
+    assert history.series() == peer.series()
+
+
+def test_series_range():
+    history = ObservationHistory(CAPACITY)
+    history.merge(records(1, 7))
+    # held 3..7, starting part way around the ring
+    assert history.series(start=BASE + 4 * CADENCE)["timestamp"] == times(4, 7)
+    assert history.series(end=BASE + 5 * CADENCE)["timestamp"] == times(3, 4)
+    assert history.series(BASE + 4 * CADENCE - 1, BASE + 5 * CADENCE + 1)["timestamp"] == times(4, 5)
+    assert history.series(start=BASE + 8 * CADENCE)["timestamp"] == []
+    assert history.series(BASE + 6 * CADENCE, BASE + 4 * CADENCE)["timestamp"] == []
+    assert set(history.series(fields=["air_temp"])) == {"timestamp", "air_temp"}
+
+
+def test_buckets():
+    history = ObservationHistory(10)
+    history.merge([record_at(7), record_at(6, air_temp=None, rel_hum=60), record_at(5, rel_hum=40), record_at(4),
+                   record_at(3, rel_hum=50), record_at(2), record_at(1)])
+    # half hours, so 3 records each, aligned to the epoch not the first record
+    buckets = history.buckets(1800, fields=["air_temp", "rel_hum"])
+    assert buckets["timestamp"] == [BASE, BASE + 1800, BASE + 3600]
+    assert buckets["count"] == [2, 3, 2]
+    assert buckets["air_temp"] == dict(min=[1.0, 3.0, 7.0], max=[2.0, 5.0, 7.0], mean=[1.5, 4.0, 7.0])
+    # a field only some of a bucket's records have is summarised over those, and None without any
+    assert buckets["rel_hum"] == dict(min=[None, 40.0, 60.0], max=[None, 50.0, 60.0], mean=[None, 45.0, 60.0])
+
+
+def test_buckets_range():
+    history = ObservationHistory(CAPACITY)
+    history.merge(records(1, 8))
+    # held 4..8, starting part way around the ring
+    buckets = history.buckets(1800, start=BASE + 5 * CADENCE, fields=["air_temp"])
+    assert buckets["timestamp"] == [BASE + 1800, BASE + 3600]
+    assert buckets["count"] == [1, 3]
+    assert buckets["air_temp"]["mean"] == [5.0, 7.0]
+    empty = history.buckets(1800, start=BASE + 9 * CADENCE)
+    assert empty["timestamp"] == [] and empty["air_temp"] == dict(min=[], max=[], mean=[])
+
+
+# =============================================================================
+
+
+class FakeResponse(object):
+    def __init__(self, fetch):
+        self.status_code = 200
+        self.headers = {"ETag": f'"{fetch}"'}
+        return
+
+    def __bool__(self):
+        return True
+
+
+def test_monitor_keeps_history_length():
+    monitor = make_monitor(history_length=CAPACITY)
+    fetches = []
+
+    def download(url, headers):
+        # the BoM's window of the latest 3 records moves on by one between fetches
+        fetches.append(url)
+        data = [dict(record, sort_order=order) for order, record in enumerate(records(len(fetches),
+                                                                                          len(fetches) + 2))]
+        return FakeResponse(len(fetches)), json.dumps(dict(observations=dict(data=data))).encode("utf8")
+
+    monitor._download = download
+    try:
+        with pytest.raises(WeatherPending):
+            monitor.get_history("IDV60901")
+        for fetch in range(1, 2 * CAPACITY):
+            monitor.get_observation("IDV60901")
+            first = max(1, fetch + 3 - CAPACITY)
+            assert monitor.get_history("IDV60901")["timestamp"] == times(first, fetch + 2)
+        assert monitor.get_history("IDV60901", bucket=3600, fields=["air_temp"])["count"] == [5]
+    finally:
+        monitor.stop()
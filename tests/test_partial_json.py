@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+decoding the leading records of a product, scanning over the members ahead of them
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.partial_json import leading_records
+
+# =============================================================================
+
+
+PATH = ("observations", "data")
+# members ahead of the data holding everything a scan could trip over - brackets and quotes in strings, escapes,
+# nesting, and every kind of scalar
+PRODUCT = {"observations": {
+    "notice": [{"copyright": "Copyright \"BoM\" [2023] {all rights}", "path": "C:\\bom\\", "uri": "]}"}],
+    "header": [{"refresh_message": "Issued at 3:30 pm", "ID": None, "main": True, "sort": False, "count": 144,
+                "lat": -37.8, "exp": 1.5e-3, "nested": [[{}], [[]], {"a": {"b": ["]"]}}], "unicode": "caf\u00e9"}],
+    "data": [{"sort_order": index, "name": "Melbourne", "air_temp": 20.5 - index} for index in range(5)]}}
+
+
+# =============================================================================
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_leading_records(indent):
+    text = json.dumps(PRODUCT, indent=indent)
+    records, num_wanted = leading_records(text, PATH, lambda record: record["sort_order"] < 2, minimum=3)
+    assert records == PRODUCT["observations"]["data"][:3]
+    assert num_wanted == 2
+    records, num_wanted = leading_records(text, PATH, lambda record: True)
+    assert records == PRODUCT["observations"]["data"]
+    assert num_wanted == len(records)
+
+
+def test_missing_member():
+    with pytest.raises(KeyError):
+        leading_records(json.dumps(PRODUCT), ("observations", "forecast"), lambda record: True)
+
+
+def test_unterminated():
+    text = json.dumps(PRODUCT)
+    with pytest.raises(ValueError):
+        leading_records(text[:text.index("\"data\"") - 20], PATH, lambda record: True)
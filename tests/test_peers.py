@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+sharing fetches between nodes - who owns each place, and falling back to the BoM when the owner is down
+"""
+
+from collections import Counter
+import json
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.circuit_breaker import CircuitBreaker
+from BOMWeatherServer.peers import RING_HEADER, HashRing, PeerUnavailable, Peers
+from fake_clock import FakeClock
+from monitors import make_monitor
+
+# =============================================================================
+
+
+NODES = ["http://node-a:8080", "http://node-b:8080", "http://node-c:8080"]
+THIS_NODE, PEER = NODES[0], NODES[1]
+PLACES = [f"ID{state}{number:05d}" for state in "VNQSTWD" for number in range(60800, 60950)]
+THRESHOLD = 2
+RESET = 60.0
+
+
+# =============================================================================
+
+
+def owned(ring, node):
+    return [place for place in PLACES if ring.owner(place) == node]
+
+
+def test_ring_agrees():
+    # every node builds the same ring, whatever order it's given the nodes in
+    ring = HashRing(NODES)
+    other = HashRing(list(reversed(NODES)))
+    assert [ring.owner(place) for place in PLACES] == [other.owner(place) for place in PLACES]
+    assert ring.fingerprint == other.fingerprint
+    assert ring.fingerprint != HashRing(NODES[:2]).fingerprint
+
+
+def test_ring_balanced():
+    shares = Counter(HashRing(NODES).owner(place) for place in PLACES)
+    assert set(shares) == set(NODES)
+    assert all(share > len(PLACES) / len(NODES) / 2 for share in shares.values())
+
+
+def test_ring_stable():
+    ring = HashRing(NODES)
+    new_node = "http://node-d:8080"
+    grown = HashRing(NODES + [new_node])
+    # only places the new node takes move
+    moved = [place for place in PLACES if grown.owner(place) != ring.owner(place)]
+    assert moved and all(grown.owner(place) == new_node for place in moved)
+    # and only the removed node's places move when one goes
+    shrunk = HashRing(NODES[1:])
+    moved = [place for place in PLACES if shrunk.owner(place) != ring.owner(place)]
+    assert sorted(moved) == sorted(owned(ring, NODES[0]))
+
+
+def test_owner_is_self():
+    peers = Peers(NODES, THIS_NODE, THRESHOLD, RESET)
+    assert THIS_NODE not in peers.breakers
+    for place in PLACES:
+        owner = peers.ring.owner(place)
+        assert peers.owner(place) == (None if owner == THIS_NODE else owner)
+    assert Peers([THIS_NODE], THIS_NODE, THRESHOLD, RESET).owner(PLACES[0]) is None
+
+
+# =============================================================================
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(body) if body is not None else ""
+        return
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession(object):
+    """
+    a peer answering every request with the same response, or exception
+    """
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+        return
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append((url, headers))
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def peers(clock):
+    peers = Peers(NODES, THIS_NODE, THRESHOLD, RESET)
+    peers.breakers[PEER] = CircuitBreaker(f"peer {PEER}", THRESHOLD, RESET, clock=clock)
+    return peers
+
+
+def test_fetch(peers):
+    session = FakeSession(FakeResponse(200, {"temp_now": 21.5}, {"ETag": '"v2"', "Age": "30", "X-Peer-Refresh": "90"}))
+    reply = peers.fetch(session, PEER, "observation", "IDV60901", etag='"v1"', since=1678680000.0)
+    assert (reply.status, reply.state, reply.etag, reply.age, reply.refresh) == (200, {"temp_now": 21.5}, '"v2"',
+                                                                                30.0, 90.0)
+    url, headers = session.requests[0]
+    assert url == f"{PEER}/peer?observation=IDV60901&since=1678680000.0"
+    assert headers == {RING_HEADER: peers.ring.fingerprint, "If-None-Match": '"v1"'}
+    session.reply = FakeResponse(304, headers={"ETag": '"v2"'})
+    assert peers.fetch(session, PEER, "observation", "IDV60901", etag='"v2"').status == 304
+    session.reply = FakeResponse(451, headers={"Retry-After": "3"})
+    reply = peers.fetch(session, PEER, "forecast", "IDV10450")
+    assert (reply.status, reply.refresh) == (451, 3.0)
+
+
+@pytest.mark.parametrize("reply", [requests.ConnectionError("refused"), requests.Timeout("too slow"),
+                                   FakeResponse(409, {"error": "ring mismatch"}), FakeResponse(200, None)])
+def test_peer_down(peers, clock, reply):
+    session = FakeSession(reply)
+    for _ in range(THRESHOLD):
+        with pytest.raises(PeerUnavailable):
+            peers.fetch(session, PEER, "observation", "IDV60901")
+    # left alone until the reset timeout, then tried again
+    assert peers.fetch(session, PEER, "observation", "IDV60901") is None
+    assert len(session.requests) == THRESHOLD
+    clock.advance(RESET)
+    session.reply = FakeResponse(200, {"temp_now": 21.5})
+    assert peers.fetch(session, PEER, "observation", "IDV60901").status == 200
+
+
+# =============================================================================
+
+
+class BoMResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __bool__(self):
+        return True
+
+
+def observation_product(air_temp):
+    data = [dict(sort_order=0, aifstime_utc="20230313033000", air_temp=air_temp),
+            dict(sort_order=1, aifstime_utc="20230313030000", air_temp=air_temp)]
+    return json.dumps(dict(observations=dict(data=data))).encode("utf8")
+
+
+@pytest.fixture
+def monitor():
+    monitor = make_monitor(peers=NODES, node=THIS_NODE, breaker_threshold=THRESHOLD)
+    downloads = []
+
+    def download(url, headers):
+        downloads.append(url)
+        return BoMResponse(), observation_product(20.5)
+
+    monitor._download = download
+    monitor.downloads = downloads
+    yield monitor
+    monitor.stop()
+
+
+def temp_now(monitor, observation_place):
+    return monitor.observation[observation_place].published[1].temp_now
+
+
+def test_owned_fetched_from_bom(monitor):
+    session = FakeSession(requests.ConnectionError("no peer should be asked"))
+    monitor._session = lambda: session
+    place = owned(monitor.peers.ring, THIS_NODE)[0]
+    monitor.prewarm([(place, "IDV10450")])
+    monitor.get_observation(place)
+    assert not session.requests
+    assert len(monitor.downloads) == 1
+    assert temp_now(monitor, place) == 20.5
+
+
+def test_peer_owned_fetched_from_peer(monitor):
+    session = FakeSession(FakeResponse(200, {"temp_now": 19.0}, {"ETag": '"v1"', "X-Peer-Refresh": "60"}))
+    monitor._session = lambda: session
+    place = owned(monitor.peers.ring, PEER)[0]
+    monitor.prewarm([(place, "IDV10450")])
+    monitor.get_observation(place)
+    assert len(session.requests) == 1 and session.requests[0][0].startswith(PEER)
+    assert not monitor.downloads
+    assert temp_now(monitor, place) == 19.0
+
+
+def test_peer_down_falls_back_to_bom(monitor):
+    session = FakeSession(requests.ConnectionError("peer down"))
+    monitor._session = lambda: session
+    places = owned(monitor.peers.ring, PEER)[:THRESHOLD + 2]
+    monitor.prewarm([(place, "IDV10450") for place in places])
+    for place in places:
+        monitor.get_observation(place)
+        assert temp_now(monitor, place) == 20.5
+    # every place fetched from the BoM, and the peer left alone once its breaker opened
+    assert len(monitor.downloads) == len(places)
+    assert len(session.requests) == THRESHOLD
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+lock free reads of published weather, by many readers while fetches keep publishing new weather
+"""
+
+from threading import Event, Thread
+import itertools
+import json
+
+from monitors import make_monitor
+
+# =============================================================================
+
+
+READERS = 16
+DURATION = 2.0          # seconds the readers read for
+PERIODS = 7             # forecast periods per area
+AREAS = ["VIC_PT042", "VIC_PT043", "NSW_PT131"]
+# areas of a product shared between pairs, and a product's default area
+PAIRS = [("IDV60901", "IDV10450/VIC_PT042"), ("IDV60801", "IDV10450/VIC_PT043"), ("IDN60901", "IDN11060/NSW_PT131"),
+         ("IDN60801", "IDN11060")]
+OBSERVATION_PLACES = [observation_place for observation_place, _ in PAIRS]
+PRODUCTS = ["IDV10450", "IDN11060"]
+
+
+# =============================================================================
+
+
+class FakeResponse(object):
+    def __init__(self, fetch):
+        self.status_code = 200
+        self.headers = {"ETag": f'"{fetch}"'}
+        return
+
+    def __bool__(self):
+        return True
+
+
+def observation_product(fetch):
+    # the newest record's temperature counts the fetches, so every fetch changes the weather
+    data = [dict(sort_order=index, aifstime_utc=f"20230313{3 - index:02d}3000", air_temp=float(fetch))
+            for index in range(2)]
+    return json.dumps(dict(observations=dict(header=[dict(ID="IDV60901.95936")], data=data))).encode("utf8")
+
+
+def forecast_product(product, fetch):
+    """
+    :return: a product whose every temperature is the fetch count plus its period's index, so a torn or mismatched
+    forecast shows
+    """
+    lines = ['<?xml version="1.0"?>', "<product>",
+             f"<amoc><identifier>{product}</identifier>"
+             "<next-routine-issue-time-utc>2023-03-13T06:10:00Z</next-routine-issue-time-utc></amoc>", "<forecast>",
+             '<area aac="VIC_FA001" description="State" type="region"/>',
+             '<area aac="VIC_ME001" description="Metropolitan" type="metropolitan"/>']
+    for area in AREAS:
+        lines.append(f'<area aac="{area}" description="Town {area}" type="location">')
+        for period in range(PERIODS):
+            lines.append(f'<forecast-period index="{period}" start-time-local="2023-03-{13 + period}T00:00:00+11:00">'
+                         f'<element type="forecast_icon_code">1</element>'
+                         f'<element type="air_temperature_minimum">{fetch + period}</element>'
+                         f'<element type="air_temperature_maximum">{fetch + period}</element>'
+                         "</forecast-period>")
+        lines.append("</area>")
+    lines.extend(["</forecast>", "</product>"])
+    return "\n".join(lines).encode("utf8")
+
+
+def stub_fetches(monitor):
+    """
+    stand in for the BoM, with a new product on every fetch
+    """
+    fetches = itertools.count(1)
+
+    def download(url, headers):
+        fetch = next(fetches)
+        return FakeResponse(fetch), observation_product(fetch)
+
+    def fetch_if_changed(path, stamp=None):
+        fetch = next(fetches)
+        product = path.rsplit("/", 1)[-1].split(".")[0]
+        return (fetch, fetch), forecast_product(product, fetch)
+
+    monitor._download = download
+    monitor.ftp_pool.fetch_if_changed = fetch_if_changed
+    return
+
+
+def record_published(monitor):
+    """
+    :return: {version:data published at that version}, kept up to date as weather is published
+    """
+    published = {}
+    publish = monitor._publish
+
+    def record(place_info, data):
+        # NOTE: called with weather_lock held, so the version is the next one
+        # recorded ahead of publishing, so it's in place for any reader seeing the version
+        published[monitor.last_version + 1] = data
+        publish(place_info, data)
+        return
+
+    monitor._publish = record
+    return published
+
+
+# =============================================================================
+
+
+def test_reads_consistent_while_fetched():
+    monitor = make_monitor()
+    stub_fetches(monitor)
+    published = record_published(monitor)
+    monitor.prewarm(PAIRS)
+    for observation_place in OBSERVATION_PLACES:
+        monitor.get_observation(observation_place)
+    for product in PRODUCTS:
+        monitor.get_forecast(product)
+    stop = Event()
+    errors = []
+    reads = [0] * READERS
+    versions_seen = [set() for _ in range(READERS)]
+
+    def fetch(task, places):
+        while not stop.is_set():
+            for place in places:
+                task(place)
+        return
+
+    def read(number):
+        last_versions = {}
+        try:
+            while not stop.is_set():
+                for pair in PAIRS:
+                    versions, results = monitor.get_weather_versioned(*pair)
+                    observation_version, forecast_version = versions
+                    # exactly the weather published at those versions
+                    assert results["observation"] == published[observation_version].as_dict()
+                    assert results["forecast"] == published[forecast_version].as_list()
+                    # from a single fetch of the product
+                    fetch_number = results["forecast"][0]["temp_max"]
+                    assert [(period["temp_min"], period["temp_max"]) for period in results["forecast"]] == \
+                        [(fetch_number + period, fetch_number + period) for period in range(PERIODS)]
+                    # never older than a version already seen
+                    assert versions >= last_versions.get(pair, (0, 0))
+                    last_versions[pair] = versions
+                    versions_seen[number].add(versions)
+                    reads[number] += 1
+        except AssertionError as ex:
+            errors.append(ex)
+            stop.set()
+        return
+
+    threads = [Thread(target=fetch, args=(monitor.get_observation, OBSERVATION_PLACES)),
+               Thread(target=fetch, args=(monitor.get_forecast, PRODUCTS))] + \
+        [Thread(target=read, args=(number,)) for number in range(READERS)]
+    try:
+        for thread in threads:
+            thread.start()
+        stop.wait(DURATION)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        monitor.stop()
+    assert not errors, errors[0]
+    assert all(reads)
+    # the readers saw the weather change under them, not just one version of it
+    assert all(len(versions) > len(PAIRS) for versions in versions_seen)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+refresh lag of the scheduler, for a handful of places vs hundreds
+"""
+
+from threading import Thread
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "BOMWeatherServer")))
+
+from periodic import Periodic
+from scheduler import Scheduler
+
+# =============================================================================
+
+
+PERIOD = 1.0            # seconds between each place's refreshes
+DURATION = 3.0          # seconds each run lasts
+WORKERS = 8             # as the monitor's fetch pool
+TASK_SLEEP = 0.005      # seconds each refresh waits, as on the network
+MAX_P99_LAG = 0.050     # seconds a refresh may start late, at the 99th percentile
+MAX_LAG_GROWTH = 0.025  # seconds the 99th percentile may grow by, from a few places to hundreds
+
+# a product the size of a small observation, parsed by each refresh
+PRODUCT = json.dumps({"observations": {"data": [{"sort_order": index, "name": "Melbourne", "air_temp": index * 0.5}
+                                                for index in range(60)]}})
+
+
+# =============================================================================
+
+
+def refresh_lags(places):
+    """
+    schedule places spread over a period, as the monitor does, and measure how late each refresh starts
+
+    :param places: number of places refreshed
+    :return: (sorted lags in seconds, number of refreshes expected)
+    """
+    scheduler = Scheduler(WORKERS)
+    periodics = []
+    lags = []
+
+    def refresh(index):
+        periodic = periodics[index]
+        lags.append(time.time() - (periodic.start_time + periodic.num_periods * PERIOD))
+        json.loads(PRODUCT)
+        time.sleep(TASK_SLEEP)
+        return
+
+    start_time = time.time() + 0.2
+    for index in range(places):
+        periodic = Periodic(PERIOD, refresh, f"place{index}", start_time=start_time + PERIOD * index / places)
+        periodics.append(periodic)
+        scheduler.add(periodic, index, periodic.start_time)
+    running = [True]
+    thread = Thread(target=scheduler.run, args=(lambda: running[0],))
+    thread.start()
+    time.sleep(DURATION)
+    running[0] = False
+    scheduler.stop()
+    thread.join()
+    return sorted(lags), int(places * (DURATION - 0.2) / PERIOD)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# =============================================================================
+
+
+@pytest.fixture(scope="module")
+def lags():
+    return {places: refresh_lags(places) for places in (10, 500)}
+
+
+@pytest.mark.parametrize("places", [10, 500])
+def test_refreshes_keep_up(lags, places):
+    refreshes, expected = lags[places]
+    assert len(refreshes) >= expected * 0.9
+    assert percentile(refreshes, 0.99) < MAX_P99_LAG
+
+
+def test_lag_flat_with_places(lags):
+    few, _ = lags[10]
+    many, _ = lags[500]
+    assert percentile(many, 0.99) - percentile(few, 0.99) < MAX_LAG_GROWTH
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+weather published to prefork workers through shared memory, written and read in one process
+"""
+
+from queue import Queue
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer import metrics
+from BOMWeatherServer.forecast_parser import AreaNotFound
+from BOMWeatherServer.shared_cache import PAIR_SIZE, SharedWeatherReader, SharedWeatherWriter, shared_cache_size
+from BOMWeatherServer.weather_pending import WeatherPending
+
+# =============================================================================
+
+
+PAIR = ("IDV60901", "IDV10450/VIC_PT042")
+OTHER_PAIR = ("IDN60901", "IDN11060")
+NO_AREA_PAIR = ("IDV60801", "IDV10450/NOWHERE")
+
+
+# =============================================================================
+
+
+class Globals(object):
+    def __init__(self):
+        self.running = True
+        return
+
+
+@pytest.fixture
+def shared():
+    """
+    :return: (writer, reader, demand queue) sharing a cache sized for 4 pairs
+    """
+    writer = SharedWeatherWriter(shared_cache_size(4))
+    demand_queue = Queue()
+    my_globals = Globals()
+    reader = SharedWeatherReader(writer.shm, demand_queue, my_globals)
+    yield writer, reader, demand_queue
+    my_globals.running = False
+    writer.close()
+
+
+def body(version):
+    return f'{{"observation": {{"temp_now": {version}}}, "forecast": []}}'.encode("utf8")
+
+
+# =============================================================================
+
+
+def test_round_trip(shared):
+    writer, reader, _ = shared
+    assert writer.publish({PAIR: ((1, 2), body(1)), OTHER_PAIR: ((3, 4), body(3)), NO_AREA_PAIR: (None, None)})
+    assert reader.get(PAIR) == ((1, 2), body(1))
+    assert reader.get(OTHER_PAIR) == ((3, 4), body(3))
+    # already held
+    assert reader.get(PAIR, known_version=(1, 2)) == ((1, 2), None)
+    with pytest.raises(AreaNotFound):
+        reader.get(NO_AREA_PAIR)
+    assert reader.has_weather(*NO_AREA_PAIR)
+
+
+def test_republished(shared):
+    # each publish writes the other slot, so publish three times to reuse one
+    writer, reader, _ = shared
+    for version in range(1, 4):
+        assert writer.publish({PAIR: ((version, version), body(version))})
+        assert reader.get(PAIR) == ((version, version), body(version))
+
+
+def test_unpublished(shared):
+    writer, reader, demand_queue = shared
+    evicted = []
+    reader.eviction_listeners.append(lambda kind, place: evicted.append((kind, place)))
+    with pytest.raises(WeatherPending):
+        reader.get(PAIR)
+    # reported to the fetcher straight away, as a new pair
+    assert demand_queue.get_nowait() == [PAIR]
+    writer.publish({PAIR: ((1, 1), body(1)), OTHER_PAIR: ((1, 1), body(1))})
+    reader.get(PAIR)
+    writer.publish({OTHER_PAIR: ((1, 1), body(1))})
+    with pytest.raises(WeatherPending):
+        reader.get(PAIR)
+    assert evicted == [("forecast", PAIR[1])]
+
+
+def test_overflow(shared):
+    writer, reader, _ = shared
+    assert writer.publish({PAIR: ((1, 1), body(1))})
+    # one body as big as all four pairs' room
+    assert not writer.publish({PAIR: ((2, 2), b"x" * 4 * PAIR_SIZE)})
+    # the weather last published is still served, and the overflow counted where the workers' metrics see it
+    assert reader.get(PAIR) == ((1, 1), body(1))
+    assert reader.overflows() == 1
+    assert b"bom_shared_cache_overflows_total 1\n" in metrics.render()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+restoring the monitor from a snapshot
+"""
+
+import pytest
+
+from monitors import make_monitor
+
+# =============================================================================
+
+
+def snapshot_state(pairs, stale_pairs=()):
+    """
+    :param pairs: (observation place, forecast place) fetched when the snapshot was taken
+    :param stale_pairs: mappings saved for places no longer tracked
+    """
+    return dict(observation={observation_place: dict(observation=dict(temp_now=20.5), validators={}, fetched=1.0)
+                             for observation_place, _ in pairs},
+                forecast={forecast_place: dict(forecast=[dict(temp_max=25.0)], fetched=1.0)
+                          for _, forecast_place in pairs},
+                forecast_to_observation={forecast_place: observation_place
+                                         for observation_place, forecast_place in list(pairs) + list(stale_pairs)})
+
+
+@pytest.fixture
+def monitors():
+    made = []
+
+    def make(**my_args):
+        made.append(make_monitor(**my_args))
+        return made[-1]
+
+    yield make
+    for monitor in made:
+        monitor.stop()
+
+
+# =============================================================================
+
+
+PAIRS = [("IDV60901", "IDV10450"), ("IDN60901", "IDN11060"), ("IDQ60901", "IDQ10095")]
+
+
+def test_restores_pairs(monitors):
+    monitor = monitors()
+    monitor.restore_snapshot(snapshot_state(PAIRS))
+    assert monitor.forecast_to_observation == {forecast_place: observation_place
+                                               for observation_place, forecast_place in PAIRS}
+    versions, results = monitor.get_weather_versioned(*PAIRS[0])
+    assert results["observation"]["temp_now"] == 20.5
+    assert results["forecast"] == [dict(temp_max=25.0)]
+
+
+def test_restores_no_stale_mappings(monitors):
+    monitor = monitors()
+    monitor.restore_snapshot(snapshot_state(PAIRS, stale_pairs=[("IDW60901", "IDW12300")]))
+    assert "IDW12300" not in monitor.forecast_to_observation
+
+
+def test_restores_no_mappings_evicted(monitors):
+    # the places beyond --max-places are evicted as the snapshot is restored, and their mappings with them
+    monitor = monitors(max_places=2)
+    monitor.restore_snapshot(snapshot_state(PAIRS))
+    assert len(monitor.forecast) == 2
+    assert monitor.forecast_to_observation == {forecast_place: observation_place
+                                               for observation_place, forecast_place in PAIRS
+                                               if forecast_place in monitor.forecast and
+                                               observation_place in monitor.observation}
+
+
+def test_snapshot_round_trip(monitors):
+    monitor = monitors()
+    monitor.restore_snapshot(snapshot_state(PAIRS))
+    restored = monitors()
+    restored.restore_snapshot(monitor.take_snapshot())
+    for pair in PAIRS:
+        assert restored.get_weather_versioned(*pair)[1] == monitor.get_weather_versioned(*pair)[1]
+    assert restored.forecast_to_observation == monitor.forecast_to_observation
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+the ISO-8601 fast path of parse_timestamp, against datetime.fromisoformat
+"""
+
+from datetime import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.timestamps import parse_aifstime, parse_timestamp
+
+# =============================================================================
+
+
+VALID = [
+    "2023-03-13T05:00:00+11:00",            # as in forecast products
+    "2023-03-12T18:00:00Z",                 # next-routine-issue-time-utc
+    "2023-03-13T05:00:00+0930",             # no colon in the offset
+    "2023-03-13T05:00:00-03:30",
+    "2023-03-13T05:00:00+00:00",
+    "2023-03-12T18:00:00.5Z",               # fractional seconds, of every length
+    "2023-03-12T18:00:00.123456+10:00",
+    "2023-03-12T18:00:00.1234-09:45",
+    "2023-12-31T23:59:59+14:00",            # crossing into the next year in UTC
+    "2024-02-29T00:00:00Z",                 # leap day
+    "1970-01-01T00:00:00Z",
+]
+INVALID = [
+    "2023-13-01T00:00:00Z",
+    "2023-00-01T00:00:00Z",
+    "2023-02-29T00:00:00Z",                 # not a leap year
+    "2023-04-31T00:00:00+10:00",
+    "2023-03-13T24:00:00Z",
+    "2023-03-13T05:60:00Z",
+    "2023-03-13T05:00:60Z",
+    "2023-03-13T05:00:00+24:00",
+    "not a timestamp",
+    "",
+]
+
+
+# =============================================================================
+
+
+def iso_seconds(timestamp):
+    # fromisoformat only takes Z from Python 3.11
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+@pytest.mark.parametrize("timestamp", VALID)
+def test_matches_fromisoformat(timestamp):
+    assert parse_timestamp(timestamp) == pytest.approx(iso_seconds(timestamp), abs=1E-6)
+
+
+@pytest.mark.parametrize("timestamp", VALID)
+def test_memoised(timestamp):
+    assert parse_timestamp(timestamp) == parse_timestamp.__wrapped__(timestamp)
+
+
+@pytest.mark.parametrize("timestamp", INVALID)
+def test_invalid(timestamp):
+    with pytest.raises(ValueError):
+        iso_seconds(timestamp)
+    with pytest.raises(ValueError):
+        parse_timestamp(timestamp)
+
+
+def test_aifstime():
+    assert parse_aifstime("20230313033000") == iso_seconds("2023-03-13T03:30:00Z")
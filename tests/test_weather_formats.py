@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+the hand-written MessagePack and CBOR encoders, against bytes from their specifications, and Accept negotiation
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from BOMWeatherServer.weather_formats import CBOR, GZIP, JSON, MSGPACK, encode, negotiate_encoding, negotiate_format
+
+# =============================================================================
+
+
+KEYS = "0123456789abcdef"
+# (value, MessagePack hex, CBOR hex), either side of each change of type or length
+ENCODED = [
+    (None, "c0", "f6"),
+    (False, "c2", "f4"),
+    (True, "c3", "f5"),
+    (0, "00", "00"),
+    (23, "17", "17"),
+    (24, "18", "1818"),
+    (127, "7f", "187f"),
+    (128, "cc80", "1880"),
+    (255, "ccff", "18ff"),
+    (256, "cd0100", "190100"),
+    (65535, "cdffff", "19ffff"),
+    (65536, "ce00010000", "1a00010000"),
+    (2 ** 32, "cf0000000100000000", "1b0000000100000000"),
+    (2 ** 64 - 1, "cfffffffffffffffff", "1bffffffffffffffff"),
+    (-1, "ff", "20"),
+    (-24, "e8", "37"),
+    (-25, "e7", "3818"),
+    (-32, "e0", "381f"),
+    (-33, "d0df", "3820"),
+    (-128, "d080", "387f"),
+    (-129, "d1ff7f", "3880"),
+    (-32768, "d18000", "397fff"),
+    (-32769, "d2ffff7fff", "398000"),
+    (-2 ** 31 - 1, "d3ffffffff7fffffff", "3a80000000"),
+    (-2 ** 63, "d38000000000000000", "3b7fffffffffffffff"),
+    # single precision where it holds the value exactly
+    (0.5, "ca3f000000", "fa3f000000"),
+    (-21.25, "cac1aa0000", "fac1aa0000"),
+    (0.1, "cb3fb999999999999a", "fb3fb999999999999a"),
+    ("", "a0", "60"),
+    ("°C", "a3c2b043", "63c2b043"),
+    ("x" * 23, "b7" + "78" * 23, "77" + "78" * 23),
+    ("x" * 24, "b8" + "78" * 24, "7818" + "78" * 24),
+    ("x" * 31, "bf" + "78" * 31, "781f" + "78" * 31),
+    ("x" * 32, "d920" + "78" * 32, "7820" + "78" * 32),
+    ("x" * 255, "d9ff" + "78" * 255, "78ff" + "78" * 255),
+    ("x" * 256, "da0100" + "78" * 256, "790100" + "78" * 256),
+    ([], "90", "80"),
+    ((1, [2, 3]), "9201920203", "8201820203"),
+    ([0] * 15, "9f" + "00" * 15, "8f" + "00" * 15),
+    ([0] * 16, "dc0010" + "00" * 16, "90" + "00" * 16),
+    ([0] * 24, "dc0018" + "00" * 24, "9818" + "00" * 24),
+    ({}, "80", "a0"),
+    ({"a": 1.5}, "81a161ca3fc00000", "a16161fa3fc00000"),
+    ({key: None for key in KEYS[:15]}, "8f" + "".join(f"a1{ord(key):02x}c0" for key in KEYS[:15]),
+     "af" + "".join(f"61{ord(key):02x}f6" for key in KEYS[:15])),
+    ({key: None for key in KEYS}, "de0010" + "".join(f"a1{ord(key):02x}c0" for key in KEYS),
+     "b0" + "".join(f"61{ord(key):02x}f6" for key in KEYS)),
+]
+
+ACCEPT = [
+    (None, JSON),
+    ("", JSON),
+    ("application/json", JSON),
+    ("application/msgpack", MSGPACK),
+    ("application/x-msgpack", MSGPACK),
+    ("application/vnd.msgpack", MSGPACK),
+    ("Application/CBOR", CBOR),
+    ("*/*", JSON),
+    ("application/*", JSON),
+    ("text/html", JSON),                                        # nothing we serve
+    ("text/html, application/cbor", CBOR),
+    ("application/json;q=0.5, application/cbor", CBOR),         # by quality, not order
+    ("application/cbor, application/msgpack", CBOR),            # order, between equal qualities
+    ("application/json;q=0.8, application/msgpack;q=0.9", MSGPACK),
+    ("application/cbor;q=0, application/msgpack;q=0.1", MSGPACK),
+    ("application/cbor;q=0", JSON),                             # refused
+    ("application/cbor;q=0, */*;q=0.1", JSON),
+    ("application/cbor;q=x, application/msgpack;q=0.1", MSGPACK),   # an unreadable quality refuses
+    ("*/*;q=0.1, application/cbor ; q=0.2", CBOR),
+]
+ACCEPT_ENCODING = [
+    (None, None),
+    ("", None),
+    ("gzip", GZIP),
+    ("x-gzip", GZIP),
+    ("GZIP", GZIP),
+    ("br, deflate", None),
+    ("br, gzip;q=0.5", GZIP),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("*", GZIP),
+    ("*;q=0", None),
+    ("gzip;q=0, *", None),                                      # gzip named outright overrides the wildcard
+    ("*;q=0, gzip;q=0.1", GZIP),
+    ("br;q=1.0, gzip;q=0.001", GZIP),
+]
+
+
+# =============================================================================
+
+
+@pytest.mark.parametrize("value, msgpack_hex, cbor_hex", ENCODED)
+def test_msgpack(value, msgpack_hex, cbor_hex):
+    assert encode(value, MSGPACK).hex() == msgpack_hex
+
+
+@pytest.mark.parametrize("value, msgpack_hex, cbor_hex", ENCODED)
+def test_cbor(value, msgpack_hex, cbor_hex):
+    assert encode(value, CBOR).hex() == cbor_hex
+
+
+@pytest.mark.parametrize("media_type", [MSGPACK, CBOR])
+def test_unencodable(media_type):
+    with pytest.raises(TypeError):
+        encode({"timestamp": b"bytes"}, media_type)
+
+
+def test_msgpack_too_big():
+    with pytest.raises(OverflowError):
+        encode(2 ** 64, MSGPACK)
+
+
+@pytest.mark.parametrize("accept, media_type", ACCEPT)
+def test_negotiate_format(accept, media_type):
+    assert negotiate_format(accept) == media_type
+
+
+@pytest.mark.parametrize("accept_encoding, coding", ACCEPT_ENCODING)
+def test_negotiate_encoding(accept_encoding, coding):
+    assert negotiate_encoding(accept_encoding) == coding